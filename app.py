@@ -1,82 +1,215 @@
 import os
+import threading
+import time
 import streamlit as st
 import pandas as pd
-import numpy as np
 import cv2
-from config_run_model import load_ocr_model
-from extract_information_card import ocr_card
-from extract_information_rg import extract_rg_novo, extract_rg_antigo
-from extract_information_cnh import extract_cnh
+from config_run_model import load_ocr_model, warmup_ocr_model
+from document_types import DEFAULT_FOLDERS, process_batch
+from rg_pairing import pair_rg_files, pairing_messages
+from auxiliary_functions import DISPLAY_SIDE, draw_word_boxes, read_image, resize_max_side
 from PIL import Image
 
+# Nome de cada tipo de documento na página
+DOCUMENT_LABELS = {
+    "cartao": "Cartão SUS",
+    "cnh": "CNH",
+    "rg_novo": "RG novo (frente e verso)",
+    "rg_antigo": "RG antigo",
+}
+
+# Formatos aceitos no envio de imagens
+UPLOAD_TYPES = ["jpg", "jpeg", "png", "bmp", "tif", "tiff", "webp"]
+
+
+@st.cache_resource(show_spinner="Carregando e aquecendo o modelo OCR...")
+def get_ocr_model():
+    # O modelo é carregado uma única vez por processo e compartilhado entre execuções e sessões
+    model = load_ocr_model()
+    warmup_ocr_model(model)
+    return model
+
+
+@st.cache_resource
+def get_model_lock():
+    # Um processamento por vez no modelo compartilhado: as sessões rodam em threads próprias, e o modelo e os
+    # contadores dos módulos (deskew_stats, template_stats, cascade_stats) não são seguros entre threads
+    return threading.Lock()
+
+
+def desenhar_bounding_boxes(image, result):
+    # Caixas e confiança das palavras sobre a imagem já decodificada (a mesma enviada ao modelo), desenhadas
+    # na resolução de exibição (auxiliary_functions.draw_word_boxes)
+    # result: palavras do OCR da página (auxiliary_functions.PageWords)
+    if result is None:
+        return resize_max_side(image, DISPLAY_SIDE)
+    return draw_word_boxes(image, result.geometries, result.confidences)
+
+
+def display_jpeg(image):
+    # Imagem (RGB) em JPEG para a página: as imagens dos documentos prontos ficam em memória até o fim do
+    # processamento, e o JPEG em resolução de exibição ocupa uma fração do array
+    _, encoded = cv2.imencode(".jpg", cv2.cvtColor(image, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return encoded.tobytes()
+
+
+class ProcessingJob:
+    # Processamento dos documentos em uma thread de fundo; a página lê job.results à medida que os lotes
+    # terminam, sem bloquear a execução do script até o último documento
+    # documents: (tipo, nomes, fontes), com fontes = caminhos ou bytes das imagens (frente e verso no RG novo)
+    # model_lock: trava compartilhada por todas as sessões que usam o modelo (get_model_lock)
+    def __init__(self, model, documents, model_lock=None, batch_size=4):
+        self.documents = documents
+        self.model_lock = model_lock if model_lock is not None else threading.Lock()
+        self.results = []
+        self.started = time.time()
+        self.first_result = None
+        self.finished = None
+        self.thread = threading.Thread(target=self.run, args=(model, batch_size), daemon=True)
+        self.thread.start()
+
+    def run(self, model, batch_size):
+        try:
+            # Lotes pequenos de documentos consecutivos do mesmo tipo: os primeiros resultados aparecem logo
+            start = 0
+            while start < len(self.documents):
+                doc_type = self.documents[start][0]
+                end = start + 1
+                while end < len(self.documents) and end - start < batch_size and self.documents[end][0] == doc_type:
+                    end += 1
+                self.run_batch(model, self.documents[start:end], batch_size)
+                start = end
+        finally:
+            self.finished = time.time()
+
+    def run_batch(self, model, documents, batch_size):
+        # Cada imagem é decodificada uma única vez e serve para o OCR e para a exibição
+        decoded, results = [], []
+        for doc_type, names, sources in documents:
+            result = {"tipo": doc_type, "nomes": names, "imagens": [], "dados": None, "erro": None}
+            try:
+                decoded.append([read_image(source) if source is not None else None for source in sources])
+            except Exception as e:
+                result["erro"] = f"{type(e).__name__}: {e}"
+                self.add_result(result)
+                continue
+            results.append(result)
+
+        if results:
+            items = [tuple(images) if result["tipo"] == "rg_novo" else images[0]
+                     for result, images in zip(results, decoded)]
+            try:
+                # Os lotes de sessões diferentes se alternam no modelo; a exibição segue fora da trava
+                with self.model_lock:
+                    outputs = process_batch(model, results[0]["tipo"], items, batch_size=batch_size)
+            except Exception as e:
+                outputs = [None] * len(results)
+                for result in results:
+                    result["erro"] = f"{type(e).__name__}: {e}"
+
+            for result, images, output in zip(results, decoded, outputs):
+                meta_data = output[1:] if output is not None else [None] * len(images)
+                for name, image, page in zip(result["nomes"], images, meta_data):
+                    if image is not None:
+                        result["imagens"].append((name, display_jpeg(resize_max_side(image, DISPLAY_SIDE)),
+                                                  display_jpeg(desenhar_bounding_boxes(image, page))))
+                if output is not None:
+                    result["dados"] = output[0]
+                self.add_result(result)
+
+    def add_result(self, result):
+        if self.first_result is None:
+            self.first_result = time.time()
+        self.results.append(result)
+
+    def progress_text(self):
+        done, total = len(self.results), len(self.documents)
+        elapsed = (self.finished or time.time()) - self.started
+        text = f"{done} de {total} documentos"
+        if done and elapsed > 0:
+            text += f" · {done / elapsed:.2f} documentos/s"
+        if self.first_result is not None:
+            text += f" · primeiro resultado em {self.first_result - self.started:.1f} s"
+        return text
+
+
+def uploaded_documents(doc_type, uploaded_files):
+    # Documentos a partir das imagens enviadas, mantidas em memória (bytes), sem gravação em disco;
+    # no RG novo, frente e verso são pareados pelo nome dos arquivos (rg_pairing)
+    contents = {}
+    for uploaded_file in uploaded_files:
+        contents[uploaded_file.name] = uploaded_file.getvalue()
+    if doc_type != "rg_novo":
+        return [(doc_type, [name], [content]) for name, content in contents.items()]
+
+    pairs, report = pair_rg_files(sorted(contents))
+    for message in pairing_messages(report):
+        st.warning(message)
+    return [(doc_type, [name for name in pair if name is not None], [contents.get(name) for name in pair])
+            for pair in pairs]
+
+
+def folder_documents():
+    # Documentos das pastas padrão de cada tipo (cartao, cnh, rg_t1 e rg_t2)
+    documents = []
+    for doc_type, folder in DEFAULT_FOLDERS.items():
+        if not os.path.isdir(folder):
+            continue
+        paths = [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+                 if os.path.isfile(os.path.join(folder, name))]
+        if doc_type != "rg_novo":
+            documents.extend((doc_type, [os.path.basename(path)], [path]) for path in paths)
+            continue
+        # Pares (frente, verso) pelo nome dos arquivos; os lados sem par são informados e processados sozinhos
+        pairs, report = pair_rg_files(paths)
+        for message in pairing_messages(report):
+            st.warning(message)
+        documents.extend((doc_type, [os.path.basename(path) for path in pair if path is not None], list(pair))
+                         for pair in pairs)
+    return documents
+
+
+def show_result(result):
+    names = " e ".join(result["nomes"])
+    st.write(f"**{DOCUMENT_LABELS[result['tipo']]}:** {names}")
+
+    # Criar colunas para exibir lado a lado
+    for name, original, annotated in result["imagens"]:
+        col1, col2 = st.columns(2)
+        with col1:
+            st.image(original, caption=f"Imagem: {name}", use_column_width=True)
+        with col2:
+            st.image(annotated, caption="Imagem com campos reconhecidos pela IA", use_column_width=True)
+
+    # Exibir os dados extraídos
+    if isinstance(result["dados"], dict):
+        df = pd.DataFrame(list(result["dados"].items()), columns=["Campos no documento", "Resultado identificado"])
+        st.table(df)
+    elif result["erro"] is not None:
+        st.error(f"Erro: {result['erro']}")
+    else:
+        st.write("Erro: Dados não encontrados.")
+
+
+def show_job(job, interval=0.3):
+    # Exibe os resultados prontos e acompanha o processamento até o fim; se a página for recarregada
+    # (por exemplo, por uma interação), os resultados anteriores são exibidos novamente e o
+    # acompanhamento continua
+    progress = st.progress(0.0, text=job.progress_text())
+    shown = 0
+    while True:
+        # O fim é lido antes dos resultados, para que nenhum resultado do último lote fique sem exibição
+        finished = job.finished is not None
+        results = job.results[shown:]
+        for result in results:
+            show_result(result)
+        shown += len(results)
+        progress.progress(shown / len(job.documents) if job.documents else 1.0, text=job.progress_text())
+        if finished:
+            break
+        time.sleep(interval)
+    st.success("Processamento concluído!")
 
-def desenhar_bounding_boxes(uploaded_file, result):
-    # Abrir a imagem
-    image = Image.open(uploaded_file)
-
-    # Converte para numpy array (caso seja uma imagem PIL)
-    image_np = np.array(image)
-
-    annotated_image = image_np.copy()
-    h, w, _ = image_np.shape
-
-    for page in result.pages:
-        for block in page.blocks:
-            for line in block.lines:
-                for word in line.words:
-                    # Converte as coordenadas do quadrilátero
-                    points = np.array(word.geometry)  # Transforma em array NumPy
-                    x_coords = points[:, 0]  # Lista de coordenadas X
-                    y_coords = points[:, 1]  # Lista de coordenadas Y
-
-                    # Define a bounding box mínima
-                    x_min, x_max = int(min(x_coords) * w), int(max(x_coords) * w)
-                    y_min, y_max = int(min(y_coords) * h), int(max(y_coords) * h)
-
-                    # Obtém a confiança da palavra detectada
-                    confidence = word.confidence  # Confiança do OCR (entre 0 e 1)
-                    confidence_text = f"{confidence * 100:.0f}"  # Converte para percentual
-
-                    # Desenha a bounding box (Azul)
-                    cv2.rectangle(annotated_image, (x_min, y_min), (x_max, y_max), (255, 0, 0), 1)
-
-                    # Exibe a confiança acima do texto (Fonte menor)
-                    cv2.putText(annotated_image, confidence_text, (x_min, y_min - 2),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 0, 0), 1)  
-                    
-
-    annotated_image = cv2.cvtColor(annotated_image, cv2.COLOR_BGR2RGB)
-
-    return annotated_image
-
-
-def process_images(directory, model, process_function, **kwargs):
-    if any(os.scandir(directory)):
-        for filename in os.listdir(directory):
-            file_path = os.path.join(directory, filename)
-
-            st.write(f"**Processando arquivo:** {filename} ...")
-            data, meta_data = process_function(model, file_path, **kwargs)
-
-            img_bbox = desenhar_bounding_boxes(file_path, meta_data)
-
-            # Criar colunas para exibir lado a lado
-            col1, col2 = st.columns(2)
-
-            with col1:
-                st.image(Image.open(file_path), caption="Imagem Original", use_column_width=True)
-
-            with col2:
-                st.image(img_bbox, caption="Imagem com campos reconhecidos pela IA", use_column_width=True)
-
-            # Exibir os dados extraídos
-            if isinstance(data, dict):
-                df = pd.DataFrame(list(data.items()), columns=["Campos no documento", "Resultado identificado"])
-                st.table(df)
-            else:
-                st.write("Erro: Dados não encontrados.")
-    else: 
-        st.write("Nenhum documento desse tipo encontrado.")
 
 def main():
 
@@ -87,63 +220,30 @@ def main():
     
     #Titulo da pagina
     st.title("Ordens de Serviço: 46, 47, 48 e 49")
-    st.write("Clique no botão abaixo para iniciar o processamento das imagens.")
-
-    #Botão para processar imagens
-    if st.button("Executar Modelos de Detecção e Reconhecimento de Texto"):
-        with st.spinner("Carregando modelo..."):
-            model = load_ocr_model()
-
-        # Diretórios com os arquivos de imagem
-        cartao = "./cartao"
-        cnh = "./cnh"
-        rg_t1 = "./rg_t1"
-        rg_t2 = "./rg_t2"
-
-        st.subheader("Processando Cartão SUS")
-        process_images(cartao, model, ocr_card)
 
-        st.subheader("Processando CNH")
-        process_images(cnh, model, extract_cnh, limiar_conf=0)
+    # Modelo persistente, carregado e aquecido na primeira execução do app
+    model = get_ocr_model()
+    st.success("Modelo pronto.")
 
-        st.subheader("Processando RG")
-        if any(os.scandir(rg_t1)):
-            files = os.listdir(rg_t1)
-            for i in range(0, len(files), 2):
-                file1 = os.path.join(rg_t1, files[i])
-                file2 = os.path.join(rg_t1, files[i+1]) if i+1 < len(files) else None
+    # Processamento em andamento nesta sessão (um por vez)
+    job = st.session_state.get("job")
+    running = job is not None and job.finished is None
 
-                st.write(f"**Processando arquivos:** {files[i]} {' e ' + files[i+1] if file2 else ''} ...")
+    # Envio de imagens: processadas em memória
+    doc_type = st.selectbox("Tipo de documento", list(DOCUMENT_LABELS), format_func=DOCUMENT_LABELS.get)
+    uploaded_files = st.file_uploader("Imagens dos documentos", type=UPLOAD_TYPES, accept_multiple_files=True)
+    if st.button("Processar imagens enviadas", disabled=running or not uploaded_files):
+        job = st.session_state["job"] = ProcessingJob(model, uploaded_documents(doc_type, uploaded_files),
+                                                      get_model_lock())
 
-                data, meta_data_f, meta_data_v = extract_rg_novo(model, file1, file2, limiar_conf=0)
+    st.write("Ou clique no botão abaixo para processar as imagens das pastas cartao, cnh, rg_t1 e rg_t2.")
 
-                col1, col2 = st.columns(2)
-
-                with col1:
-                    st.image(Image.open(file1), caption=f"Imagem: {files[i]}", use_column_width=True)
-
-                with col2:
-                    img_bbox = desenhar_bounding_boxes(file1, meta_data_f)
-                    st.image(img_bbox, caption="Imagem com campos reconhecidos pela IA", use_column_width=True)
-
-                if file2:
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.image(Image.open(file2), caption=f"Imagem: {files[i+1]}", use_column_width=True)
-                    with col2:
-                        img_bbox = desenhar_bounding_boxes(file2, meta_data_v)
-                        st.image(img_bbox, caption="Imagem com campos reconhecidos pela IA", use_column_width=True)
-
-                if isinstance(data, dict):
-                    df = pd.DataFrame(list(data.items()), columns=["Campos no documento", "Resultado identificado"])
-                    st.table(df)
-                else:
-                    st.write("Erro: Dados não encontrados.")
-
-        
-        process_images(rg_t2, model, extract_rg_antigo, limiar_conf=0)
+    #Botão para processar imagens
+    if st.button("Executar Modelos de Detecção e Reconhecimento de Texto", disabled=running):
+        job = st.session_state["job"] = ProcessingJob(model, folder_documents(), get_model_lock())
 
-        st.success("Processamento concluído!")
+    if job is not None:
+        show_job(job)
 
 
 if __name__ == "__main__":
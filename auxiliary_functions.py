@@ -1,5 +1,7 @@
 import math
+import os
 import cv2
+import numpy as np
 
 def calculate_base_angle(vertices):
     x1, y1 = vertices[0]
@@ -46,9 +48,62 @@ def average_angles_boxes(angle_list):
 
     return mean_angle
 
-def rotate_image(image_path, angle):
-    # Carregar a imagem
-    image = cv2.imread(image_path)
+def geometries_mean_angle_np(geometries, max_angle=10):
+    # Inclinação a partir da base das caixas das palavras (array (N, 4, 2)): ângulos fora de max_angle são
+    # descartados e a média é a dos quatro ângulos centrais (average_angles_boxes)
+    geometries = np.asarray(geometries, dtype=np.float64)
+    if len(geometries) == 0:
+        return 0
+
+    dx = geometries[:, 1, 0] - geometries[:, 0, 0]
+    dy = geometries[:, 1, 1] - geometries[:, 0, 1]
+    angles = np.degrees(np.arctan2(dy, dx))
+    angles = np.where(angles < 0, angles + 0.5, np.where(angles > 0, angles - 0.5, angles))
+
+    # Excluir valores discrepantes
+    angles = angles[(angles > -max_angle) & (angles < max_angle)]
+    if len(angles) > 0:
+        return average_angles_boxes(angles.tolist())
+
+    return 0
+
+def boxes_mean_angle(boxes, max_angle=10):
+    # Inclinação a partir das caixas da etapa de detecção
+    # Caixas retas (N, 5) não carregam informação de inclinação
+    if boxes.ndim != 3:
+        return 0
+
+    # Quadriláteros (N, 4, 2); versões recentes do doctr incluem o score como quinto ponto
+    return geometries_mean_angle_np(boxes[:, :4], max_angle)
+
+# Extensões dos arquivos de imagem aceitos nas pastas de documentos (outros arquivos, como Thumbs.db, são ignorados)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+def is_image_file(path):
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+def read_image(image):
+    # Aceita caminho, bytes do arquivo ou imagem já decodificada (RGB)
+    if isinstance(image, np.ndarray):
+        return image
+
+    if isinstance(image, (bytes, bytearray)):
+        decoded = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+    else:
+        if not os.path.isfile(image):
+            raise FileNotFoundError(f"unable to access {image}")
+        decoded = cv2.imread(str(image), cv2.IMREAD_COLOR)
+
+    if decoded is None:
+        raise ValueError(f"Não foi possível decodificar a imagem: {image if isinstance(image, str) else '<bytes>'}")
+
+    # O modelo espera imagens em RGB
+    return cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB)
+
+def rotate_image(image, angle):
+    # Carregar a imagem caso seja fornecido o caminho do arquivo
+    if isinstance(image, str):
+        image = cv2.imread(image)
 
     # Obter as dimensões da imagem
     (h, w) = image.shape[:2]
@@ -62,7 +117,234 @@ def rotate_image(image_path, angle):
 
     return rotated_image
 
+# Orientação e inclinação da página estimadas pela imagem, antes do OCR
+# As letras são binarizadas e dilatadas até formarem blocos alongados (palavras e linhas) em uma cópia reduzida da
+# imagem; a direção do lado maior de cada bloco indica a direção das linhas de texto. O custo é de alguns
+# milissegundos por página, bem abaixo de uma passada da detecção.
+
+def normalize_line_angle(angle):
+    # Direção de uma linha, em graus, no intervalo (-90, 90]
+    while angle > 90:
+        angle -= 180
+    while angle <= -90:
+        angle += 180
+    return angle
+
+def text_line_angles(image, side=800, min_ratio=3, min_area=50):
+    # Direção (graus, mesma convenção de calculate_base_angle) dos blocos de texto alongados da imagem (RGB)
+    small = resize_max_side(image, side)
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY) if small.ndim == 3 else small
+    binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    (h, w) = binary.shape
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, w // 100), max(1, h // 100)))
+    binary = cv2.dilate(binary, kernel)
+    contours = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[0]
+
+    angles = []
+    for contour in contours:
+        if cv2.contourArea(contour) < min_area:
+            continue
+        points = cv2.boxPoints(cv2.minAreaRect(contour))
+        first, second = points[1] - points[0], points[2] - points[1]
+        if np.hypot(*first) < np.hypot(*second):
+            first, second = second, first
+        # Apenas blocos alongados (palavras e linhas), sem manchas, fotos e bordas
+        if np.hypot(*first) < min_ratio * max(np.hypot(*second), 1):
+            continue
+        angles.append(normalize_line_angle(math.degrees(math.atan2(first[1], first[0]))))
+    return angles
+
+def estimate_page_angle(image, max_angle=10, side=800):
+    # (girada, ângulo): girada quando as linhas de texto são verticais (página deitada) e a inclinação das linhas
+    # horizontais, pela mesma regra das caixas das palavras (average_angles_boxes); 0 sem linhas suficientes
+    angles = text_line_angles(image, side)
+    horizontal = [angle for angle in angles if -max_angle < angle < max_angle]
+    vertical = [angle for angle in angles if abs(angle) > 90 - max_angle]
+
+    # Página deitada: as direções passam a ser as da página girada 90 graus no sentido anti-horário
+    turned = len(vertical) > len(horizontal)
+    if turned:
+        horizontal = [normalize_line_angle(angle - 90) for angle in vertical]
+    return turned, average_angles_boxes(horizontal) if horizontal else 0
+
+def normalize_page(image, max_angle=10, min_angle=1):
+    # Página deitada girada 90 graus e inclinação acima de min_angle corrigida; retorna a imagem, se foi girada
+    # e o ângulo corrigido (0 quando a inclinação é desprezível)
+    # O sentido do giro da página deitada não é conhecido pela imagem: páginas de cabeça para baixo são
+    # reconhecidas com poucas palavras confiáveis e seguem para o modelo de caixas rotacionadas
+    turned, angle = estimate_page_angle(image, max_angle)
+    if turned:
+        image = cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    if abs(angle) <= min_angle:
+        angle = 0
+    if angle:
+        image = rotate_image(image, angle)
+    return image, turned, angle
+
+# Recorte do documento antes do OCR
+# Fotos de celular costumam mostrar o documento em uma pequena parte de um quadro grande; o documento é
+# localizado por bordas e contornos em uma cópia reduzida da imagem, recortado com correção de perspectiva e
+# normalizado para um tamanho fixo, para que o custo do OCR não dependa da resolução da câmera
+
+# Lado maior do documento recortado, em pixels (a proporção medida do documento é mantida)
+DOCUMENT_SIDE = 1024
+
+def halve_image(image, width, height):
+    # O INTER_AREA tem um caminho rápido para a redução exata pela metade: a imagem é reduzida pela metade
+    # (descartando a última linha ou coluna ímpar) enquanto continuar com pelo menos o dobro de width x height
+    while image.shape[0] >= 2 * height and image.shape[1] >= 2 * width:
+        (h, w) = image.shape[:2]
+        image = cv2.resize(image[:h - h % 2, :w - w % 2], (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+    return image
+
+def resize_max_side(image, max_side):
+    # Reduz a imagem para que o lado maior tenha no máximo max_side pixels (nunca amplia)
+    (h, w) = image.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return image
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    # O ajuste fracionário é feito na imagem já reduzida pela metade
+    return cv2.resize(halve_image(image, *size), size, interpolation=cv2.INTER_AREA)
+
+def order_quad_points(points):
+    # Vértices em ordem: superior esquerdo, superior direito, inferior direito e inferior esquerdo
+    points = np.asarray(points, dtype=np.float32).reshape(4, 2)
+    center = points.mean(axis=0)
+    points = points[np.argsort(np.arctan2(points[:, 1] - center[1], points[:, 0] - center[0]))]
+    return np.roll(points, -int(np.argmin(points.sum(axis=1))), axis=0)
+
+def find_document_quad(image, detect_side=640, min_area=0.2, max_area=0.98):
+    # Procura o contorno do documento em uma cópia reduzida da imagem; retorna os quatro vértices na escala
+    # da imagem original ou None quando nenhum quadrilátero convexo ocupa uma fração razoável do quadro
+    small = resize_max_side(image, detect_side)
+    scale = image.shape[1] / small.shape[1]
+    frame_area = small.shape[0] * small.shape[1]
+
+    gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_RGB2GRAY), (5, 5), 0)
+    edges = cv2.dilate(cv2.Canny(gray, 50, 150), np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+        area = cv2.contourArea(contour)
+        if area < min_area * frame_area:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx) and area <= max_area * frame_area:
+            return order_quad_points(approx.reshape(4, 2) * scale)
+    return None
+
+def crop_document(image, side=DOCUMENT_SIDE, detect_side=640):
+    # Retorna a imagem do documento recortada e normalizada e se o documento foi encontrado;
+    # sem quadrilátero, a imagem inteira é apenas reduzida para o mesmo tamanho máximo
+    quad = find_document_quad(image, detect_side)
+    if quad is None:
+        return resize_max_side(image, side), False
+
+    width = max(np.linalg.norm(quad[1] - quad[0]), np.linalg.norm(quad[2] - quad[3]))
+    height = max(np.linalg.norm(quad[3] - quad[0]), np.linalg.norm(quad[2] - quad[1]))
+    scale = side / max(width, height)
+    out_w, out_h = max(1, round(width * scale)), max(1, round(height * scale))
+
+    # A região do documento é reduzida pela metade antes da transformação até ficar com menos do dobro do
+    # tamanho final; a transformação de perspectiva faz o restante sem serrilhado perceptível
+    x0, y0 = np.floor(quad.min(axis=0)).astype(int).clip(0)
+    x1, y1 = np.ceil(quad.max(axis=0)).astype(int) + 1
+    region = image[y0:y1, x0:x1]
+    small = halve_image(region, round(region.shape[1] * scale), round(region.shape[0] * scale))
+    quad = (quad - np.array([x0, y0], dtype=np.float32)) * \
+        np.array([small.shape[1] / region.shape[1], small.shape[0] / region.shape[0]], dtype=np.float32)
+
+    target = np.array([[0, 0], [out_w - 1, 0], [out_w - 1, out_h - 1], [0, out_h - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(quad.astype(np.float32), target)
+    return cv2.warpPerspective(small, matrix, (out_w, out_h), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_REPLICATE), True
+
 # Funções para organizar o OCR por linha
+def to_quadrilaterals(geometries):
+    # Caixas retas ((xmin, ymin), (xmax, ymax)) viram quadriláteros (N, 4, 2) no sentido horário
+    geometries = np.asarray(geometries, dtype=np.float32)
+    if geometries.ndim == 3 and geometries.shape[1] == 2:
+        (xmin, ymin), (xmax, ymax) = geometries[:, 0].T, geometries[:, 1].T
+        geometries = np.stack([
+            np.stack([xmin, ymin], axis=-1),
+            np.stack([xmax, ymin], axis=-1),
+            np.stack([xmax, ymax], axis=-1),
+            np.stack([xmin, ymax], axis=-1),
+        ], axis=1)
+    return geometries.reshape(-1, 4, 2)
+
+def page_to_arrays(page):
+    # Palavras da página empacotadas em arrays: textos, geometrias (N, 4, 2) e confianças
+    words = [word for block in page.blocks for line in block.lines for word in line.words]
+    texts = np.empty(len(words), dtype=object)
+    texts[:] = [word.value for word in words]
+    geometries = [np.asarray(word.geometry, dtype=np.float32).reshape(-1, 2) for word in words]
+    if not geometries:
+        geometries = np.zeros((0, 4, 2), dtype=np.float32)
+    elif len({geometry.shape for geometry in geometries}) == 1:
+        geometries = to_quadrilaterals(np.stack(geometries))
+    else:
+        geometries = np.concatenate([to_quadrilaterals(geometry[None]) for geometry in geometries])
+    confidences = np.array([word.confidence for word in words], dtype=np.float32)
+    return texts, geometries, confidences
+
+class PageWords:
+    # Palavras de uma página do OCR em arrays, no lugar do Document do doctr (árvore Page/Block/Line/Word que
+    # também guarda a imagem da página): textos, geometrias relativas (N, 4, 2) float32, confianças float32,
+    # dimensões (altura, largura) da imagem lida e se a inclinação do documento foi corrigida
+    # Pode ser desempacotado como (textos, geometrias, confianças), o mesmo formato de page_to_arrays
+    __slots__ = ("texts", "geometries", "confidences", "dimensions", "skewed")
+
+    def __init__(self, texts, geometries, confidences, dimensions=None, skewed=False):
+        self.texts = texts
+        self.geometries = geometries
+        self.confidences = confidences
+        self.dimensions = dimensions
+        self.skewed = skewed
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __iter__(self):
+        return iter((self.texts, self.geometries, self.confidences))
+
+def page_words(page, skewed=False):
+    # PageWords de uma página do doctr (ou do onnxtr)
+    return PageWords(*page_to_arrays(page), tuple(page.dimensions), skewed)
+
+def filter_word_arrays(words, limiar_conf=None):
+    # Mantém apenas as palavras com confiança acima do limiar
+    texts, geometries, confidences = words
+    if limiar_conf is None:
+        return words
+    keep = confidences > limiar_conf
+    return texts[keep], geometries[keep], confidences[keep]
+
+# Lado maior das imagens exibidas no app
+DISPLAY_SIDE = 1280
+
+def draw_word_boxes(image, geometries, confidences=None, max_side=DISPLAY_SIDE, color=(0, 0, 255)):
+    # Caixas das palavras (geometrias relativas (N, 4, 2), como em page_to_arrays) sobre a imagem já decodificada
+    # (RGB), reduzida para exibição antes do desenho; todas as caixas são desenhadas em uma única chamada de
+    # cv2.polylines, e a confiança (em %) fica acima de cada palavra
+    annotated_image = resize_max_side(image, max_side)
+    if annotated_image is image:
+        annotated_image = image.copy()
+    h, w = annotated_image.shape[:2]
+
+    geometries = np.asarray(geometries, dtype=np.float32).reshape(-1, 4, 2)
+    if not len(geometries):
+        return annotated_image
+    points = np.rint(geometries * np.array([w, h], dtype=np.float32)).astype(np.int32)
+    cv2.polylines(annotated_image, list(points), True, color, 1)
+
+    if confidences is not None:
+        corners = points.min(axis=1)
+        for (x, y), label in zip(corners.tolist(), np.char.mod("%.0f", np.asarray(confidences) * 100)):
+            cv2.putText(annotated_image, label, (x, y - 2), cv2.FONT_HERSHEY_SIMPLEX, 0.3, color, 1)
+    return annotated_image
+
 def extract_y_center(geometry):
     top_y = min(coord[1] for coord in geometry)
     bottom_y = max(coord[1] for coord in geometry)
@@ -102,3 +384,64 @@ def group_words_by_lines(words_data, tolerance=0.01):
     list_lines = [' '.join(word['text'] for word in line) for line in lines]
 
     return list_lines
+
+def group_words_by_lines_np(geometries, texts, tolerance=0.01, page_ids=None, num_pages=None):
+    # Versão vetorizada de group_words_by_lines: mesmas linhas, sem dicionários por palavra
+    # Com page_ids, agrupa várias páginas de uma vez e devolve a lista de linhas de cada página
+    geometries = np.asarray(geometries, dtype=np.float64).reshape(-1, 4, 2)
+    texts = np.asarray(texts, dtype=object)
+    batched = page_ids is not None
+    if batched:
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        if num_pages is None:
+            num_pages = int(page_ids.max()) + 1 if len(page_ids) else 0
+    else:
+        page_ids = np.zeros(len(texts), dtype=np.int64)
+        num_pages = 1
+
+    pages = [[] for _ in range(num_pages)]
+    if len(texts) == 0:
+        return pages if batched else pages[0]
+
+    y_center = (geometries[:, :, 1].min(axis=1) + geometries[:, :, 1].max(axis=1)) / 2
+    x_min = geometries[:, :, 0].min(axis=1)
+
+    # Ordena por página e pelo centro Y, preservando a ordem original nos empates
+    order = np.lexsort((y_center, page_ids))
+    y_sorted = y_center[order]
+    page_sorted = page_ids[order]
+
+    # Nova linha quando o centro Y se afasta da palavra anterior além da tolerância ou a página muda
+    breaks = np.empty(len(order), dtype=bool)
+    breaks[0] = True
+    breaks[1:] = (np.abs(np.diff(y_sorted)) > tolerance) | (page_sorted[1:] != page_sorted[:-1])
+    line_ids = np.cumsum(breaks) - 1
+
+    # Dentro de cada linha, ordena pelo menor X (esquerda para a direita)
+    order = order[np.lexsort((x_min[order], line_ids))]
+    starts = np.flatnonzero(breaks)
+    ends = np.append(starts[1:], len(order))
+
+    sorted_texts = texts[order].tolist()
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        pages[page_sorted[start]].append(' '.join(sorted_texts[start:end]))
+
+    return pages if batched else pages[0]
+
+def field_confidences(dados, *meta_data):
+    # Confiança média das palavras reconhecidas que compõem cada campo extraído
+    # meta_data: PageWords de cada página do documento (None para páginas ausentes)
+    word_confidences = {}
+    for result in meta_data:
+        if result is None:
+            continue
+        for text, confidence in zip(result.texts.tolist(), result.confidences.tolist()):
+            word_confidences[text] = max(word_confidences.get(text, 0), confidence)
+
+    confidences = {}
+    for field, value in dados.items():
+        values = [word_confidences[token] for token in str(value).split() if token in word_confidences] \
+            if value is not None else []
+        confidences[field] = round(sum(values) / len(values), 4) if values else None
+
+    return confidences
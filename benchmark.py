@@ -0,0 +1,453 @@
+import argparse
+import json
+import os
+import resource
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Geração de documentos sintéticos
+##################################
+
+FIRST_NAMES = ["MARIA", "JOSE", "ANA", "JOAO", "PEDRO", "JULIANA", "CARLOS", "FERNANDA", "LUCAS", "PATRICIA"]
+LAST_NAMES = ["SILVA", "SANTOS", "OLIVEIRA", "SOUZA", "PEREIRA", "ALVES", "LIMA", "GOMES", "COSTA", "RIBEIRO"]
+
+
+def random_name(rng, words=3):
+    return " ".join([rng.choice(FIRST_NAMES)] + list(rng.choice(LAST_NAMES, size=words - 1)))
+
+
+def random_date(rng, start_year=1950, end_year=2030):
+    return f"{rng.integers(1, 29):02d}/{rng.integers(1, 13):02d}/{rng.integers(start_year, end_year)}"
+
+
+def random_digits(rng, n):
+    return "".join(str(d) for d in rng.integers(0, 10, size=n))
+
+
+def random_cpf(rng):
+    # Dígitos verificadores válidos (o modo cascata reprocessa CPFs inválidos); os mesmos sorteios de antes,
+    # para não alterar os demais campos dos conjuntos gerados
+    digits = [int(d) for d in random_digits(rng, 11)[:9]]
+    for position in (9, 10):
+        total = sum(d * weight for d, weight in zip(digits, range(position + 1, 1, -1)))
+        digits.append(total * 10 % 11 % 10)
+    digits = "".join(str(d) for d in digits)
+    return f"{digits[:3]}.{digits[3:6]}.{digits[6:9]}-{digits[9:]}"
+
+
+def random_cns(rng):
+    # Número provisório do Cartão Nacional de Saúde (começa com 7, 8 ou 9) com soma ponderada múltipla de 11
+    digits = [int(d) for d in random_digits(rng, 3) + random_digits(rng, 4) + random_digits(rng, 4)
+              + random_digits(rng, 4)]
+    digits[0] = 7 + digits[0] % 3
+    while True:
+        check = -sum(d * weight for d, weight in zip(digits[:14], range(15, 1, -1))) % 11
+        if check < 10:
+            break
+        digits[13] = (digits[13] + 1) % 10
+    digits[14] = check
+    digits = "".join(str(d) for d in digits)
+    return f"{digits[:3]} {digits[3:7]} {digits[7:11]} {digits[11:]}"
+
+
+# Cada gerador devolve as linhas do documento e os campos esperados na saída do extrator
+def synthetic_cartao(rng):
+    nome = random_name(rng, 4)
+    dt_nasc = random_date(rng)
+    sexo = rng.choice(["M", "F"])
+    numero = random_cns(rng)
+    lines = ["CARTAO NACIONAL DE SAUDE", nome, f"{dt_nasc} SEXO {sexo}", numero]
+    truth = {"Nome": nome, "Data de Nascimento": dt_nasc, "Sexo": sexo, "Numero do Cartao": numero}
+    return [lines], truth
+
+
+def synthetic_cnh(rng):
+    nome, pai, mae = random_name(rng), random_name(rng, 2), random_name(rng, 2)
+    rg, cpf, cnh = random_digits(rng, 7), random_cpf(rng), random_digits(rng, 11)
+    dt_nasc, validade, primeira = random_date(rng, 1950, 2000), random_date(rng, 2025, 2035), random_date(rng, 2000, 2020)
+    lines = [
+        "REPUBLICA FEDERATIVA DO BRASIL",
+        "CARTEIRA NACIONAL DE HABILITACAO",
+        "NOME",
+        nome,
+        f"DOC IDENTIDADE {rg} SSP ES",
+        f"CPF {cpf}",
+        f"DATA NASCIMENTO {dt_nasc}",
+        "FILIACAO",
+        pai,
+        mae,
+        "PERMISSAO ACC CAT HAB B",
+        f"VALIDADE {validade} PRIMEIRA HABILITACAO {primeira}",
+        f"REGISTRO {cnh}",
+    ]
+    truth = {"RG": rg, "CPF": cpf, "CNH": cnh, "Nome": nome, "Filiacao": f"{pai} {mae}",
+             "Data de Nascimento": dt_nasc, "Validade": validade, "Primeira CNH": primeira}
+    return [lines], truth
+
+
+def synthetic_rg_antigo(rng):
+    nome, pai, mae = random_name(rng), random_name(rng, 2), random_name(rng, 2)
+    rg = f"{rng.integers(1, 10)}.{random_digits(rng, 3)}.{random_digits(rng, 3)}"
+    dt_expedicao, dt_nasc, cpf = random_date(rng, 2000, 2020), random_date(rng, 1950, 2000), random_cpf(rng)
+    lines = [
+        "VALIDA EM TODO O TERRITORIO NACIONAL",
+        f"REGISTRO GERAL {rg} DATA DE EXPEDICAO {dt_expedicao}",
+        f"NOME {nome}",
+        pai,
+        mae,
+        "NATURALIDADE VITORIA ES",
+        f"DATA DE NASCIMENTO {dt_nasc}",
+        "DOC ORIGEM CERT NASC",
+        f"CPF {cpf}",
+    ]
+    truth = {"RG": rg, "Data de Expedicao": dt_expedicao, "Nome": nome, "Filiacao": f"{pai} {mae}",
+             "CPF": cpf, "Data de Nascimento": dt_nasc}
+    return [lines], truth
+
+
+def synthetic_rg_novo(rng):
+    nome, pai, mae = random_name(rng), random_name(rng, 2), random_name(rng, 2)
+    rg = f"{rng.integers(10, 100)}.{random_digits(rng, 3)}.{random_digits(rng, 3)}"
+    dt_nasc, dt_expedicao, cpf = random_date(rng, 1950, 2000), random_date(rng, 2015, 2025), random_cpf(rng)
+    frente = [
+        "REPUBLICA FEDERATIVA DO BRASIL",
+        "CARTEIRA DE IDENTIDADE",
+        f"NOME {nome}",
+        f"FILIACAO {pai} E",
+        mae,
+        f"DATA DE NASCIMENTO {dt_nasc}",
+    ]
+    verso = [
+        "REGISTRO GERAL",
+        f"CPF {cpf}",
+        f"RG {rg}",
+        f"DATA DE EXPEDICAO {dt_expedicao}",
+    ]
+    truth = {"RG": rg, "Data de Expedicao": dt_expedicao, "Nome": nome, "Filiacao": f"{pai} E {mae}",
+             "CPF": cpf, "Data de Nascimento": dt_nasc}
+    return [frente, verso], truth
+
+
+GENERATORS = {
+    "cartao": synthetic_cartao,
+    "cnh": synthetic_cnh,
+    "rg_antigo": synthetic_rg_antigo,
+    "rg_novo": synthetic_rg_novo,
+}
+
+
+def render_document(lines, rng, scale=1.0, skew=0.0, noise=0.0, margin=0.0):
+    # Desenha as linhas em um cartão no formato ID-1 (85,6 x 54 mm) com posições conhecidas
+    width, height = int(856 * scale), int(540 * scale)
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+
+    line_height = height / (len(lines) + 1)
+    font_scale = min(0.9 * scale, line_height / 45)
+    for i, text in enumerate(lines):
+        y = int(line_height * (i + 1))
+        cv2.putText(image, text, (int(0.04 * width), y), cv2.FONT_HERSHEY_SIMPLEX,
+                    font_scale, (20, 20, 20), max(1, int(2 * scale)), cv2.LINE_AA)
+
+    # Cartão sobre um fundo maior, como em fotos de celular
+    if margin > 0:
+        pad_y, pad_x = int(height * margin), int(width * margin)
+        background = np.full((height + 2 * pad_y, width + 2 * pad_x, 3), 90, dtype=np.uint8)
+        background[pad_y:pad_y + height, pad_x:pad_x + width] = image
+        image = background
+
+    if skew:
+        (h, w) = image.shape[:2]
+        rotation_matrix = cv2.getRotationMatrix2D((w // 2, h // 2), skew, 1.0)
+        image = cv2.warpAffine(image, rotation_matrix, (w, h), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_CONSTANT, borderValue=(90, 90, 90))
+
+    if noise:
+        image = np.clip(image + rng.normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+
+    return image
+
+
+def generate_dataset(doc_type, count, seed=0, scale=1.0, max_skew=0.0, noise=0.0, margin=0.0):
+    # Retorna, para cada documento, as imagens codificadas em JPEG (como chegam do disco) e os campos esperados
+    rng = np.random.default_rng(seed)
+    dataset = []
+    for _ in range(count):
+        pages, truth = GENERATORS[doc_type](rng)
+        skew = float(rng.uniform(-max_skew, max_skew)) if max_skew else 0.0
+        images = []
+        for lines in pages:
+            image = render_document(lines, rng, scale, skew, noise, margin)
+            images.append(cv2.imencode(".jpg", cv2.cvtColor(image, cv2.COLOR_RGB2BGR))[1].tobytes())
+        dataset.append((images, truth))
+    return dataset
+
+
+# Execução e métricas
+#####################
+
+def normalize(value):
+    return " ".join(str(value).upper().split()) if value is not None else None
+
+
+def field_accuracy(results, truths):
+    # Fração dos campos esperados extraídos exatamente (ignorando espaços e caixa)
+    correct = total = 0
+    for data, truth in zip(results, truths):
+        for field, expected in truth.items():
+            total += 1
+            correct += normalize(data.get(field)) == normalize(expected)
+    return correct / total if total else None
+
+
+def current_rss_mb():
+    # Memória residente atual do processo; sem /proc, o pico desde o início do processo (ru_maxrss, em KB no Linux)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RssSampler:
+    # Pico de memória residente durante um caso, amostrado em uma thread: o ru_maxrss do processo é o pico de toda
+    # a execução e repetiria, nos casos seguintes, o maior pico dos anteriores
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start_mb = self.peak_mb = 0.0
+        self.stop = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        self.thread.join()
+        self.sample()
+
+
+def summarize(name, latencies, elapsed, count, accuracy=None, rss=None):
+    # rss: RssSampler do caso; acrescimo_rss_mb é o pico durante o caso menos a memória no seu início
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "caso": name,
+        "documentos": count,
+        "docs_por_segundo": round(count / elapsed, 3) if elapsed else None,
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 1) if len(latencies_ms) else None,
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 1) if len(latencies_ms) else None,
+        "pico_rss_mb": round(rss.peak_mb, 1) if rss is not None else None,
+        "acrescimo_rss_mb": round(rss.peak_mb - rss.start_mb, 1) if rss is not None else None,
+        "acuracia_campos": round(accuracy, 4) if accuracy is not None else None,
+    }
+
+
+def run_single(name, function, dataset, has_truth=True):
+    # Um documento por chamada: mede a latência de cada documento
+    latencies, results = [], []
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        for images, _ in dataset:
+            t0 = time.perf_counter()
+            output = function(*images)
+            latencies.append(time.perf_counter() - t0)
+            results.append(output[0])
+        elapsed = time.perf_counter() - start
+
+    accuracy = field_accuracy(results, [truth for _, truth in dataset]) if has_truth else None
+    return summarize(name, latencies, elapsed, len(dataset), accuracy, rss)
+
+
+def run_batch(name, function, dataset, batch_size):
+    # Lotes de documentos: a latência de um documento é a duração do seu lote
+    latencies, results = [], []
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        for i in range(0, len(dataset), batch_size):
+            chunk = dataset[i:i + batch_size]
+            t0 = time.perf_counter()
+            outputs = function([images[0] if len(images) == 1 else tuple(images) for images, _ in chunk])
+            duration = time.perf_counter() - t0
+            latencies.extend([duration] * len(chunk))
+            results.extend(output[0] for output in outputs)
+        elapsed = time.perf_counter() - start
+
+    return summarize(name, latencies, elapsed, len(dataset), field_accuracy(results, [t for _, t in dataset]), rss)
+
+
+def benchmark_cases(model, datasets, batch_size, fast_model=None, min_confidence=0.7, **kwargs):
+    from extract_information_card import pipeline_ocr_card, ocr_card, ocr_card_batch
+    from extract_information_cnh import extract_cnh, extract_cnh_batch
+    from extract_information_cnh import pipeline_ocr as pipeline_ocr_cnh
+    from extract_information_rg import extract_rg_antigo, extract_rg_antigo_batch, extract_rg_novo, \
+        extract_rg_novo_batch
+    from extract_information_rg import pipeline_ocr as pipeline_ocr_rg
+
+    cases = {
+        "cartao": [
+            ("pipeline_ocr_card", lambda image: pipeline_ocr_card(model, image, **kwargs), False),
+            ("ocr_card", lambda image: ocr_card(model, image, **kwargs), True),
+            ("ocr_card_batch", lambda images: ocr_card_batch(model, images, batch_size, **kwargs), None),
+        ],
+        "cnh": [
+            ("cnh.pipeline_ocr", lambda image: pipeline_ocr_cnh(model, image, limiar_conf=0, **kwargs), False),
+            ("extract_cnh", lambda image: extract_cnh(model, image, limiar_conf=0, **kwargs), True),
+            ("extract_cnh_batch", lambda images: extract_cnh_batch(model, images, 0, batch_size, **kwargs), None),
+        ],
+        "rg_antigo": [
+            ("rg.pipeline_ocr", lambda image: pipeline_ocr_rg(model, image, limiar_conf=0, **kwargs), False),
+            ("extract_rg_antigo", lambda image: extract_rg_antigo(model, image, limiar_conf=0, **kwargs), True),
+            ("extract_rg_antigo_batch",
+             lambda images: extract_rg_antigo_batch(model, images, 0, batch_size, **kwargs), None),
+        ],
+        "rg_novo": [
+            ("extract_rg_novo",
+             lambda frente, verso: extract_rg_novo(model, frente, verso, limiar_conf=0, **kwargs), True),
+            ("extract_rg_novo_batch",
+             lambda pairs: extract_rg_novo_batch(model, pairs, 0, batch_size, **kwargs), None),
+        ],
+    }
+
+    # Modo cascata: o modelo rápido lê todos os documentos e o modelo pesado só os escalados
+    if fast_model is not None:
+        from document_types import process_batch
+        for doc_type in cases:
+            cases[doc_type].append((f"{doc_type}_cascata_batch", lambda items, doc_type=doc_type: process_batch(
+                model, doc_type, items, batch_size, fast_model=fast_model, min_confidence=min_confidence,
+                **kwargs), None))
+
+    report = []
+    for doc_type, dataset in datasets.items():
+        for name, function, has_truth in cases[doc_type]:
+            if has_truth is None:
+                summary = run_batch(name, function, dataset, batch_size)
+            else:
+                summary = run_single(name, function, dataset, has_truth)
+            summary["tipo"] = doc_type
+            report.append(summary)
+            print(format_row(summary))
+
+    return report
+
+
+def format_row(summary):
+    return (f"{summary['tipo']:<10} {summary['caso']:<24} {summary['docs_por_segundo'] or 0:>9.2f} doc/s "
+            f"p50 {summary['p50_ms'] or 0:>8.1f} ms  p95 {summary['p95_ms'] or 0:>8.1f} ms  "
+            f"rss {summary['pico_rss_mb']:>7.1f} MB (+{summary['acrescimo_rss_mb']:>6.1f})  acurácia {summary['acuracia_campos'] if summary['acuracia_campos'] is not None else '-'}")
+
+
+def model_label(options):
+    label = f"{options['det_arch']}:{options['reco_arch']}:{options['backend']}"
+    return label + " (páginas retas)" if options.get("straight_pages") else label
+
+
+def compare_models(report):
+    # Caso em lote de cada tipo e modelo, do mais rápido para o mais lento: velocidade x acurácia
+    print("\nComparação dos modelos (processamento em lote):")
+    batch_cases = [summary for summary in report if summary["caso"].endswith("_batch")]
+    for doc_type in dict.fromkeys(summary["tipo"] for summary in batch_cases):
+        rows = sorted((summary for summary in batch_cases if summary["tipo"] == doc_type),
+                      key=lambda summary: -(summary["docs_por_segundo"] or 0))
+        for summary in rows:
+            print(f"{doc_type:<10} {summary['modelo']:<60} {summary['docs_por_segundo'] or 0:>9.2f} doc/s  "
+                  f"carga {summary['carga_s']:>6.1f} s  acurácia {summary['acuracia_campos']}")
+
+
+def save_images(datasets, directory):
+    # Grava as imagens geradas para inspeção visual
+    for doc_type, dataset in datasets.items():
+        os.makedirs(os.path.join(directory, doc_type), exist_ok=True)
+        for i, (images, truth) in enumerate(dataset):
+            for side, image in enumerate(images):
+                with open(os.path.join(directory, doc_type, f"{i:05d}_{side}.jpg"), "wb") as f:
+                    f.write(image)
+            with open(os.path.join(directory, doc_type, f"{i:05d}.json"), "w", encoding="utf-8") as f:
+                json.dump(truth, f, ensure_ascii=False)
+
+
+def main(argv=None):
+    from config_run_model import add_cascade_arguments, add_model_arguments
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark dos pipelines de OCR com documentos sintéticos (CPU, sem acesso à rede).")
+    parser.add_argument("--tipos", default=",".join(GENERATORS), help="Tipos de documento separados por vírgula")
+    parser.add_argument("--documentos", type=int, default=20, help="Documentos gerados por tipo")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--escala", type=float, default=1.0, help="Escala da resolução (1.0 = 856x540)")
+    parser.add_argument("--inclinacao", type=float, default=0.0, help="Inclinação máxima em graus")
+    parser.add_argument("--ruido", type=float, default=0.0, help="Desvio padrão do ruído gaussiano")
+    parser.add_argument("--margem", type=float, default=0.0, help="Margem de fundo ao redor do cartão")
+    parser.add_argument("--skew-mode", choices=["ocr", "deteccao"], default="ocr")
+    add_model_arguments(parser)
+    parser.add_argument("--modelos", nargs="+", metavar="DETECTOR:RECONHECEDOR[:BACKEND]",
+                        help="Compara combinações de modelos, por exemplo db_resnet50:crnn_vgg16_bn "
+                             "db_mobilenet_v3_large:crnn_mobilenet_v3_small:pytorch-int8")
+    add_cascade_arguments(parser)
+    parser.add_argument("--recortar", action="store_true",
+                        help="Localiza e recorta o documento antes do OCR (fotos em que o documento ocupa só parte da imagem)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--salvar-imagens", metavar="PASTA", help="Grava as imagens sintéticas geradas")
+    parser.add_argument("--saida", metavar="ARQUIVO", help="Grava o relatório em JSON (linha de base para comparação)")
+    args = parser.parse_args(argv)
+
+    datasets = {
+        doc_type: generate_dataset(doc_type, args.documentos, args.seed, args.escala, args.inclinacao,
+                                   args.ruido, args.margem)
+        for doc_type in args.tipos.split(",")
+    }
+    if args.salvar_imagens:
+        save_images(datasets, args.salvar_imagens)
+
+    # Os pesos pré-treinados precisam estar no cache local do doctr (ou do onnxtr) para rodar sem rede
+    from cascade import report_cascade_stats
+    from config_run_model import cascade_model_options, load_ocr_model, model_options, parse_model_combination, \
+        warmup_ocr_model
+    combinations = [parse_model_combination(combination, model_options(args)) for combination in args.modelos] \
+        if args.modelos else [model_options(args)]
+
+    # Modo cascata: o modelo rápido é o mesmo para todas as combinações comparadas
+    cascade = {}
+    fast_options = cascade_model_options(args)
+    if fast_options is not None:
+        cascade = {"fast_model": warmup_ocr_model(load_ocr_model(**fast_options)),
+                   "min_confidence": args.limiar_cascata}
+
+    report = []
+    for options in combinations:
+        print(f"Modelo: {model_label(options)}")
+        start = time.perf_counter()
+        model = warmup_ocr_model(load_ocr_model(**options))
+        load_seconds = time.perf_counter() - start
+
+        summaries = benchmark_cases(model, datasets, args.batch_size, skew_mode=args.skew_mode, crop=args.recortar,
+                                    **cascade)
+        for summary in summaries:
+            summary["modelo"] = model_label(options)
+            summary["carga_s"] = round(load_seconds, 2)
+        report.extend(summaries)
+        del model
+
+    if len(combinations) > 1:
+        compare_models(report)
+    if fast_options is not None:
+        print(report_cascade_stats())
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump({"parametros": vars(args), "resultados": report}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
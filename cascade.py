@@ -0,0 +1,121 @@
+import re
+from datetime import datetime
+
+from auxiliary_functions import field_confidences
+
+# Cascata de modelos: um modelo leve (por exemplo db_mobilenet_v3_large + crnn_mobilenet_v3_small) lê todos os
+# documentos e apenas os documentos com algum campo obrigatório ausente, fora do formato ou com confiança baixa
+# passam pelo modelo pesado. Os dois níveis usam as mesmas funções em lote (document_types.process_batch), então
+# o modo template, o cache de OCR (cada modelo tem a sua chave) e as demais opções valem para ambos.
+
+# Campos que o modelo rápido precisa entregar válidos para que o documento não seja reprocessado
+# (o cartão do tipo 2 não tem data de nascimento; o CPF não existe em todo RG antigo)
+REQUIRED_FIELDS = {
+    "cartao": ("Numero do Cartao",),
+    "cnh": ("CPF", "CNH", "Data de Nascimento", "Validade"),
+    "rg_novo": ("RG", "CPF", "Data de Nascimento", "Data de Expedicao"),
+    "rg_antigo": ("RG", "Data de Nascimento", "Data de Expedicao"),
+}
+
+# Contadores: documentos recebidos, resolvidos pelo modelo rápido, reprocessados pelo modelo pesado e o motivo
+cascade_stats = {"documentos": 0, "rapido": 0, "escalados": 0, "ausente": 0, "formato": 0, "confianca": 0}
+
+
+def digits_of(value):
+    return re.sub(r"\D", "", value)
+
+
+def cpf_valid(value):
+    # Formato 000.000.000-00 e dígitos verificadores
+    if not re.fullmatch(r"\d{3}\.\d{3}\.\d{3}-\d{2}", value):
+        return False
+    digits = [int(d) for d in digits_of(value)]
+    if len(set(digits)) == 1:
+        return False
+    for position in (9, 10):
+        total = sum(d * weight for d, weight in zip(digits[:position], range(position + 1, 1, -1)))
+        if (total * 10 % 11) % 10 != digits[position]:
+            return False
+    return True
+
+
+def cns_valid(value):
+    # Cartão Nacional de Saúde: 15 dígitos com soma ponderada (pesos 15 a 1) múltipla de 11
+    digits = digits_of(value)
+    if len(digits) != 15 or digits[0] not in "1234789":
+        return False
+    return sum(int(d) * weight for d, weight in zip(digits, range(15, 0, -1))) % 11 == 0
+
+
+def date_valid(value):
+    # Data do calendário no formato dia/mês/ano (também com "-" ou ".")
+    match = re.fullmatch(r"(\d{2})[/.-](\d{2})[/.-](\d{4})", value)
+    if match is None:
+        return False
+    try:
+        datetime(int(match.group(3)), int(match.group(2)), int(match.group(1)))
+    except ValueError:
+        return False
+    return True
+
+
+FIELD_CHECKS = {
+    "CPF": cpf_valid,
+    "Numero do Cartao": cns_valid,
+    "CNH": lambda value: re.fullmatch(r"\d{11}", value) is not None,
+    "RG": lambda value: 5 <= len(digits_of(value)) <= 10,
+    "Data de Nascimento": date_valid,
+    "Data de Expedicao": date_valid,
+    "Validade": date_valid,
+}
+
+
+def escalation_reason(doc_type, dados, confidences=None, min_confidence=0.7):
+    # Motivo para reprocessar o documento com o modelo pesado ("ausente", "formato" ou "confianca"), ou None se o
+    # resultado do modelo rápido é aceito; campos sem confiança conhecida (por exemplo, do modo template) não
+    # são reprocessados por confiança
+    dados = dados or {}
+    for field in REQUIRED_FIELDS[doc_type]:
+        if dados.get(field) is None:
+            return "ausente"
+        check = FIELD_CHECKS.get(field)
+        if check is not None and not check(str(dados[field])):
+            return "formato"
+
+    confidences = confidences or {}
+    for field in REQUIRED_FIELDS[doc_type]:
+        if confidences.get(field) is not None and confidences[field] < min_confidence:
+            return "confianca"
+    return None
+
+
+def cascade_batch(doc_type, items, fast, accurate, min_confidence=0.7):
+    # fast e accurate: funções em lote de cada nível (lista de itens -> resultados (dados, meta_data...))
+    results = fast(list(items))
+    cascade_stats["documentos"] += len(items)
+
+    escalated = []
+    for idx, result in enumerate(results):
+        reason = escalation_reason(doc_type, result[0], field_confidences(result[0], *result[1:]), min_confidence)
+        if reason is not None:
+            cascade_stats[reason] += 1
+            escalated.append(idx)
+    cascade_stats["rapido"] += len(items) - len(escalated)
+    cascade_stats["escalados"] += len(escalated)
+
+    # Os documentos escalados seguem juntos para o modelo pesado
+    if escalated:
+        for idx, result in zip(escalated, accurate([items[idx] for idx in escalated])):
+            results[idx] = result
+
+    return results
+
+
+def report_cascade_stats():
+    total = cascade_stats["documentos"]
+    fast = cascade_stats["rapido"]
+    percentual = 100 * fast / total if total else 0
+    return (f"Cascata: {fast} de {total} documentos resolvidos pelo modelo rápido ({percentual:.1f}%), "
+            f"{cascade_stats['escalados']} reprocessados pelo modelo pesado "
+            f"(campo ausente: {cascade_stats['ausente']}, formato: {cascade_stats['formato']}, "
+            f"confiança: {cascade_stats['confianca']})")
@@ -1,15 +1,443 @@
-from doctr.io import DocumentFile
-from doctr.models import ocr_predictor
+import os
 
-def load_ocr_model():
-    # Carrega o modelo OCR
-    return ocr_predictor('db_resnet50', 'crnn_vgg16_bn', pretrained=True, assume_straight_pages=False)
+import cv2
+import numpy as np
+
+import metrics
+from auxiliary_functions import boxes_mean_angle, crop_document, filter_word_arrays, geometries_mean_angle_np, normalize_page, \
+    page_words, read_image, rotate_image, group_words_by_lines_np
+
+# Contadores do pipeline: documentos processados e documentos que passaram pelo caminho lento
+# (correção de inclinação seguida de um novo OCR); no modo de páginas retas, documentos lidos pelo modelo de
+# caixas retas e documentos reprocessados pelo modelo de caixas rotacionadas
+deskew_stats = {"documentos": 0, "inclinados": 0, "paginas_retas": 0, "fallback_rotacionado": 0}
+
+# Modo de páginas retas: documentos com menos de FALLBACK_MIN_WORDS palavras de confiança ao menos
+# FALLBACK_MIN_CONFIDENCE são reprocessados pelo modelo de caixas rotacionadas
+FALLBACK_MIN_WORDS = 8
+FALLBACK_MIN_CONFIDENCE = 0.5
+
+# Arquiteturas de detecção e de reconhecimento do doctr; as variantes mobilenet são as mais leves na CPU
+DETECTION_ARCHS = ["db_resnet50", "db_resnet34", "db_mobilenet_v3_large", "linknet_resnet18", "linknet_resnet34",
+                   "linknet_resnet50", "fast_tiny", "fast_small", "fast_base"]
+RECOGNITION_ARCHS = ["crnn_vgg16_bn", "crnn_mobilenet_v3_small", "crnn_mobilenet_v3_large", "sar_resnet31", "master",
+                     "vitstr_small", "vitstr_base", "parseq"]
+
+# Backends de inferência:
+# "pytorch": doctr; "pytorch-int8": doctr com quantização dinâmica int8 do reconhecimento (camadas lineares e
+# recorrentes; as convoluções seguem em float32); "onnx" e "onnx-int8": modelos exportados para ONNX, executados
+# pelo onnxruntime (pacote opcional onnxtr, com a mesma interface do doctr)
+BACKENDS = ["pytorch", "pytorch-int8", "onnx", "onnx-int8"]
+
+# Modelo padrão e tamanhos de lote internos do doctr (páginas por chamada da detecção e recortes de palavras
+# por chamada do reconhecimento)
+DEFAULT_MODEL = {"det_arch": "db_resnet50", "reco_arch": "crnn_vgg16_bn", "backend": "pytorch", "det_batch_size": 2,
+                 "reco_batch_size": 128, "straight_pages": False}
+
+def load_ocr_model(det_arch="db_resnet50", reco_arch="crnn_vgg16_bn", backend="pytorch", det_batch_size=2,
+                   reco_batch_size=128, straight_pages=False):
+    # straight_pages: modelo de caixas retas (assume_straight_pages=True), sem as caixas rotacionadas e sem a
+    # classificação da orientação de cada recorte de palavra; as páginas são endireitadas antes do OCR
+    # (ocr_entries) e o modelo de caixas rotacionadas só é carregado quando algum documento precisa dele
+    # O doctr (e com ele o torch) só é importado quando um modelo é de fato necessário
+    if backend in ("onnx", "onnx-int8"):
+        try:
+            from onnxtr.models import ocr_predictor
+        except ImportError:
+            raise ImportError(f"O backend {backend} requer o pacote onnxtr (pip install onnxtr[cpu]).") from None
+
+        model = ocr_predictor(det_arch, reco_arch, assume_straight_pages=straight_pages, det_bs=det_batch_size,
+                              reco_bs=reco_batch_size, load_in_8_bit=backend == "onnx-int8")
+    elif backend in ("pytorch", "pytorch-int8"):
+        from doctr.models import ocr_predictor
+
+        # Carrega o modelo OCR
+        model = ocr_predictor(det_arch, reco_arch, pretrained=True, assume_straight_pages=straight_pages,
+                              det_bs=det_batch_size, reco_bs=reco_batch_size)
+        if backend == "pytorch-int8":
+            quantize_recognition(model)
+    else:
+        raise ValueError(f"Backend desconhecido: {backend} (opções: {', '.join(BACKENDS)})")
+
+    # Configuração usada para identificar os resultados do modelo (por exemplo, no cache de OCR)
+    model.ocr_config = {"det_arch": det_arch, "reco_arch": reco_arch, "assume_straight_pages": straight_pages,
+                        "backend": backend}
+    model.load_options = {"det_arch": det_arch, "reco_arch": reco_arch, "backend": backend,
+                          "det_batch_size": det_batch_size, "reco_batch_size": reco_batch_size}
+    return model
+
+def rotated_ocr_model(model):
+    # Modelo de caixas rotacionadas com as mesmas arquiteturas, para os documentos que o modelo de caixas retas não
+    # conseguiu ler; carregado na primeira vez que é necessário e mantido junto do modelo de caixas retas
+    rotated = getattr(model, "rotated_model", None)
+    if rotated is None:
+        rotated = load_ocr_model(**model.load_options)
+        # Atribuído pelo __dict__ para não registrar o modelo como submódulo do modelo de caixas retas
+        model.__dict__["rotated_model"] = rotated
+    return rotated
+
+def quantize_recognition(model):
+    # Quantização dinâmica: pesos das camadas lineares e LSTM em int8 e ativações quantizadas durante a execução;
+    # não precisa de calibração e reduz o custo das arquiteturas com cabeça recorrente (CRNN) na CPU
+    import torch
+
+    predictor = model.reco_predictor
+    predictor.model = torch.ao.quantization.quantize_dynamic(predictor.model, {torch.nn.Linear, torch.nn.LSTM},
+                                                             dtype=torch.qint8)
+    return model
+
+def add_model_arguments(parser):
+    # Opções de modelo comuns aos comandos que carregam o OCR
+    parser.add_argument("--detector", choices=DETECTION_ARCHS, default=DEFAULT_MODEL["det_arch"],
+                        help="Arquitetura de detecção de texto")
+    parser.add_argument("--reconhecedor", choices=RECOGNITION_ARCHS, default=DEFAULT_MODEL["reco_arch"],
+                        help="Arquitetura de reconhecimento de texto")
+    parser.add_argument("--backend", choices=BACKENDS, default=DEFAULT_MODEL["backend"],
+                        help="pytorch, pytorch-int8 (quantização dinâmica), onnx ou onnx-int8 (requerem onnxtr)")
+    parser.add_argument("--det-batch-size", type=int, default=DEFAULT_MODEL["det_batch_size"],
+                        help="Páginas por chamada da detecção dentro do modelo")
+    parser.add_argument("--reco-batch-size", type=int, default=DEFAULT_MODEL["reco_batch_size"],
+                        help="Recortes de palavras por chamada do reconhecimento dentro do modelo")
+    parser.add_argument("--paginas-retas", action="store_true",
+                        help="Endireita as páginas pela imagem e usa o modelo de caixas retas; os documentos com "
+                             "poucas palavras reconhecidas são reprocessados pelo modelo de caixas rotacionadas")
+
+def model_options(args):
+    # Parâmetros de load_ocr_model a partir das opções de add_model_arguments
+    return {"det_arch": args.detector, "reco_arch": args.reconhecedor, "backend": args.backend,
+            "det_batch_size": args.det_batch_size, "reco_batch_size": args.reco_batch_size,
+            "straight_pages": args.paginas_retas}
+
+def parse_model_combination(combination, options=None):
+    # "detector:reconhecedor[:backend]" -> parâmetros de load_ocr_model; o backend e os lotes internos
+    # omitidos vêm de options
+    parts = combination.split(":")
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Combinação inválida: {combination} (use detector:reconhecedor[:backend])")
+    options = dict(options or DEFAULT_MODEL)
+    options.update(det_arch=parts[0], reco_arch=parts[1])
+    if len(parts) == 3:
+        options["backend"] = parts[2]
+    for value, choices in ((options["det_arch"], DETECTION_ARCHS), (options["reco_arch"], RECOGNITION_ARCHS),
+                           (options["backend"], BACKENDS)):
+        if value not in choices:
+            raise ValueError(f"{value} não é uma opção válida: {', '.join(choices)}")
+    return options
+
+def add_cascade_arguments(parser):
+    # Modo cascata (cascade.py): modelo rápido para todos os documentos e o modelo principal para os duvidosos
+    parser.add_argument("--cascata", metavar="DETECTOR:RECONHECEDOR[:BACKEND]",
+                        help="Modelo rápido lido primeiro, por exemplo db_mobilenet_v3_large:crnn_mobilenet_v3_small; "
+                             "só os documentos com campos obrigatórios ausentes, inválidos ou de confiança baixa "
+                             "passam pelo modelo principal")
+    parser.add_argument("--limiar-cascata", type=float, default=0.7,
+                        help="Confiança mínima dos campos obrigatórios no modelo rápido (padrão: 0.7)")
+
+def cascade_model_options(args):
+    # Parâmetros do modelo rápido (ou None sem --cascata); os lotes internos seguem as opções do modelo principal
+    if not args.cascata:
+        return None
+    return parse_model_combination(args.cascata, model_options(args))
+
+def warmup_ocr_model(model):
+    # Inferência de aquecimento com uma imagem sintética que contém texto,
+    # para que a detecção e o reconhecimento sejam executados ao menos uma vez
+    image = np.full((512, 768, 3), 255, dtype=np.uint8)
+    cv2.putText(image, "REGISTRO GERAL 12.345.678", (40, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 3)
+    cv2.putText(image, "01/01/2000", (40, 320), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 3)
+    model([image])
+    return model
 
 def run_ocr(model, image_path, show_image=False):
-    # Executa OCR na imagem especificada
-    doc = DocumentFile.from_images(image_path)
+    # Executa OCR na imagem especificada (caminho, bytes ou imagem decodificada)
+    doc = [read_image(image_path)]
     result = model(doc)
     if show_image:
         result.show()
     return result
 
+def run_ocr_batch(model, images, batch_size=8, show_image=False, records=None, prefix=""):
+    # Executa OCR em lotes: cada lote de imagens passa por uma única chamada do modelo
+    # records: registros de métricas dos documentos (um por imagem), quando a instrumentação está ativa
+    records = records if records is not None else [None] * len(images)
+    results = []
+    for start in range(0, len(images), batch_size):
+        doc = [read_image(image) for image in images[start:start + batch_size]]
+        with metrics.model_call(model, records[start:start + batch_size], prefix):
+            result = model(doc)
+        if show_image:
+            result.show()
+
+        # Separa as páginas do lote em um documento por imagem (da mesma classe do backend: doctr ou onnxtr)
+        results.extend(type(result)(pages=[page]) for page in result.pages)
+
+    return results
+
+def rerun_rotated(model, pending, final_results, show_image=False, records=None):
+    # Reprocessa em um único lote as imagens rotacionadas em memória
+    pending_records = [records[idx] for idx, _ in pending] if records is not None else None
+    rotated_results = run_ocr_batch(model, [image for _, image in pending], len(pending), show_image,
+                                    pending_records, prefix="reprocessamento_")
+    for (idx, _), result in zip(pending, rotated_results):
+        final_results[idx] = page_words(result.pages[0], skewed=True)
+
+def detect_skew_angles(model, images, max_angle=10):
+    # Executa apenas a detecção de texto (sem reconhecimento) para estimar a inclinação
+    angles = []
+    for loc_pred in model.det_predictor(images):
+        boxes = list(loc_pred.values())[0]
+        angles.append(boxes_mean_angle(boxes, max_angle))
+
+    return angles
+
+def decode_images(images, records, crop=False):
+    # Cada imagem é decodificada uma única vez (e, com crop, recortada)
+    decoded = []
+    for image, record in zip(images, records):
+        with metrics.timer([record], "decodificacao"):
+            image = read_image(image)
+        if crop:
+            with metrics.timer([record], "recorte"):
+                image, found = crop_document(image)
+            metrics.set_field(record, "recortado", found)
+        decoded.append(image)
+    return decoded
+
+def ocr_entries(model, images, max_angle=10, batch_size=8, show_image=False, skew_mode="ocr", records=None,
+                crop=False):
+    # skew_mode="ocr": a inclinação é medida no OCR completo e os documentos inclinados passam por um novo OCR
+    # skew_mode="deteccao": a inclinação é medida só com a detecção e cada documento é reconhecido uma única vez
+    # crop: o documento é localizado e recortado (auxiliary_functions.crop_document) antes do OCR; as geometrias
+    # passam a ser relativas à imagem recortada
+    # Com um modelo de caixas retas (load_ocr_model(straight_pages=True)), as páginas são endireitadas pela
+    # imagem (straight_ocr_entries) e skew_mode vale para os documentos reprocessados pelo modelo de caixas
+    # rotacionadas
+    if getattr(model, "ocr_config", {}).get("assume_straight_pages"):
+        return straight_ocr_entries(model, images, max_angle, batch_size, show_image, skew_mode, records, crop)
+
+    # Os resultados do modelo são convertidos em PageWords assim que cada lote termina, sem manter os
+    # documentos do doctr
+    first_results = [None] * len(images)
+    final_results = [None] * len(images)
+    skewed_flags = [False] * len(images)
+    records = records if records is not None else [None] * len(images)
+
+    # Imagens inclinadas aguardando o reprocessamento
+    pending = []
+
+    for start in range(0, len(images), batch_size):
+        batch_records = records[start:start + batch_size]
+        decoded = decode_images(images[start:start + batch_size], batch_records, crop)
+        deskew_stats["documentos"] += len(decoded)
+
+        if skew_mode == "deteccao":
+            with metrics.timer(batch_records, "deteccao_inclinacao"):
+                angles = detect_skew_angles(model, decoded, max_angle)
+
+            pages = []
+            for offset, (image, mean_angle, record) in enumerate(zip(decoded, angles, batch_records)):
+                skewed = skewed_flags[start + offset] = mean_angle > 1 or mean_angle < -1
+                metrics.set_field(record, "inclinado", skewed)
+                if skewed:
+                    deskew_stats["inclinados"] += 1
+                    with metrics.timer([record], "rotacao"):
+                        image = rotate_image(image, mean_angle)
+                pages.append(image)
+
+            results = run_ocr_batch(model, pages, batch_size, show_image, batch_records)
+            for offset, result in enumerate(results):
+                idx = start + offset
+                first_results[idx] = final_results[idx] = page_words(result.pages[0], skewed_flags[idx])
+            continue
+
+        results = run_ocr_batch(model, decoded, batch_size, show_image, batch_records)
+
+        for offset, result in enumerate(results):
+            idx = start + offset
+            # As palavras do primeiro OCR são empacotadas uma única vez e servem para medir a inclinação
+            first_results[idx] = final_results[idx] = page_words(result.pages[0])
+            mean_angle = geometries_mean_angle_np(first_results[idx].geometries, max_angle)
+            skewed = skewed_flags[idx] = first_results[idx].skewed = mean_angle > 1 or mean_angle < -1
+            metrics.set_field(records[idx], "inclinado", skewed)
+            if skewed:
+                # Ajusta inclinação da imagem sem gravar arquivos temporários
+                deskew_stats["inclinados"] += 1
+                with metrics.timer([records[idx]], "rotacao"):
+                    pending.append((idx, rotate_image(decoded[offset], mean_angle)))
+
+        # Os documentos inclinados são reprocessados quando completam um lote
+        if len(pending) >= batch_size:
+            rerun_rotated(model, pending, final_results, show_image, records)
+            pending = []
+
+    if pending:
+        rerun_rotated(model, pending, final_results, show_image, records)
+
+    # Para cada documento: as palavras do OCR da imagem original, as do OCR final (sem filtro de confiança) e se
+    # a inclinação foi corrigida; nos documentos não reprocessados, os dois são o mesmo objeto
+    return list(zip(first_results, final_results, skewed_flags))
+
+def straight_ocr_entries(model, images, max_angle=10, batch_size=8, show_image=False, skew_mode="ocr", records=None,
+                         crop=False):
+    # Caminho rápido: a orientação e a inclinação de cada página são corrigidas pela imagem
+    # (auxiliary_functions.normalize_page) e o OCR é feito uma única vez com o modelo de caixas retas, sem
+    # medir a inclinação nas palavras (as caixas retas não a carregam). Documentos com menos de FALLBACK_MIN_WORDS
+    # palavras confiáveis (por exemplo, páginas de cabeça para baixo ou muito tortas) seguem para o pipeline de
+    # caixas rotacionadas (ocr_entries com rotated_ocr_model), com a imagem como foi recebida
+    entries = [None] * len(images)
+    skewed_flags = [False] * len(images)
+    records = records if records is not None else [None] * len(images)
+    fallback = []
+
+    for start in range(0, len(images), batch_size):
+        batch_records = records[start:start + batch_size]
+        decoded = decode_images(images[start:start + batch_size], batch_records, crop)
+
+        pages = []
+        for offset, (image, record) in enumerate(zip(decoded, batch_records)):
+            with metrics.timer([record], "orientacao"):
+                page, turned, angle = normalize_page(image, max_angle)
+            skewed_flags[start + offset] = turned or angle != 0
+            pages.append(page)
+
+        results = run_ocr_batch(model, pages, batch_size, show_image, batch_records)
+        for offset, result in enumerate(results):
+            idx = start + offset
+            words = page_words(result.pages[0], skewed_flags[idx])
+            if np.count_nonzero(words.confidences >= FALLBACK_MIN_CONFIDENCE) < FALLBACK_MIN_WORDS:
+                fallback.append((idx, decoded[offset]))
+                continue
+            entries[idx] = (words, words, skewed_flags[idx])
+            metrics.set_field(records[idx], "inclinado", skewed_flags[idx])
+
+    # Os documentos lidos no caminho rápido entram nos contadores aqui; os reprocessados, em ocr_entries
+    accepted = len(images) - len(fallback)
+    deskew_stats["documentos"] += accepted
+    deskew_stats["inclinados"] += sum(1 for entry in entries if entry is not None and entry[2])
+    deskew_stats["paginas_retas"] += accepted
+    deskew_stats["fallback_rotacionado"] += len(fallback)
+
+    if fallback:
+        fallback_records = [records[idx] for idx, _ in fallback]
+        for record in fallback_records:
+            metrics.set_field(record, "fallback_rotacionado", True)
+        fallback_entries = ocr_entries(rotated_ocr_model(model), [image for _, image in fallback], max_angle,
+                                       batch_size, show_image, skew_mode, fallback_records)
+        for (idx, _), entry in zip(fallback, fallback_entries):
+            entries[idx] = entry
+
+    return entries
+
+def pipeline_ocr_batch(model, image_paths, limiar_conf=None, max_angle=10, batch_size=8, show_image=False,
+                       skew_mode="ocr", cache=None, lines_dir=None, return_words=False, crop=False, decoded=None):
+    # return_words: cada saída inclui também as palavras sem filtro de confiança e se a inclinação foi corrigida
+    # crop: recorta o documento antes do OCR (fotos em que o documento ocupa só parte do quadro)
+    # decoded: imagens já decodificadas por caminho (os recortes do modo template), usadas no lugar da leitura do
+    # arquivo; o caminho continua identificando a imagem nas métricas e nas linhas gravadas
+    entries = [None] * len(image_paths)
+    images = [decoded.get(image, image) if decoded and isinstance(image, str) else image for image in image_paths]
+    records = metrics.new_records(image_paths)
+
+    if cache is not None:
+        # Consulta o cache pelo conteúdo da imagem e pela configuração do modelo e do pipeline
+        config_key = cache.config_key(getattr(model, "ocr_config", {}), max_angle=max_angle, skew_mode=skew_mode,
+                                      crop=crop)
+        keys = []
+        for idx, image in enumerate(images):
+            # O arquivo é lido uma única vez: os mesmos bytes servem para o hash e para o OCR
+            if isinstance(image, str):
+                if not os.path.isfile(image):
+                    raise FileNotFoundError(f"unable to access {image}")
+                with open(image, "rb") as f:
+                    images[idx] = image = f.read()
+            with metrics.timer([records[idx]], "cache"):
+                keys.append(cache.key(image, config_key))
+                entries[idx] = cache.get(keys[-1])
+            metrics.set_field(records[idx], "cache", entries[idx] is not None)
+
+    # Apenas as imagens fora do cache passam pelo modelo
+    misses = [idx for idx, entry in enumerate(entries) if entry is None]
+    if misses:
+        new_entries = ocr_entries(model, [images[idx] for idx in misses], max_angle, batch_size,
+                                  show_image, skew_mode, [records[idx] for idx in misses], crop)
+        for idx, (meta_data, words, skewed) in zip(misses, new_entries):
+            entries[idx] = (meta_data, words, skewed)
+            if cache is not None:
+                cache.put(keys[idx], (meta_data, words, skewed))
+
+    # Agrupa as palavras de todos os documentos em linhas com uma única chamada vetorizada
+    filtered = [filter_word_arrays(words, limiar_conf) for _, words, _ in entries]
+    for (texts, _, _), record in zip(filtered, records):
+        metrics.set_field(record, "palavras", len(texts))
+    with metrics.timer(records, "agrupamento_linhas"):
+        page_lines = group_words_by_lines_np(
+            np.concatenate([geometries for _, geometries, _ in filtered] + [np.zeros((0, 4, 2), dtype=np.float32)]),
+            np.concatenate([texts for texts, _, _ in filtered] + [np.empty(0, dtype=object)]),
+            page_ids=np.repeat(np.arange(len(filtered)), [len(texts) for texts, _, _ in filtered]),
+            num_pages=len(filtered))
+    if return_words:
+        outputs = [(lines, meta_data, words, skewed) for lines, (meta_data, words, skewed) in zip(page_lines, entries)]
+    else:
+        outputs = [(lines, meta_data) for lines, (meta_data, _, _) in zip(page_lines, entries)]
+
+    if lines_dir is not None:
+        save_lines(lines_dir, image_paths, page_lines)
+
+    # Os registros ficam disponíveis para o extrator medir a extração e finalizá-los
+    metrics.set_batch(records)
+
+    return outputs
+
+def save_lines(lines_dir, image_paths, page_lines):
+    # Grava as linhas do OCR de cada imagem em <pasta>/<nome da imagem>.txt, uma linha por linha do documento
+    # (document_types.process_batch usa uma pasta por tipo de documento),
+    # para que os campos possam ser extraídos novamente sem o modelo
+    os.makedirs(lines_dir, exist_ok=True)
+    for image_path, lines in zip(image_paths, page_lines):
+        if not isinstance(image_path, str):
+            continue
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        with open(os.path.join(lines_dir, name + ".txt"), "w", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in lines))
+
+def read_lines(path):
+    # Linhas do OCR gravadas por save_lines
+    with open(path, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+def report_deskew_stats():
+    # Resumo de quantos documentos precisaram da correção de inclinação
+    total = deskew_stats["documentos"]
+    inclinados = deskew_stats["inclinados"]
+    percentual = 100 * inclinados / total if total else 0
+    report = f"Documentos com correção de inclinação: {inclinados} de {total} ({percentual:.1f}%)"
+    fallback = deskew_stats["fallback_rotacionado"]
+    if deskew_stats["paginas_retas"] or fallback:
+        report += (f"\nPáginas retas: {deskew_stats['paginas_retas']} documentos lidos pelo modelo de caixas retas, "
+                   f"{fallback} reprocessados pelo modelo de caixas rotacionadas")
+    return report
+
+def pipeline_ocr_available(model, image_paths, **kwargs):
+    # Executa o pipeline em lote apenas nas imagens encontradas; as demais recebem None
+    available = []
+    for idx, image_path in enumerate(image_paths):
+        if image_path is None or (isinstance(image_path, str) and not os.path.isfile(image_path)):
+            print(
+                f"Imagem não fornecida ou não encontrada no caminho fornecido: {image_path}")
+        else:
+            available.append(idx)
+
+    outputs = [None] * len(image_paths)
+    if available:
+        batch_outputs = pipeline_ocr_batch(model, [image_paths[idx] for idx in available], **kwargs)
+        for idx, output in zip(available, batch_outputs):
+            outputs[idx] = output
+
+        # Alinha os registros de métricas com a lista de entrada
+        batch_records = metrics.take_batch(len(available))
+        records = [None] * len(image_paths)
+        for idx, record in zip(available, batch_records):
+            records[idx] = record
+        metrics.set_batch(records)
+
+    return outputs
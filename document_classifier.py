@@ -0,0 +1,190 @@
+import os
+import re
+
+import metrics
+from config_run_model import pipeline_ocr_available
+from document_types import FIELD_EXTRACTORS
+from ocr_replay import save_document_words
+from rg_pairing import side_key
+
+# Classificação do tipo de documento a partir das linhas do primeiro OCR
+# As imagens de uma pasta mista passam uma única vez pelo modelo; cada uma é classificada por palavras-chave
+# e padrões do texto reconhecido e as mesmas linhas seguem para o extrator de campos do tipo encontrado,
+# sem novas chamadas do modelo. O RG novo tem frente e verso classificados separadamente e reunidos em pares.
+
+# Indícios procurados no texto do documento (todas as linhas, em maiúsculas)
+FEATURES = {
+    "cartao_saude": r'CART[AÃ]O\s+NACIONAL\s+DE\s+SA[UÚ]DE|\bSUS\b',
+    "matricula_cartao": r'\b\d{3}\s+\d{4}\s+\d{4}\s+\d{4}\b|\b\d{15}\b',
+    "habilitacao": r'HABILITA[ÇC][AÃ]O',
+    "permissao": r'\bPERMISS[AÃ]O\b',
+    "categoria": r'\bCAT\.?\s*HAB\b|\bACC\b',
+    "registro_cnh": r'\b\d{11}\b',
+    "registro_geral": r'REGISTRO\s+GERAL',
+    "expedicao": r'EXPEDI[ÇC][AÃ]O',
+    "carteira_identidade": r'CARTEIRA\s+DE\s+IDENTIDADE',
+    "nome": r'\bNOME\b',
+    "filiacao": r'\bFILIA[ÇC][AÃ]O\b',
+    "nascimento": r'NASCIMENTO',
+    "naturalidade": r'NATURALIDADE',
+    "doc_origem": r'DOC\.?\s+ORIGEM',
+    "territorio_nacional": r'TERRIT[OÓ]RIO\s+NACIONAL',
+    "cpf": r'\bCPF\b|\b\d{3}\.\d{3}\.\d{3}-\d{2}\b',
+    "rg_rotulo": r'^RG\b',
+}
+
+COMPILED_FEATURES = {name: re.compile(expression, re.MULTILINE) for name, expression in FEATURES.items()}
+
+# Peso de cada indício por classe; pesos negativos separam classes com rótulos em comum
+# (o verso do RG novo e o RG antigo têm "REGISTRO GERAL" e "DATA DE EXPEDIÇÃO", mas só o RG antigo traz
+# nome, naturalidade e documento de origem no mesmo lado)
+CLASS_FEATURES = {
+    "cartao": {"cartao_saude": 3, "matricula_cartao": 3, "habilitacao": -3, "registro_geral": -3},
+    "cnh": {"habilitacao": 3, "permissao": 2, "categoria": 2, "registro_cnh": 1, "registro_geral": -3},
+    "rg_antigo": {"registro_geral": 2, "expedicao": 1, "nome": 1, "naturalidade": 2, "doc_origem": 2,
+                  "territorio_nacional": 1, "habilitacao": -3},
+    "rg_novo_frente": {"carteira_identidade": 2, "nome": 1, "filiacao": 1, "nascimento": 1, "registro_geral": -2,
+                       "habilitacao": -3, "naturalidade": -1},
+    "rg_novo_verso": {"registro_geral": 2, "expedicao": 1, "cpf": 1, "rg_rotulo": 2, "nome": -2,
+                      "naturalidade": -2, "doc_origem": -2},
+}
+
+# Tipo de documento de cada classe
+CLASS_TYPES = {
+    "cartao": "cartao",
+    "cnh": "cnh",
+    "rg_antigo": "rg_antigo",
+    "rg_novo_frente": "rg_novo",
+    "rg_novo_verso": "rg_novo",
+}
+
+
+def classify_lines(lines, min_score=2):
+    # Classe do documento (None se nenhuma atingir a pontuação mínima) e a pontuação de cada classe
+    text = "\n".join(line.strip() for line in lines).upper()
+    found = {name: pattern.search(text) is not None for name, pattern in COMPILED_FEATURES.items()}
+    scores = {name: sum(weight for feature, weight in weights.items() if found[feature])
+              for name, weights in CLASS_FEATURES.items()}
+    best = max(scores, key=scores.get)
+    return (best if scores[best] >= min_score else None), scores
+
+
+def pair_rg_sides(paths, classes):
+    # Frente e verso do RG novo com o mesmo documento no nome (<documento>_frente/_verso, rg_pairing) formam um
+    # par; os lados fora da convenção são pareados com o lado vizinho (também fora da convenção) na ordem dos nomes;
+    # um lado sem o outro é processado sozinho (um lado com documento no nome nunca é pareado com outro documento)
+    order = sorted(range(len(paths)), key=lambda idx: os.path.basename(paths[idx]))
+    sides = [idx for idx in order if classes[idx] in ("rg_novo_frente", "rg_novo_verso")]
+    pairs = []
+    used = set()
+
+    documents = {}
+    for idx in sides:
+        key = side_key(paths[idx])
+        if key is not None:
+            documents.setdefault(key[0], []).append(idx)
+    for members in documents.values():
+        fronts = [idx for idx in members if classes[idx] == "rg_novo_frente"]
+        backs = [idx for idx in members if classes[idx] == "rg_novo_verso"]
+        for front, back in zip(fronts, backs):
+            pairs.append((front, back))
+            used.update((front, back))
+
+    unnamed = [idx for idx in sides if side_key(paths[idx]) is None]
+    for position, idx in enumerate(unnamed):
+        if idx in used or classes[idx] != "rg_novo_frente":
+            continue
+        for neighbor in unnamed[position + 1:position + 2] + unnamed[max(0, position - 1):position]:
+            if neighbor not in used and classes[neighbor] == "rg_novo_verso":
+                pairs.append((idx, neighbor))
+                used.update((idx, neighbor))
+                break
+        else:
+            pairs.append((idx, None))
+            used.add(idx)
+    for idx in sides:
+        if idx not in used:
+            pairs.append((idx, None) if classes[idx] == "rg_novo_frente" else (None, idx))
+    return pairs
+
+
+def classify_pages(model, image_paths, batch_size=8, min_score=2, **kwargs):
+    # Um único OCR das imagens; cada página traz o caminho, a saída do pipeline, as linhas, a classe (None se não
+    # classificada), a pontuação de cada classe e o registro de métricas
+    outputs = pipeline_ocr_available(model, image_paths, limiar_conf=None, max_angle=10, batch_size=batch_size,
+                                     **kwargs)
+    records = metrics.take_batch(len(outputs))
+
+    pages = []
+    for path, output, record in zip(image_paths, outputs, records):
+        page_lines = output[0] if output is not None else []
+        with metrics.timer([record], "classificacao"):
+            name, page_scores = classify_lines(page_lines, min_score)
+        metrics.set_field(record, "classe", name)
+        pages.append({"caminho": path, "saida": output, "linhas": page_lines, "classe": name,
+                      "pontuacao": page_scores, "registro": record})
+    return pages
+
+
+def document_results(pages, words_dir=None):
+    # Um registro por documento: tipo (None se não classificado), arquivos, classe e pontuação de cada imagem e
+    # os dados extraídos
+    paths = [page["caminho"] for page in pages]
+    classes = [page["classe"] for page in pages]
+
+    # Documentos: imagens isoladas e pares de RG novo, na ordem da primeira imagem de cada um
+    documents = [(idx,) for idx, name in enumerate(classes) if name not in ("rg_novo_frente", "rg_novo_verso")]
+    documents += pair_rg_sides(paths, classes)
+    documents.sort(key=lambda sides: min(idx for idx in sides if idx is not None))
+
+    results = []
+    for sides in documents:
+        present = [idx for idx in sides if idx is not None]
+        doc_type = CLASS_TYPES.get(classes[present[0]])
+        result = {
+            "tipo": doc_type,
+            "arquivos": [paths[idx] if idx is not None else None for idx in sides],
+            "classes": [classes[idx] if idx is not None else None for idx in sides],
+            "pontuacao": [pages[idx]["pontuacao"] if idx is not None else None for idx in sides],
+            "dados": None,
+        }
+        if doc_type is not None:
+            with metrics.timer([pages[idx]["registro"] for idx in present], "extracao"):
+                result["dados"] = FIELD_EXTRACTORS[doc_type](*[pages[idx]["linhas"] if idx is not None else []
+                                                              for idx in sides])
+            if words_dir is not None:
+                save_document_words(words_dir, doc_type, [paths[idx] if idx is not None else None for idx in sides],
+                                    [pages[idx]["saida"] if idx is not None else None for idx in sides])
+        results.append(result)
+
+    metrics.finish([page["registro"] for page in pages])
+    return results
+
+
+def iter_classify(model, image_paths, batch_size=8, chunk_size=32, min_score=2, words_dir=None, **kwargs):
+    # Classifica as imagens em partes de chunk_size e gera os registros de cada parte (classify_batch), para que
+    # os resultados saiam à medida que as partes terminam, sem manter as palavras da pasta inteira em memória
+    # Um lado do RG novo sem par no fim de uma parte pode ter o outro lado no início da seguinte: ele segue para a
+    # próxima parte (uma única vez) e só então é processado sozinho
+    carried = []
+    for start in range(0, len(image_paths), chunk_size):
+        new_pages = classify_pages(model, image_paths[start:start + chunk_size], batch_size, min_score,
+                                   return_words=words_dir is not None, **kwargs)
+        pages = carried + new_pages
+        carried = []
+        if start + chunk_size < len(image_paths):
+            paths = [page["caminho"] for page in pages]
+            classes = [page["classe"] for page in pages]
+            first_new = len(pages) - len(new_pages)
+            waiting = {idx for sides in pair_rg_sides(paths, classes) if None in sides
+                       for idx in sides if idx is not None and idx >= first_new}
+            carried = [page for idx, page in enumerate(pages) if idx in waiting]
+            pages = [page for idx, page in enumerate(pages) if idx not in waiting]
+        if pages:
+            yield document_results(pages, words_dir)
+
+
+def classify_batch(model, image_paths, batch_size=8, min_score=2, words_dir=None, **kwargs):
+    # Um único OCR de todas as imagens; retorna um registro por documento (document_results)
+    chunks = iter_classify(model, image_paths, batch_size, max(1, len(image_paths)), min_score, words_dir, **kwargs)
+    return [result for results in chunks for result in results]
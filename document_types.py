@@ -0,0 +1,86 @@
+import os
+
+from auxiliary_functions import field_confidences
+from extract_information_card import ocr_card_batch, extract_fields_card
+from extract_information_rg import extract_rg_novo_batch, extract_rg_antigo_batch, extract_fields_rg_novo, \
+    extract_fields_rg_antigo
+from extract_information_cnh import extract_cnh_batch, extract_fields_cnh
+from cascade import cascade_batch
+from template_fields import template_batch
+
+# Função em lote e parâmetros padrão de cada tipo de documento
+DOCUMENT_TYPES = {
+    "cartao": (ocr_card_batch, {}),
+    "cnh": (extract_cnh_batch, {"limiar_conf": 0}),
+    "rg_novo": (extract_rg_novo_batch, {"limiar_conf": 0}),  # itens são pares (frente, verso)
+    "rg_antigo": (extract_rg_antigo_batch, {"limiar_conf": 0}),
+}
+
+# Páginas de cada item (batch_size das funções em lote conta páginas: um lote de n pares do RG novo tem 2n)
+PAGES_PER_ITEM = {
+    "cartao": 1,
+    "cnh": 1,
+    "rg_novo": 2,
+    "rg_antigo": 1,
+}
+
+# Extração dos campos a partir das linhas do OCR, sem o modelo (o RG novo recebe as linhas da frente e do verso)
+FIELD_EXTRACTORS = {
+    "cartao": extract_fields_card,
+    "cnh": extract_fields_cnh,
+    "rg_novo": extract_fields_rg_novo,
+    "rg_antigo": extract_fields_rg_antigo,
+}
+
+# Pasta padrão de cada tipo de documento
+DEFAULT_FOLDERS = {
+    "cartao": "./cartao",
+    "cnh": "./cnh",
+    "rg_novo": "./rg_t1",
+    "rg_antigo": "./rg_t2",
+}
+
+
+def process_batch(model, doc_type, items, batch_size=8, templates=None, fast_model=None, min_confidence=0.7,
+                  **kwargs):
+    # Processa uma lista de itens de um tipo de documento com a função em lote correspondente
+    # templates: regiões dos campos por tipo (template_fields); os documentos recusados pelo modo template
+    # seguem pela função em lote
+    # fast_model: modo cascata (cascade); todos os itens passam pelo modelo rápido e apenas os itens com campos
+    # obrigatórios ausentes, inválidos ou com confiança abaixo de min_confidence passam por model
+    if fast_model is not None:
+        return cascade_batch(doc_type, items,
+                             lambda batch: process_batch(fast_model, doc_type, batch, batch_size, templates=templates,
+                                                         min_confidence=min_confidence, **kwargs),
+                             lambda batch: process_batch(model, doc_type, batch, batch_size, templates=templates,
+                                                         min_confidence=min_confidence, **kwargs),
+                             min_confidence)
+
+    function, defaults = DOCUMENT_TYPES[doc_type]
+    options = dict(defaults)
+    options.update(kwargs)
+    # Linhas gravadas em uma subpasta por tipo: imagens de mesmo nome em pastas de tipos diferentes não se
+    # sobrescrevem
+    if options.get("lines_dir") is not None:
+        options["lines_dir"] = os.path.join(options["lines_dir"], doc_type)
+    if templates and doc_type in templates:
+        # Os documentos recusados chegam ao caminho de página inteira já recortados
+        return template_batch(model, doc_type, items, templates[doc_type],
+                              lambda rejected, decoded: function(model, rejected, batch_size=batch_size,
+                                                                 **dict(options, crop=False, decoded=decoded)),
+                              batch_size, options.get("limiar_conf", 0))
+    return function(model, items, batch_size=batch_size, **options)
+
+
+def process_items(model, doc_type, items, batch_size=8, **kwargs):
+    # Resultado de cada item ({"dados", "confiancas"} e "erro" quando falha); se o lote falhar (por exemplo, uma
+    # imagem corrompida), os itens são processados um a um para que apenas o item com problema seja registrado
+    # com erro
+    try:
+        return [{"dados": result[0], "confiancas": field_confidences(result[0], *result[1:])}
+                for result in process_batch(model, doc_type, items, batch_size=batch_size, **kwargs)]
+    except Exception as e:
+        if len(items) == 1:
+            return [{"dados": None, "erro": f"{type(e).__name__}: {e}"}]
+
+    return [output for item in items for output in process_items(model, doc_type, [item], batch_size, **kwargs)]
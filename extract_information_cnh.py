@@ -1,66 +1,17 @@
-import re
-import cv2
-import os
-
-from auxiliary_functions import calculate_base_angle, average_angles_boxes, rotate_image, group_words_by_lines
-from config_run_model import run_ocr
+import metrics
+from config_run_model import pipeline_ocr_batch, pipeline_ocr_available
+from ocr_replay import save_document_words
+from field_rules import apply_rule, extract_fields, cnh_number, cpf_number, dates_cnh, filiation_cnh, name_cnh, \
+    rg_number_cnh
 
 # Funções utilizadas para extrair informações do texto de ambos os tipos de CNH
 #############################################################################
 
 # Pipeline para OCR
-def pipeline_ocr(model, image_path, limiar_conf=0.5, show_image=False, debug=False):
-
-    result = run_ocr(model, image_path, show_image)
-    meta_data = result
-
-    # Obter a inclinação dos retângulos com mais de 4 caracteres
-    angle_list = []
-    for block in result.pages[0].blocks:
-        for line in block.lines:
-            for word in line.words:
-                vertices = word.geometry
-                angle = calculate_base_angle(vertices)
-                # Excluir valores discrepantes
-                if -10 < angle < 10:
-                    angle_list.append(angle)
-                    
-    if len(angle_list) > 0:
-        # Função que ordena e calcula a média dos quatro ângulos centrais da lista
-        mean_angle = average_angles_boxes(angle_list)
-    else:
-        mean_angle = 0
-
-    if mean_angle > 1 or mean_angle < -1:
-        # Ajusta inclinação da imagem
-        rotated_image = rotate_image(image_path, mean_angle)
-
-        # Salvar a imagem rotacionada
-        cv2.imwrite('rotated_image.jpg', rotated_image)
-
-        image_path = "rotated_image.jpg"
-
-        result = run_ocr(model, image_path, show_image)
-
-        # Apagar o arquivo temporário
-        os.remove("rotated_image.jpg")
-
-    # Extrair o texto das linhas dentro do intervalo ajustado
-    words_data = []
-
-    # Extrair o texto e a geometria
-    for block in result.pages[0].blocks:
-        for line in block.lines:
-            for word in line.words:
-                if word.confidence > limiar_conf:
-                    word_data = {
-                        "text": word.value,  # O texto da palavra
-                        "geometry": word.geometry  # Coordenadas normalizadas
-                    }
-                    words_data.append(word_data)
-
-    # Agrupa as palavras em linhas
-    lines = group_words_by_lines(words_data)
+def pipeline_ocr(model, image_path, limiar_conf=0.5, show_image=False, debug=False, **kwargs):
+
+    lines, meta_data = pipeline_ocr_batch(model, [image_path], limiar_conf, max_angle=10,
+                                          batch_size=1, show_image=show_image, **kwargs)[0]
 
     if debug:
         # Exibe as linhas como texto (opcional)
@@ -76,130 +27,75 @@ def pipeline_ocr(model, image_path, limiar_conf=0.5, show_image=False, debug=Fal
 
 
 def extract_name(ocr_output):
-    for i, line in enumerate(ocr_output):
-        line = line.strip()
-        if re.search(r'\bNOME\b', line, re.IGNORECASE):  # Procura a palavra "NOME"
-            if i + 1 < len(ocr_output):  # Verifica se há uma próxima linha
-                return ocr_output[i + 1].strip()  # Retorna a linha seguinte como nome
-
-    return None  # Retorna None se não encontrar "NOME" ou se não houver próxima linha
-
+    # Retorna a linha seguinte à palavra "NOME"
+    return apply_rule(name_cnh, ocr_output)
 
 
 def extract_filiation(ocr_output):
-    filiation = []
-    capture = False  # Flag para indicar quando começar a capturar os nomes
-    
-    for line in ocr_output:
-        line = line.strip()
-        
-        if re.search(r'\bFILIA[ÇC]AO\b', line, re.IGNORECASE):  
-            capture = True  # Começa a capturar a partir da linha seguinte
-            continue  # Pula a linha atual
-        
-        if re.search(r'\bPERMISSAO\b', line, re.IGNORECASE):  
-            break  # Para de capturar ao encontrar "PERMISSÃO"
-
-        if capture:  
-            filiation.append(line)  # Armazena as linhas de filiação
-    
-    return " ".join(filiation) if filiation else None  # Retorna uma string única ou None
+    # Linhas entre "FILIAÇÃO" e "PERMISSÃO" em uma string única
+    return apply_rule(filiation_cnh, ocr_output)
 
 
 def extract_num_rg(ocr_output):
-    rg_pattern = re.compile(r'\b[A-Z]?(\d{6,9})\b', re.IGNORECASE)  
-    # Captura um número de 6 a 9 dígitos, opcionalmente precedido por uma letra
-    
-    for line in ocr_output[:10]:  # Limita a busca às 10 primeiras linhas
-        line = line.strip()
-        match = rg_pattern.search(line)
-        if match:
-            return match.group(1)  # Retorna apenas os dígitos, ignorando a letra inicial
-
-    return None  # Retorna None se nenhum RG for encontrado
-
-
+    # Número de 6 a 9 dígitos nas 10 primeiras linhas, opcionalmente precedido por uma letra
+    return apply_rule(rg_number_cnh, ocr_output)
 
 
 def extract_cpf(ocr_output):
-    cpf_patterns = [
-        re.compile(r'CPF[\s:]*([0-9]{3}\.[0-9]{3}\.[0-9]{3}-[0-9]{2})'),
-        re.compile(r'\b([0-9]{3}\.[0-9]{3}\.[0-9]{3}-[0-9]{2})\b')
-    ]
-
-    for pattern in cpf_patterns:
-        for line in ocr_output:  
-            line = line.strip()
-            match = pattern.search(line)
-            if match:
-                return match.group(1)  # Retorna o primeiro RG encontrado
-
-    return None
+    # CPF após o rótulo "CPF" ou, na falta dele, o primeiro CPF do documento
+    return apply_rule(cpf_number, ocr_output)
 
 def extract_num_cnh(ocr_output):
-    rg_pattern = re.compile(r'\b\d{11}\b')  # 
-
-    for line in ocr_output[10:]:  # Limita a busca às 10 ultimas linhas
-        line = line.strip()
-        match = rg_pattern.search(line)
-        if match:
-            return match.group()  # Retorna o primeiro número encontrado
-
-    return None  
+    # Número de 11 dígitos a partir da 11ª linha
+    return apply_rule(cnh_number, ocr_output)
 
 
 def extract_cnh_dates(ocr_output):
-    date_pattern = re.compile(r'\b(\d{2}/\d{2}/\d{4})\b')  # Captura datas no formato dd/mm/aaaa
-    dates = []
-
-    for line in ocr_output:
-        line = line.strip()
-        matches = date_pattern.findall(line)  # Encontra todas as datas na linha
-        dates.extend(matches)  # Adiciona as datas encontradas à lista
+    # As três primeiras datas: nascimento, validade e primeira habilitação
+    return apply_rule(dates_cnh, ocr_output)
 
-    # Mapeia as três primeiras datas para as respectivas variáveis
-    dt_nasc = dates[0] if len(dates) > 0 else None
-    validade = dates[1] if len(dates) > 1 else None
-    primeira_cnh = dates[2] if len(dates) > 2 else None
 
-    return dt_nasc, validade, primeira_cnh
+# Pipeline para extrair informações da CNH
 
 
-# Pipeline para extrair informações do RG novo
+def extract_fields_cnh(result):
+    # Todos os campos em uma única passagem pelas linhas
+    return extract_fields("cnh", result)
 
 
-def extract_cnh(model, path, limiar_conf=0.5, show_image=False, debug=False):
+def extract_cnh(model, path, limiar_conf=0.5, show_image=False, debug=False, **kwargs):
     try:
         result, meta_data = pipeline_ocr(model, path, limiar_conf,
-                              show_image=show_image, debug=debug)
-        nome = extract_name(result)
-        filiacao = extract_filiation(result)
-        dt_nasc, validade, primeira_cnh = extract_cnh_dates(result)
-        cpf= extract_cpf(result)
-        rg = extract_num_rg(result)
-        cnh = extract_num_cnh(result)
-        
+                              show_image=show_image, debug=debug, **kwargs)
+        records = metrics.take_batch(1)
     except FileNotFoundError as e:
         print(
             f"Imagem não fornecida ou não encontrada no caminho fornecido: {path}")
-        nome = None
-        filiacao = None
-        dt_nasc = None
-        validade = None
-        primeira_cnh = None
-        cpf = None
-        rg = None
-        cnh = None
-        
-
-    dados = {
-        "RG": rg,
-        "CPF": cpf,
-        "CNH": cnh,
-        "Nome": nome,        
-        "Filiacao": filiacao,        
-        "Data de Nascimento": dt_nasc,
-        "Validade": validade,
-        "Primeira CNH": primeira_cnh
-    }
+        result, meta_data = [], None
+        records = [None]
+
+    with metrics.timer(records, "extracao"):
+        dados = extract_fields_cnh(result)
+
+    metrics.finish(records)
     return dados, meta_data
+
+
+def extract_cnh_batch(model, paths, limiar_conf=0.5, batch_size=8, show_image=False, words_dir=None, **kwargs):
+    # Processa várias CNHs com chamadas em lote do modelo
+    # words_dir: grava as palavras do OCR de cada documento para a reextração sem o modelo (ocr_replay)
+    outputs = pipeline_ocr_available(model, paths, limiar_conf=limiar_conf, max_angle=10, batch_size=batch_size,
+                                     show_image=show_image, return_words=words_dir is not None, **kwargs)
+    records = metrics.take_batch(len(outputs))
+
+    results = []
+    for path, output, record in zip(paths, outputs, records):
+        result, meta_data = output[:2] if output is not None else ([], None)
+        with metrics.timer([record], "extracao"):
+            dados = extract_fields_cnh(result)
+        results.append((dados, meta_data))
+        if words_dir is not None:
+            save_document_words(words_dir, "cnh", [path], [output], limiar_conf)
+
+    metrics.finish(records)
+    return results
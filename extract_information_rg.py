@@ -1,9 +1,8 @@
-import re
-import cv2
-import os
-
-from auxiliary_functions import calculate_base_angle, average_angles_boxes, rotate_image, group_words_by_lines
-from config_run_model import run_ocr
+import metrics
+from config_run_model import pipeline_ocr_batch, pipeline_ocr_available
+from ocr_replay import save_document_words
+from field_rules import apply_rule, extract_fields, cpf_antigo, cpf_rg_novo, dt_expedicao_name_filiation, \
+    dt_expedicao_rg, dt_nasc_rg, filiation_rg, name_rg, rg_number_antigo, rg_number_novo
 
 
 
@@ -11,59 +10,10 @@ from config_run_model import run_ocr
 #############################################################################
 
 # Pipeline para OCR
-def pipeline_ocr(model, image_path, limiar_conf=0.5, show_image=False, debug=False):
-
-    result = run_ocr(model, image_path, show_image)
-    meta_data = result
-
-    # Obter a inclinação dos retângulos com mais de 4 caracteres
-    angle_list = []
-    for block in result.pages[0].blocks:
-        for line in block.lines:
-            for word in line.words:
-                vertices = word.geometry
-                angle = calculate_base_angle(vertices)
-                # Excluir valores discrepantes
-                if -10 < angle < 10:
-                    angle_list.append(angle)
-    
-    if len(angle_list) > 0:
-        # Função que ordena e calcula a média dos quatro ângulos centrais da lista
-        mean_angle = average_angles_boxes(angle_list)
-    else:
-        mean_angle = 0
-    
-
-    if mean_angle > 1 or mean_angle < -1:
-        # Ajusta inclinação da imagem
-        rotated_image = rotate_image(image_path, mean_angle)
-
-        # Salvar a imagem rotacionada
-        cv2.imwrite('rotated_image.jpg', rotated_image)
-
-        image_path = "rotated_image.jpg"
-
-        result = run_ocr(model, image_path, show_image)
-
-        # Apagar o arquivo temporário
-        os.remove("rotated_image.jpg")
-
-    # Extrair o texto das linhas dentro do intervalo ajustado
-    words_data = []
-
-    # Extrair o texto e a geometria
-    for block in result.pages[0].blocks:
-        for line in block.lines:
-            for word in line.words:
-                if word.confidence > limiar_conf:
-                    word_data = {
-                        "text": word.value,  # O texto da palavra
-                        "geometry": word.geometry  # Coordenadas normalizadas
-                    }
-                    words_data.append(word_data)
-
-    # Agrupa as palavras em linhas
-    lines = group_words_by_lines(words_data)
+def pipeline_ocr(model, image_path, limiar_conf=0.5, show_image=False, debug=False, **kwargs):
+
+    lines, meta_data = pipeline_ocr_batch(model, [image_path], limiar_conf, max_angle=10,
+                                          batch_size=1, show_image=show_image, **kwargs)[0]
 
     if debug:
         # Exibe as linhas como texto (opcional)
@@ -77,328 +27,151 @@ def pipeline_ocr(model, image_path, limiar_conf=0.5, show_image=False, debug=Fal
 ######################################################
 
 def extract_num_rg_antigo(ocr_output):
-
-    rg_patterns = [
-        # Após "REGISTRO GERAL"
-        re.compile(r'REGISTRO GERAL[\s:]*([0-9]{1,2}\.?[0-9]{3}\.?[0-9]{3})'),
-        # (22.875.151-94 ou 22.875.151-9)
-        re.compile(r'\b([0-9]{2,3}\.[0-9]{3}\.[0-9]{3}-[0-9]{1,2})\b'),
-        # Formato com pontos (1.234.567 ou 12.345.678)
-        re.compile(r'\b([0-9]{1,2}\.[0-9]{3}\.[0-9]{3})\b'),
-        # Formato com espaços (1 234 567 ou 12 345 678)
-        re.compile(r'\b([0-9]{1,2}\s[0-9]{3}\s[0-9]{3})\b'),
-        re.compile(r'\b([0-9]{3}\.[0-9]{3})\b')  # (123.456)
-
-    ]
-
-    for pattern in rg_patterns:
-        for line in ocr_output[:4]:  # Limita a iteração às 4 primeiras linhas
-            line = line.strip()
-            match = pattern.search(line)
-            if match:
-                return match.group(1)  # Retorna o primeiro RG encontrado
-
-    return None  # Retorna None se nenhum RG for encontrado
+    # Número do RG nas 4 primeiras linhas, pelos formatos em ordem de prioridade
+    return apply_rule(rg_number_antigo, ocr_output)
 
 
 def extract_dt_expedicao_nome_filiacao(ocr_output):
-    dt_expedicao_patterns = [
-        # Formato com barras (12/34/5678)
-        re.compile(r'\b([0-9]{2}/[0-9]{2}/[0-9]{4})\b'),
-        # Formato com hífens (12-34-5678)
-        re.compile(r'\b([0-9]{2}-[0-9]{2}-[0-9]{4})\b'),
-        # Formato com pontos (12.34.5678)
-        re.compile(r'\b([0-9]{2}\.[0-9]{2}\.[0-9]{4})\b')
-    ]
-
-    for pattern in dt_expedicao_patterns:
-        for i, line in enumerate(ocr_output):  # Percorre todas as linhas
-            line = line.strip()
-            match = pattern.search(line)
-            if match:
-                dt_expedicao = match.group(1)
-
-                # Verifica o nome
-                nome = None
-                if i + 1 < len(ocr_output):
-                    next_line = ocr_output[i + 1].strip()
-                    if len(next_line.split()) > 1:  # Verifica se a linha tem mais de uma palavra
-                        nome = next_line
-                        next_line = ocr_output[i + 2].strip()
-                        # Verifica se a linha tem mais de uma palavra
-                        if len(next_line.split()) > 1:
-                            filiacao = ocr_output[i + 2].strip() + " " + ocr_output[i + 3].strip(
-                            ) if i + 3 < len(ocr_output) else None
-                            # Limpa o valor do nome e da filiação
-                            if nome != None:
-                                nome = re.sub(r'\bNOME\b', '', nome).strip()
-                            if filiacao != None:
-                                filiacao = re.sub(
-                                    r'\bFILIAÇAO\b', '', filiacao).strip()
-                            return dt_expedicao, nome, filiacao
-                        else:
-                            filiacao = ocr_output[i + 3].strip() + " " + ocr_output[i + 4].strip(
-                            ) if i + 4 < len(ocr_output) else None
-                            # Limpa o valor do nome e da filiação
-                            if nome != None:
-                                nome = re.sub(r'\bNOME\b', '', nome).strip()
-                            if filiacao != None:
-                                filiacao = re.sub(
-                                    r'\bFILIAÇAO\b', '', filiacao).strip()
-                            return dt_expedicao, nome, filiacao
-
-                    else:   # Pula para a próxima linha se tiver apenas uma palavra
-                        nome = ocr_output[i + 2].strip()
-                        next_line = ocr_output[i + 3].strip()
-                        # Verifica se a linha tem mais de uma palavra
-                        if len(next_line.split()) > 1:
-                            filiacao = ocr_output[i + 3].strip() + " " + ocr_output[i + 4].strip(
-                            ) if i + 3 < len(ocr_output) else None
-                            # Limpa o valor do nome e da filiação
-                            if nome != None:
-                                nome = re.sub(r'\bNOME\b', '', nome).strip()
-                            if filiacao != None:
-                                filiacao = re.sub(
-                                    r'\bFILIAÇAO\b', '', filiacao).strip()
-                            return dt_expedicao, nome, filiacao
-                        else:
-                            filiacao = ocr_output[i + 4].strip() + " " + ocr_output[i + 5].strip(
-                            ) if i + 5 < len(ocr_output) else None
-                            # Limpa o valor do nome e da filiação
-                            if nome != None:
-                                nome = re.sub(r'\bNOME\b', '', nome).strip()
-                            if filiacao != None:
-                                filiacao = re.sub(
-                                    r'\bFILIAÇAO\b', '', filiacao).strip()
-                            return dt_expedicao, nome, filiacao
-
-    return None, None, None  # Retorna None se nenhum padrão for encontrado
+    # Data de expedição seguida do nome e da filiação nas linhas abaixo
+    return apply_rule(dt_expedicao_name_filiation, ocr_output)
 
 
 def extract_cpf_antigo(ocr_output):
-    pattern = re.compile(r'\b([0-9]{3}\.[0-9]{3}\.[0-9]{3}-[0-9]{2})\b')
-
-    for line in ocr_output[4:]:  # Começa a partir da quinta linha
-        line = line.strip()
-        match = pattern.search(line)
-        if match:
-            return match.group(1)  # Retorna o primeiro CPF encontrado
-
-    return None  # Retorna None se nenhum CPF for encontrado
+    # Primeiro CPF a partir da quinta linha
+    return apply_rule(cpf_antigo, ocr_output)
 
 
 def extract_dt_nasc_antigo(ocr_output):
+    # Primeira data a partir da quinta linha, pelos formatos em ordem de prioridade
+    return apply_rule(dt_nasc_rg, ocr_output)
 
-    dt_nasc_patterns = [
-        # Formato com barras (12/34/5678)
-        re.compile(r'\b([0-9]{2}/[0-9]{2}/[0-9]{4})\b'),
-        # Formato com hífens (12-34-5678)
-        re.compile(r'\b([0-9]{2}-[0-9]{2}-[0-9]{4})\b'),
-        # Formato com pontos (12.34.5678)
-        re.compile(r'\b([0-9]{2}\.[0-9]{2}\.[0-9]{4})\b')
-    ]
 
-    for pattern in dt_nasc_patterns:
-        for line in ocr_output[4:]:  # Limita a iteração às 4 primeiras linhas
-            line = line.strip()
-            match = pattern.search(line)
-            if match:
-                return match.group(1)  # Retorna o primeiro RG encontrado
+# Pipeline para extrair informações do RG antigo
 
-    return None  # Retorna None se nenhum RG for encontrado
 
+def extract_fields_rg_antigo(lines):
+    # Todos os campos em uma única passagem pelas linhas
+    return extract_fields("rg_antigo", lines)
 
-# Pipeline para extrair informações do RG antigo
 
-
-def extract_rg_antigo(model, path_verso, limiar_conf=0.5, show_image=False, debug=False):
+def extract_rg_antigo(model, path_verso, limiar_conf=0.5, show_image=False, debug=False, **kwargs):
     try:
         # Chama a função e obtém o resultado
         lines, meta_data = pipeline_ocr(
-            model, path_verso, limiar_conf=limiar_conf, show_image=show_image, debug=debug)
-        # Extrai as informações
-        rg = extract_num_rg_antigo(lines)
-        dt_expedicao, nome, filiacao = extract_dt_expedicao_nome_filiacao(
-            lines)
-        cpf = extract_cpf_antigo(lines)
-        dt_nasc = extract_dt_nasc_antigo(lines)
-
+            model, path_verso, limiar_conf=limiar_conf, show_image=show_image, debug=debug, **kwargs)
+        records = metrics.take_batch(1)
     except FileNotFoundError as e:
         print(
             f"Imagem não fornecida ou não encontrada no caminho fornecido: {path_verso}")
-        nome = None
-        filiacao = None
-        dt_nasc = None
-        rg = None
-        cpf = None
-        dt_expedicao = None
-
-    dados = {
-        "RG": rg,
-        "Data de Expedicao": dt_expedicao,
-        "Nome": nome,
-        "Filiacao": filiacao,
-        "CPF": cpf,
-        "Data de Nascimento": dt_nasc
-    }
+        lines, meta_data = [], None
+        records = [None]
+
+    with metrics.timer(records, "extracao"):
+        dados = extract_fields_rg_antigo(lines)
+
+    metrics.finish(records)
     return dados, meta_data
 
 
+def extract_rg_antigo_batch(model, paths_verso, limiar_conf=0.5, batch_size=8, show_image=False, words_dir=None,
+                            **kwargs):
+    # Processa vários RGs antigos com chamadas em lote do modelo
+    # words_dir: grava as palavras do OCR de cada documento para a reextração sem o modelo (ocr_replay)
+    outputs = pipeline_ocr_available(model, paths_verso, limiar_conf=limiar_conf, max_angle=10, batch_size=batch_size,
+                                     show_image=show_image, return_words=words_dir is not None, **kwargs)
+    records = metrics.take_batch(len(outputs))
+
+    results = []
+    for path_verso, output, record in zip(paths_verso, outputs, records):
+        lines, meta_data = output[:2] if output is not None else ([], None)
+        with metrics.timer([record], "extracao"):
+            dados = extract_fields_rg_antigo(lines)
+        results.append((dados, meta_data))
+        if words_dir is not None:
+            save_document_words(words_dir, "rg_antigo", [path_verso], [output], limiar_conf)
+
+    metrics.finish(records)
+    return results
+
+
 # Funções utilizadas para extrair informações do texto do novo RG
 ################################################################
 
 def extract_name(ocr_output):
-    for line in ocr_output:  # Começa a partir da quinta linha
-        line = line.strip()
-        # Usa regex para encontrar o nome após a palavra "NOME"
-        match = re.search(r'NOME\s+(.+)', line)
-        if match:
-            return match.group(1)
-
-    return None  # Retorna None se nenhum CPF for encontrado
+    # Nome após a palavra "NOME"
+    return apply_rule(name_rg, ocr_output)
 
 
 def extract_filiation(ocr_output):
-    for i, line in enumerate(ocr_output):
-        line = line.strip()
-        match = re.search(r'FILIA[ÇC]AO\s*(.*)', line)
-        if match:
-            filiation_current = match.group(1).strip()
-            if not filiation_current and i + 1 < len(ocr_output):
-                filiation_current = ocr_output[i+1].strip()
-                filiation_next = ocr_output[i+2].strip() if i + \
-                    2 < len(ocr_output) else ""
-            else:
-                filiation_next = ocr_output[i+1].strip() if i + \
-                    1 < len(ocr_output) else ""
-
-            if " E " in filiation_current or " E " in filiation_next or \
-               " E" in filiation_current or " E" in filiation_next:
-                return f"{filiation_current} {filiation_next}".strip()
-            else:
-                return filiation_current
-
-    return None
+    # Filiação após "FILIAÇÃO", incluindo a linha seguinte quando há dois nomes
+    return apply_rule(filiation_rg, ocr_output)
 
 
 def extract_dt_nasc(ocr_output):
-
-    dt_nasc_patterns = [
-        # Formato com barras (12/34/5678)
-        re.compile(r'\b([0-9]{2}/[0-9]{2}/[0-9]{4})\b'),
-        # Formato com hífens (12-34-5678)
-        re.compile(r'\b([0-9]{2}-[0-9]{2}-[0-9]{4})\b'),
-        # Formato com pontos (12.34.5678)
-        re.compile(r'\b([0-9]{2}\.[0-9]{2}\.[0-9]{4})\b')
-    ]
-
-    for pattern in dt_nasc_patterns:
-        for line in ocr_output[4:]:  # Limita a iteração às 4 primeiras linhas
-            line = line.strip()
-            match = pattern.search(line)
-            if match:
-                return match.group(1)  # Retorna o primeiro RG encontrado
-
-    return None  # Retorna None se nenhum RG for encontrado
+    # Primeira data a partir da quinta linha, pelos formatos em ordem de prioridade
+    return apply_rule(dt_nasc_rg, ocr_output)
 
 
 def extract_num_rg_novo(ocr_output):
-    rg_patterns = [
-        re.compile(r'REGISTRO GERAL[\s:]*([0-9]{1,2}\.?[0-9]{3}\.?[0-9]{3})'),
-        re.compile(r'\b([0-9]{2,3}\.[0-9]{3}\.[0-9]{3}-[0-9]{1,2})\b'),
-        re.compile(r'\b([0-9]{1,2}\.[0-9]{3}\.[0-9]{3})\b'),
-        re.compile(r'\b([0-9]{1,2}\s[0-9]{3}\s[0-9]{3})\b'),
-        re.compile(r'\b([0-9]{3}\.[0-9]{3})\b')
-    ]
-
-    for pattern in rg_patterns:
-        for line in ocr_output:
-            line = line.strip()
-            match = pattern.search(line)
-            if match:
-                return match.group(1)
-
-    return None
+    # Número do RG pelos formatos em ordem de prioridade
+    return apply_rule(rg_number_novo, ocr_output)
 
 
 def extract_cpf(ocr_output):
-    cpf_patterns = [
-        re.compile(r'CPF[\s:]*([0-9]{3}\.[0-9]{3}\.[0-9]{3}-[0-9]{2})'),
-        re.compile(r'\b([0-9]{3}\.[0-9]{3}\.[0-9]{3}-[0-9]{2})\b')
-    ]
-
-    for i, line in enumerate(ocr_output):
-        line = line.strip()
-        for pattern in cpf_patterns:
-            match = pattern.search(line)
-            if match:
-                cpf = match.group(1)
-                # Busca o RG nas linhas abaixo do CPF
-                rg = extract_num_rg_novo(ocr_output[i+1:])
-                if rg:
-                    return cpf, rg
-                else:
-                    return cpf, None
-
-    return None, None
+    # CPF e o RG das linhas abaixo dele
+    return apply_rule(cpf_rg_novo, ocr_output)
 
 
 def extract_dt_expedicao(ocr_output):
+    # Primeira data do verso, pelos formatos em ordem de prioridade
+    return apply_rule(dt_expedicao_rg, ocr_output)
 
-    dt_expedicao_patterns = [
-        # Formato com barras (12/34/5678)
-        re.compile(r'\b([0-9]{2}/[0-9]{2}/[0-9]{4})\b'),
-        # Formato com hífens (12-34-5678)
-        re.compile(r'\b([0-9]{2}-[0-9]{2}-[0-9]{4})\b'),
-        # Formato com pontos (12.34.5678)
-        re.compile(r'\b([0-9]{2}\.[0-9]{2}\.[0-9]{4})\b')
-    ]
 
-    for pattern in dt_expedicao_patterns:
-        for line in ocr_output:  
-            line = line.strip()
-            match = pattern.search(line)
-            if match:
-                return match.group(1)  # Retorna o primeiro RG encontrado
+# Pipeline para extrair informações do RG novo
+def extract_fields_rg_novo(result, result_v):
+    # Frente e verso em uma única passagem pelas linhas de cada lado
+    return extract_fields("rg_novo", result, result_v)
 
-    return None  # Retorna None se nenhum RG for encontrado
 
+def extract_rg_novo(model, path_frente, path_verso, limiar_conf=0.5, show_image=False, debug=False, **kwargs):
+    # Frente e verso na mesma chamada em lote do modelo; um lado ausente (None ou arquivo inexistente)
+    # é informado e extraído como sem linhas
+    outputs = pipeline_ocr_available(model, [path_frente, path_verso], limiar_conf=limiar_conf, max_angle=10,
+                                     batch_size=2, show_image=show_image, **kwargs)
+    records = metrics.take_batch(2)
+    (result, meta_data_f), (result_v, meta_data_v) = [output if output is not None else ([], None)
+                                                      for output in outputs]
 
-# Pipeline para extrair informações do RG novo
-def extract_rg_novo(model, path_frente, path_verso, limiar_conf=0.5, show_image=False, debug=False):
-    try:
-        result, meta_data_f = pipeline_ocr(model, path_frente, limiar_conf,
-                              show_image=show_image, debug=debug)
-        nome = extract_name(result)
-        filiacao = extract_filiation(result)
-        dt_nasc = extract_dt_nasc(result)
-    except FileNotFoundError as e:
-        print(
-            f"Imagem não fornecida ou não encontrada no caminho fornecido: {path_frente}")
-        nome = None
-        filiacao = None
-        dt_nasc = None
+    if debug:
+        # Exibe as linhas de cada lado como texto (opcional)
+        for side, lines in (("Frente", result), ("Verso", result_v)):
+            for i, line_text in enumerate(lines):
+                print(f"{side} - Linha {i + 1}: {line_text}")
 
-    try:
-        result_v, meta_data_v = pipeline_ocr(
-            model, path_verso, limiar_conf, show_image=show_image, debug=debug)
-        cpf, rg = extract_cpf(result_v)
-        if rg is None:
-            rg = extract_num_rg_novo(result_v)
-        dt_expedicao = extract_dt_expedicao(result_v)
-    except FileNotFoundError as e:
-        print(
-            f"Imagem não fornecida ou não encontrada no caminho fornecido: {path_verso}")
-        cpf = None
-        rg = None
-        dt_expedicao = None
-
-    dados = {
-        "RG": rg,
-        "Data de Expedicao": dt_expedicao,
-        "Nome": nome,
-        "Filiacao": filiacao,
-        "CPF": cpf,
-        "Data de Nascimento": dt_nasc
-    }
+    with metrics.timer(records, "extracao"):
+        dados = extract_fields_rg_novo(result, result_v)
+
+    metrics.finish(records)
     return dados, meta_data_f, meta_data_v
+
+
+def extract_rg_novo_batch(model, pairs, limiar_conf=0.5, batch_size=8, show_image=False, words_dir=None, **kwargs):
+    # Frente e verso de todos os pares passam pelas mesmas chamadas em lote do modelo
+    # words_dir: grava as palavras do OCR de cada documento para a reextração sem o modelo (ocr_replay)
+    paths = [path for pair in pairs for path in pair]
+    outputs = pipeline_ocr_available(model, paths, limiar_conf=limiar_conf, max_angle=10, batch_size=batch_size,
+                                     show_image=show_image, return_words=words_dir is not None, **kwargs)
+    records = metrics.take_batch(len(outputs))
+
+    results = []
+    for i in range(0, len(outputs), 2):
+        result, meta_data_f = outputs[i][:2] if outputs[i] is not None else ([], None)
+        result_v, meta_data_v = outputs[i + 1][:2] if outputs[i + 1] is not None else ([], None)
+        with metrics.timer(records[i:i + 2], "extracao"):
+            dados = extract_fields_rg_novo(result, result_v)
+        results.append((dados, meta_data_f, meta_data_v))
+        if words_dir is not None:
+            save_document_words(words_dir, "rg_novo", paths[i:i + 2], outputs[i:i + 2], limiar_conf)
+
+    metrics.finish(records)
+    return results
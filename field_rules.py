@@ -0,0 +1,359 @@
+import re
+
+# Motor de extração de campos por regras declarativas
+# Os padrões são compilados uma única vez; as ocorrências de cada padrão em cada linha são registradas
+# e compartilhadas pelas regras de todos os campos do documento
+
+CARD_PUNCTUATION = re.compile(r'[.,;:_-]')
+
+# Transformações aplicadas às linhas antes da busca
+TRANSFORMS = {
+    "linha": str.strip,
+    "cartao": lambda line: CARD_PUNCTUATION.sub('', line).strip(),
+}
+
+# Padrões: nome -> (expressão, flags, transformação da linha)
+PATTERNS = {
+    # Datas
+    "data_barra": (r'\b([0-9]{2}/[0-9]{2}/[0-9]{4})\b', 0, "linha"),  # 12/34/5678
+    "data_hifen": (r'\b([0-9]{2}-[0-9]{2}-[0-9]{4})\b', 0, "linha"),  # 12-34-5678
+    "data_ponto": (r'\b([0-9]{2}\.[0-9]{2}\.[0-9]{4})\b', 0, "linha"),  # 12.34.5678
+    "data_cnh": (r'\b(\d{2}/\d{2}/\d{4})\b', 0, "linha"),
+
+    # Número do RG
+    "rg_registro_geral": (r'REGISTRO GERAL[\s:]*([0-9]{1,2}\.?[0-9]{3}\.?[0-9]{3})', 0, "linha"),
+    "rg_digito": (r'\b([0-9]{2,3}\.[0-9]{3}\.[0-9]{3}-[0-9]{1,2})\b', 0, "linha"),  # 22.875.151-94 ou 22.875.151-9
+    "rg_pontos": (r'\b([0-9]{1,2}\.[0-9]{3}\.[0-9]{3})\b', 0, "linha"),  # 1.234.567 ou 12.345.678
+    "rg_espacos": (r'\b([0-9]{1,2}\s[0-9]{3}\s[0-9]{3})\b', 0, "linha"),  # 1 234 567 ou 12 345 678
+    "rg_curto": (r'\b([0-9]{3}\.[0-9]{3})\b', 0, "linha"),  # 123.456
+    "rg_cnh": (r'\b[A-Z]?(\d{6,9})\b', re.IGNORECASE, "linha"),
+
+    # CPF e CNH
+    "cpf_rotulo": (r'CPF[\s:]*([0-9]{3}\.[0-9]{3}\.[0-9]{3}-[0-9]{2})', 0, "linha"),
+    "cpf": (r'\b([0-9]{3}\.[0-9]{3}\.[0-9]{3}-[0-9]{2})\b', 0, "linha"),
+    "cnh": (r'\b\d{11}\b', 0, "linha"),
+
+    # Rótulos
+    "nome_rotulo_cnh": (r'\bNOME\b', re.IGNORECASE, "linha"),
+    "filiacao_rotulo_cnh": (r'\bFILIA[ÇC]AO\b', re.IGNORECASE, "linha"),
+    "permissao_rotulo": (r'\bPERMISSAO\b', re.IGNORECASE, "linha"),
+    "nome_rg": (r'NOME\s+(.+)', 0, "linha"),
+    "filiacao_rg": (r'FILIA[ÇC]AO\s*(.*)', 0, "linha"),
+
+    # Cartão
+    "matricula_cartao": (r'^\d{3}(?:\s+\d{4}){3}$', 0, "cartao"),  # XXX XXXX XXXX XXXX
+    "data_cartao": (r'\d{2}/\d{2}/\d{4}', 0, "cartao"),
+    "duas_palavras": (r'\S\s+\S', 0, "cartao"),
+    "matricula_cartao_2": (r'\d{15}', 0, "linha"),
+}
+
+COMPILED = {name: re.compile(expression, flags) for name, (expression, flags, _) in PATTERNS.items()}
+
+DATE_PATTERNS = ("data_barra", "data_hifen", "data_ponto")
+RG_PATTERNS = ("rg_registro_geral", "rg_digito", "rg_pontos", "rg_espacos", "rg_curto")
+CPF_PATTERNS = ("cpf_rotulo", "cpf")
+
+
+class LineHits:
+    # Linhas de um documento e as ocorrências dos padrões, calculadas sob demanda e no máximo uma vez
+    # por padrão e linha; as regras de todos os campos compartilham as mesmas ocorrências
+    def __init__(self, lines):
+        self.raw = list(lines)
+        self.count = len(self.raw)
+        self.lines = {}
+        self.matches = {}
+
+    def transformed(self, transform):
+        lines = self.lines.get(transform)
+        if lines is None:
+            lines = self.lines[transform] = [TRANSFORMS[transform](line) for line in self.raw]
+        return lines
+
+    def pattern_state(self, name):
+        # Ocorrências já calculadas do padrão (False: linha ainda não avaliada; None: sem ocorrência)
+        found = self.matches.get(name)
+        if found is None:
+            found = self.matches[name] = [False] * self.count
+        return found, self.transformed(PATTERNS[name][2]), COMPILED[name]
+
+    def match(self, name, i):
+        # Ocorrência do padrão na linha i (None se não houver)
+        found, lines, pattern = self.pattern_state(name)
+        match = found[i]
+        if match is False:
+            match = found[i] = pattern.search(lines[i])
+        return match
+
+    def first(self, name, start=None, stop=None):
+        # Primeira ocorrência do padrão no intervalo de linhas [start:stop]
+        found, lines, pattern = self.pattern_state(name)
+        for i in range(*slice(start, stop).indices(self.count)):
+            match = found[i]
+            if match is False:
+                match = found[i] = pattern.search(lines[i])
+            if match:
+                return i, match
+        return None, None
+
+    def last(self, name, stop=None):
+        # Última ocorrência do padrão antes da linha stop
+        found, lines, pattern = self.pattern_state(name)
+        for i in reversed(range(*slice(None, stop).indices(self.count))):
+            match = found[i]
+            if match is False:
+                match = found[i] = pattern.search(lines[i])
+            if match:
+                return i, match
+        return None, None
+
+    def first_of(self, names, start=None, stop=None, line_major=False):
+        # Primeira ocorrência entre vários padrões
+        # line_major=False: os padrões são tentados em ordem de prioridade
+        # line_major=True: vence a linha mais acima; na mesma linha, o padrão de maior prioridade
+        best = (None, None)
+        for name in names:
+            i, match = self.first(name, start, stop)
+            if match is None:
+                continue
+            if not line_major:
+                return i, match
+            if best[0] is None or i < best[0]:
+                best = (i, match)
+        return best
+
+
+def first_match(names, start=None, stop=None, group=1, line_major=False):
+    # Regra: primeira ocorrência entre os padrões no intervalo de linhas
+    def rule(hits):
+        _, match = hits.first_of(names, start, stop, line_major)
+        return match.group(group) if match else None
+    return rule
+
+
+# Regras de primeira ocorrência
+rg_number_cnh = first_match(["rg_cnh"], stop=10)  # 10 primeiras linhas
+cpf_number = first_match(CPF_PATTERNS)
+cnh_number = first_match(["cnh"], start=10, group=0)  # a partir da 11ª linha
+rg_number_antigo = first_match(RG_PATTERNS, stop=4)  # 4 primeiras linhas
+rg_number_novo = first_match(RG_PATTERNS)
+cpf_antigo = first_match(["cpf"], start=4)  # a partir da 5ª linha
+dt_nasc_rg = first_match(DATE_PATTERNS, start=4)  # a partir da 5ª linha
+dt_expedicao_rg = first_match(DATE_PATTERNS)
+name_rg = first_match(["nome_rg"])
+
+
+# Regras com contexto entre linhas
+####################################
+
+def name_cnh(hits):
+    # Linha seguinte à primeira linha com "NOME"
+    i, _ = hits.first("nome_rotulo_cnh")
+    if i is not None and i + 1 < hits.count:
+        return hits.transformed("linha")[i + 1]
+    return None
+
+
+def filiation_cnh(hits):
+    # Linhas entre "FILIAÇÃO" e "PERMISSÃO", ignorando as linhas com o próprio rótulo
+    lines = hits.transformed("linha")
+    filiation = []
+    capture = False
+    for i in range(hits.count):
+        if hits.match("filiacao_rotulo_cnh", i):
+            capture = True
+            continue
+        if hits.match("permissao_rotulo", i):
+            break
+        if capture:
+            filiation.append(lines[i])
+    return " ".join(filiation) if filiation else None
+
+
+def dates_cnh(hits):
+    # As três primeiras datas: nascimento, validade e primeira habilitação
+    lines = hits.transformed("linha")
+    dates = []
+    for i in range(hits.count):
+        if hits.match("data_cnh", i):
+            dates.extend(COMPILED["data_cnh"].findall(lines[i]))
+            if len(dates) >= 3:
+                break
+    dates += [None] * (3 - len(dates))
+    return tuple(dates[:3])
+
+
+def dt_expedicao_name_filiation(hits):
+    # Data de expedição seguida do nome e da filiação nas linhas abaixo
+    # Uma data na última linha não tem nome abaixo e é ignorada
+    i, match = hits.first_of(DATE_PATTERNS, stop=-1)
+    if match is None:
+        return None, None, None
+
+    lines = hits.transformed("linha")
+    count = hits.count
+    dt_expedicao = match.group(1)
+
+    def line(offset):
+        # Linha abaixo da data, ou None quando o OCR termina antes dela
+        return lines[i + offset] if i + offset < count else None
+
+    # O nome está na linha seguinte, ou na outra se a seguinte tiver apenas uma palavra; a filiação ocupa as
+    # duas linhas depois do nome, ou as duas seguintes se a primeira tiver apenas uma palavra
+    if line(1) is not None and len(line(1).split()) > 1:
+        nome, start = line(1), 2
+    else:
+        nome, start = line(2), 3
+    if line(start) is not None and len(line(start).split()) <= 1:
+        start += 1
+    first, second = line(start), line(start + 1)
+    filiacao = first + " " + second if first is not None and second is not None else None
+
+    # Limpa o valor do nome e da filiação
+    if nome is not None:
+        nome = re.sub(r'\bNOME\b', '', nome).strip()
+    if filiacao is not None:
+        filiacao = re.sub(r'\bFILIAÇAO\b', '', filiacao).strip()
+    return dt_expedicao, nome, filiacao
+
+
+def filiation_rg(hits):
+    # Filiação na própria linha do rótulo ou nas linhas seguintes; o segundo nome entra quando há " E "
+    i, match = hits.first("filiacao_rg")
+    if match is None:
+        return None
+
+    lines = hits.transformed("linha")
+    filiation_current = match.group(1).strip()
+    if not filiation_current and i + 1 < hits.count:
+        filiation_current = lines[i + 1]
+        filiation_next = lines[i + 2] if i + 2 < hits.count else ""
+    else:
+        filiation_next = lines[i + 1] if i + 1 < hits.count else ""
+
+    if " E " in filiation_current or " E " in filiation_next or \
+       " E" in filiation_current or " E" in filiation_next:
+        return f"{filiation_current} {filiation_next}".strip()
+    return filiation_current
+
+
+def cpf_rg_novo(hits):
+    # CPF e o RG das linhas abaixo dele
+    i, match = hits.first_of(CPF_PATTERNS, line_major=True)
+    if match is None:
+        return None, None
+    _, rg = hits.first_of(RG_PATTERNS, start=i + 1)
+    return match.group(1), rg.group(1) if rg else None
+
+
+def cpf_rg_novo_fallback(hits):
+    # RG abaixo do CPF ou, na falta dele, o primeiro RG do verso
+    cpf, rg = cpf_rg_novo(hits)
+    if rg is None:
+        rg = rg_number_novo(hits)
+    return rg, cpf
+
+
+def card_type_1(hits):
+    # Tipo 1 - cartão mais comum: vale a última matrícula; data, sexo e nome são buscados nas linhas acima
+    i, match = hits.last("matricula_cartao")
+    if match is None:
+        return None, None, None, None
+
+    registration = " ".join(match.group().split())
+    birth_date, gender, name = None, None, None
+
+    # Subir até encontrar a data de nascimento e sexo
+    j, date_match = hits.last("data_cartao", stop=i)
+    if date_match is not None:
+        birth_date = date_match.group(0)
+        prev_line = hits.transformed("cartao")[j]
+        gender = prev_line[-1] if prev_line[-1] in "MF" else None
+
+        # Subir até encontrar um nome válido (pelo menos duas palavras)
+        k, _ = hits.last("duas_palavras", stop=j)
+        if k is not None:
+            name = hits.transformed("cartao")[k]
+
+    return name, birth_date, gender, registration
+
+
+def card_type_2(hits):
+    # Tipo 2 - sem data de nascimento e sexo: vale a última matrícula e o nome é o texto acima dela
+    i, match = hits.last("matricula_cartao_2")
+    if match is None:
+        return None, None, None, None
+
+    name = " ".join(hits.raw[:i]) if i > 0 else None
+    return name, None, None, match.group().strip()
+
+
+def card(hits):
+    # Separação das entidades: tipo 1 e, sem matrícula, tipo 2
+    result = card_type_1(hits)
+    if result[3] is None:
+        result = card_type_2(hits)
+    return result
+
+
+# Regras de cada tipo de documento: campos na ordem do resultado e (campos, lado do documento, regra)
+FIELD_RULES = {
+    "cartao": {
+        "campos": ("Nome", "Data de Nascimento", "Sexo", "Numero do Cartao"),
+        "regras": [
+            (("Nome", "Data de Nascimento", "Sexo", "Numero do Cartao"), 0, card),
+        ],
+    },
+    "cnh": {
+        "campos": ("RG", "CPF", "CNH", "Nome", "Filiacao", "Data de Nascimento", "Validade", "Primeira CNH"),
+        "regras": [
+            ("RG", 0, rg_number_cnh),
+            ("CPF", 0, cpf_number),
+            ("CNH", 0, cnh_number),
+            ("Nome", 0, name_cnh),
+            ("Filiacao", 0, filiation_cnh),
+            (("Data de Nascimento", "Validade", "Primeira CNH"), 0, dates_cnh),
+        ],
+    },
+    "rg_antigo": {
+        "campos": ("RG", "Data de Expedicao", "Nome", "Filiacao", "CPF", "Data de Nascimento"),
+        "regras": [
+            ("RG", 0, rg_number_antigo),
+            (("Data de Expedicao", "Nome", "Filiacao"), 0, dt_expedicao_name_filiation),
+            ("CPF", 0, cpf_antigo),
+            ("Data de Nascimento", 0, dt_nasc_rg),
+        ],
+    },
+    "rg_novo": {
+        "campos": ("RG", "Data de Expedicao", "Nome", "Filiacao", "CPF", "Data de Nascimento"),
+        "regras": [
+            # Frente
+            ("Nome", 0, name_rg),
+            ("Filiacao", 0, filiation_rg),
+            ("Data de Nascimento", 0, dt_nasc_rg),
+            # Verso
+            (("RG", "CPF"), 1, cpf_rg_novo_fallback),
+            ("Data de Expedicao", 1, dt_expedicao_rg),
+        ],
+    },
+}
+
+
+def apply_rule(rule, lines):
+    # Aplica uma regra isolada (usada pelas funções de extração de cada campo)
+    return rule(LineHits(lines))
+
+
+def extract_fields(doc_type, *documents):
+    # Extrai todos os campos de um tipo de documento; documents: linhas de cada lado (frente, verso)
+    spec = FIELD_RULES[doc_type]
+    scans = [LineHits(lines) for lines in documents]
+
+    dados = dict.fromkeys(spec["campos"])
+    for fields, side, rule in spec["regras"]:
+        value = rule(scans[side])
+        if isinstance(fields, tuple):
+            dados.update(zip(fields, value))
+        else:
+            dados[fields] = value
+    return dados
+
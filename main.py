@@ -1,71 +1,411 @@
+import argparse
 import os
+import sys
+import time
 
 
-from config_run_model import load_ocr_model
-from extract_information_card import ocr_card
-from extract_information_rg import extract_rg_novo, extract_rg_antigo
-from extract_information_cnh import extract_cnh
+import metrics
+from auxiliary_functions import is_image_file
+from cascade import report_cascade_stats
+from config_run_model import add_cascade_arguments, add_model_arguments, cascade_model_options, load_ocr_model, \
+    model_options, read_lines, report_deskew_stats
+from document_types import DEFAULT_FOLDERS, FIELD_EXTRACTORS, process_items
+from ocr_cache import OcrCache
+from ocr_replay import diff_results, read_results, replay, write_results
+from parallel_runner import iter_parallel
+from result_writer import ResultWriter, item_timings, records_timings, result_record
+from rg_pairing import pair_rg_files, pairing_messages, read_manifest
+from template_fields import TEMPLATE_TYPES, calibrate_templates, load_templates, report_template_stats, save_templates
 
-if __name__ == "__main__":
-    # Carregar o modelo
-    model = load_ocr_model()
-    
+# O doctr (e com ele o torch) só é importado quando um modelo é carregado;
+# listar, reextrair e replay iniciam sem essas dependências
+
+# Lotes do modelo em cada parte de uma pasta processada no próprio processo
+CHUNK_BATCHES = 4
+
+
+def folder_items(doc_type, folder, manifest=None):
+    # Lista os arquivos da pasta; para o RG novo forma os pares (frente, verso) pelo nome dos arquivos ou
+    # pelo manifesto e informa os lados sem par; apenas os arquivos de imagem são considerados
+    files = [os.path.join(folder, filename) for filename in sorted(os.listdir(folder)) if is_image_file(filename)]
+
+    if doc_type == "rg_novo":
+        pairs, report = pair_rg_files(files, manifest)
+        for message in pairing_messages(report):
+            print(message)
+        return pairs
+
+    return files
+
+
+def item_label(item):
+    if isinstance(item, tuple):
+        file1, file2 = item
+        return f"{os.path.basename(file1) if file1 else 'N/A'} e {os.path.basename(file2) if file2 else 'N/A'}"
+    return os.path.basename(item)
+
+
+def print_results(items, data_list, errors=None):
+    for item, data, error in zip(items, data_list, errors or [None] * len(items)):
+        print(f"Arquivo: {item_label(item)}")
+        print(f"Erro: {error}" if error is not None else data)
+
+
+def export_results(writer, doc_type, items, data_list, confidences, errors):
+    # Grava os resultados de um lote, com os tempos por estágio dos registros de métricas do lote
+    timings = records_timings(metrics.drain())
+    writer.write([result_record(doc_type, item, data, item_confidences, item_timings(item, timings), error)
+                  for item, data, item_confidences, error in zip(items, data_list, confidences, errors)])
+
+
+def selected_folders(args):
+    # Pastas informadas na linha de comando; sem nenhuma, as pastas padrão
+    folders = {doc_type: getattr(args, doc_type) for doc_type in DEFAULT_FOLDERS if getattr(args, doc_type)}
+    return folders or dict(DEFAULT_FOLDERS)
+
+
+def selected_manifest(args):
+    return read_manifest(args.manifesto_rg) if args.manifesto_rg else None
+
+
+def folder_jobs(folders, manifest=None):
+    # Itens de cada tipo de documento, apenas das pastas existentes e não vazias
+    jobs = []
+    for doc_type, folder in folders.items():
+        if os.path.isdir(folder) and any(os.scandir(folder)):
+            jobs.append((doc_type, folder_items(doc_type, folder, manifest)))
+    return jobs
+
+
+def command_processar(args):
+    # Com --exportar os registros de métricas de cada lote são guardados para gravar os tempos de cada documento
+    writer = ResultWriter(args.exportar, args.parquet_linhas) if args.exportar else None
+    if args.metricas or args.metricas_prometheus or writer is not None:
+        metrics.enable(args.metricas, collect=writer is not None)
+
+    cache = OcrCache(args.cache, args.cache_max_mb * 1024 ** 2) if args.cache else None
+    options = {"skew_mode": args.skew_mode}
+    if args.recortar:
+        options["crop"] = True
+    if args.templates:
+        options["templates"] = load_templates(args.templates)
+    if args.salvar_linhas:
+        options["lines_dir"] = args.salvar_linhas
+    if args.salvar_palavras:
+        options["words_dir"] = args.salvar_palavras
+    fast_options = cascade_model_options(args)
+    if fast_options is not None:
+        options["min_confidence"] = args.limiar_cascata
 
     # Diretórios com os arquivos de imagem
-    cartao = "./cartao"
-    cnh = "./cnh"
-    rg_t1 = "./rg_t1"
-    rg_t2 = "./rg_t2"
-                  
-    if any(os.scandir(cartao)):
-        # Iterar sobre todos os arquivos no diretório
-        for filename in os.listdir(cartao):
-            file_path = os.path.join(cartao, filename)
+    folders = selected_folders(args)
+    jobs = folder_jobs(folders, selected_manifest(args))
+
+    try:
+        if args.workers > 1:
+            # Documentos distribuídos entre os processos; resultados na ordem de entrada, à medida que os lotes
+            # terminam
+            for job_idx, items, data_list, confidences, errors in iter_parallel(
+                    jobs, args.workers, batch_size=args.batch_size, cache=cache, with_confidences=writer is not None,
+                    model_options=model_options(args), fast_model_options=fast_options, **options):
+                print_results(items, data_list, errors)
+                if writer is not None:
+                    export_results(writer, jobs[job_idx][0], items, data_list, confidences, errors)
+        else:
+            # Carregar o modelo (e, no modo cascata, o modelo rápido)
+            model = load_ocr_model(**model_options(args))
+            if fast_options is not None:
+                options["fast_model"] = load_ocr_model(**fast_options)
+
+            for doc_type, items in jobs:
+                print(f"Processando {len(items)} itens em {folders[doc_type]} ...")
+
+                # Processar os arquivos em lote e obter o dicionário de dados de cada um; a pasta é dividida em
+                # partes de alguns lotes, para que os resultados sejam exibidos e gravados sem acumular a pasta
+                # inteira em memória; um item com problema (por exemplo, uma imagem corrompida) recebe o erro sem
+                # interromper os demais
+                chunk_size = args.batch_size * CHUNK_BATCHES
+                for start in range(0, len(items), chunk_size):
+                    chunk = items[start:start + chunk_size]
+                    outputs = process_items(model, doc_type, chunk, batch_size=args.batch_size,
+                                            show_image=not args.nao_exibir, cache=cache, **options)
+                    data_list = [output["dados"] for output in outputs]
+                    errors = [output.get("erro") for output in outputs]
+                    print_results(chunk, data_list, errors)
+                    if writer is not None:
+                        export_results(writer, doc_type, chunk, data_list,
+                                       [output.get("confiancas") for output in outputs], errors)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is not None:
+        print(f"{writer.count} documentos gravados em {', '.join(args.exportar)}")
+    print(report_deskew_stats())
+    if args.templates:
+        print(report_template_stats())
+    if fast_options is not None:
+        print(report_cascade_stats())
+    if args.metricas_prometheus:
+        metrics.write_prometheus(args.metricas_prometheus)
+    metrics.disable()
+    if cache is not None:
+        print(f"Cache de OCR: {cache.stats()}")
+        cache.close()
+
+
+def command_listar(args):
+    # Tipos de documento, pastas e itens que seriam processados
+    folders = selected_folders(args)
+    for doc_type, folder in folders.items():
+        if not os.path.isdir(folder):
+            print(f"{doc_type}: {folder} (pasta não encontrada)")
+            continue
+        items = folder_items(doc_type, folder, selected_manifest(args))
+        print(f"{doc_type}: {folder} ({len(items)} itens)")
+        for item in items:
+            print(f"  {item_label(item)}")
+
 
-            print(f"Processando arquivo: {filename} ...")
+def command_reextrair(args):
+    # Extrai os campos novamente a partir das linhas gravadas com "processar --salvar-linhas"
+    # Uma pasta gravada por processar tem uma subpasta por tipo; a subpasta do tipo pedido é usada
+    paths = []
+    for path in args.arquivos:
+        if os.path.isdir(os.path.join(path, args.tipo)):
+            path = os.path.join(path, args.tipo)
+        if os.path.isdir(path):
+            paths.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".txt"))
+        else:
+            paths.append(path)
 
-            # Processar cada arquivo e obter o dicionário de dados
-            data = ocr_card(model, file_path, show_image=True) 
+    extract_fields = FIELD_EXTRACTORS[args.tipo]
+    if args.tipo == "rg_novo":
+        # Arquivos em pares: frente e verso, pelo nome das imagens de origem (<documento>_frente.txt)
+        items, report = pair_rg_files(paths)
+        for message in pairing_messages(report):
+            print(message)
+        data_list = [extract_fields(read_lines(front) if front else [], read_lines(back) if back else [])
+                     for front, back in items]
+    else:
+        items = paths
+        data_list = [extract_fields(read_lines(path)) for path in items]
 
-            print(data)
-    
-    if any(os.scandir(cnh)):
-        # Iterar sobre todos os arquivos no diretório
-        for filename in os.listdir(cnh):
-            file_path = os.path.join(cnh, filename)
+    print_results(items, data_list)
 
-            print(f"Processando arquivo: {filename} ...")
 
-            # Processar cada arquivo e obter o dicionário de dados
-            data = extract_cnh(model, file_path, limiar_conf=0,show_image=True)
+def command_replay(args):
+    # Reextrai os campos das palavras gravadas com "processar --salvar-palavras" e compara com uma execução anterior
+    start = time.perf_counter()
+    results = replay(args.pasta, FIELD_EXTRACTORS, args.tipo)
+    elapsed = time.perf_counter() - start
 
-            print(data)
+    if args.saida:
+        write_results(args.saida, results)
+    if not args.saida and not args.comparar:
+        for result in results:
+            print(f"Documento: {result['documento']}")
+            print(result["dados"])
+    print(f"{len(results)} documentos reextraídos em {elapsed:.2f} s")
 
-    if any(os.scandir(rg_t1)):
-         # Obter a lista de arquivos no diretório
-        files = os.listdir(rg_t1)
+    if args.comparar:
+        previous = [result for result in read_results(args.comparar) if args.tipo in (None, result["tipo"])]
+        diff = diff_results(previous, results)
+        for change in diff["alteracoes"]:
+            print(f"{change['documento']} [{change['campo']}]: {change['antes']!r} -> {change['depois']!r}")
+        print(f"Campos alterados: {len(diff['alteracoes'])} em "
+              f"{len({change['documento'] for change in diff['alteracoes']})} documentos; "
+              f"novos: {len(diff['novos'])}; ausentes: {len(diff['ausentes'])}")
 
-        # Iterar sobre os arquivos de dois em dois
-        for i in range(0, len(files), 2):
-            file1 = os.path.join(rg_t1, files[i])
-            file2 = os.path.join(rg_t1, files[i+1]) if i+1 < len(files) else None
 
-            print(f"Processando arquivos: {files[i]} e {files[i+1] if file2 else 'N/A'} ...")
+def command_classificar(args):
+    # Pasta mista: cada imagem é classificada pelo texto do primeiro OCR e segue para o extrator do seu tipo
+    from document_classifier import iter_classify
 
-            # Processar cada arquivo e obter o dicionário de dados
-            data = extract_rg_novo(model, file1, file2, limiar_conf=0,show_image=True)
+    cache = OcrCache(args.cache) if args.cache else None
+    options = {"skew_mode": args.skew_mode}
+    if args.recortar:
+        options["crop"] = True
+    if args.salvar_palavras:
+        options["words_dir"] = args.salvar_palavras
 
-            print(data)
+    paths = [os.path.join(args.pasta, name) for name in sorted(os.listdir(args.pasta))
+             if is_image_file(name) and os.path.isfile(os.path.join(args.pasta, name))]
+    model = load_ocr_model(**model_options(args))
+    if args.saida:
+        write_results(args.saida, [])
 
-    if any(os.scandir(rg_t2)):
-        # Iterar sobre todos os arquivos no diretório
-        for filename in os.listdir(rg_t2):
-            file_path = os.path.join(rg_t2, filename)
+    # A pasta é classificada em partes de alguns lotes, como em processar: os resultados são exibidos e gravados
+    # ao final de cada parte
+    counts = {}
+    for results in iter_classify(model, paths, batch_size=args.batch_size,
+                                 chunk_size=args.batch_size * CHUNK_BATCHES, cache=cache, **options):
+        for result in results:
+            names = " e ".join(os.path.basename(path) if path else "N/A" for path in result["arquivos"])
+            print(f"Arquivo: {names} ({result['tipo'] or 'não classificado'})")
+            print(result["dados"])
+            counts[result["tipo"] or "não classificado"] = counts.get(result["tipo"] or "não classificado", 0) + 1
+        if args.saida:
+            write_results(args.saida, results, mode="a")
+    print("Documentos por tipo: " + ", ".join(f"{doc_type}: {count}" for doc_type, count in counts.items()))
 
-            print(f"Processando arquivo: {filename} ...")
+    if cache is not None:
+        cache.close()
 
-            # Processar cada arquivo e obter o dicionário de dados
-            data = data = extract_rg_antigo(model, file_path, limiar_conf=0,show_image=True)
 
-            print(data)
- 
\ No newline at end of file
+def command_calibrar(args):
+    # Mede as regiões dos campos nas palavras gravadas com "processar --recortar --salvar-palavras"
+    templates = calibrate_templates(args.pasta, FIELD_EXTRACTORS, args.tipo, args.min_documentos)
+    for doc_type, template in templates.items():
+        fields = [field for page in template["paginas"] for field in page["campos"]]
+        anchors = [anchor["texto"] for page in template["paginas"] for anchor in page["ancoras"]]
+        print(f"{doc_type}: {template['documentos']} documentos; campos: {', '.join(fields)}; "
+              f"palavras fixas: {', '.join(anchors) or 'nenhuma'}")
+    if not templates:
+        print("Nenhum template medido: poucos documentos ou campos não localizados na maioria deles.")
+        return
+    save_templates(args.saida, templates)
+    print(f"Templates gravados em {args.saida}")
+
+
+def command_servidor(argv):
+    import ocr_server
+    ocr_server.main(argv)
+
+
+def command_benchmark(argv):
+    import benchmark
+    benchmark.main(argv)
+
+
+def command_monitorar(argv):
+    import watch_folders
+    watch_folders.main(argv)
+
+
+# Subcomandos que repassam os argumentos para o módulo correspondente
+DELEGATED_COMMANDS = {
+    "servidor": command_servidor,
+    "benchmark": command_benchmark,
+    "monitorar": command_monitorar,
+}
+
+
+def add_folder_arguments(parser):
+    for doc_type in DEFAULT_FOLDERS:
+        parser.add_argument("--" + doc_type.replace("_", "-"), dest=doc_type, metavar="PASTA",
+                            help=f"Pasta com as imagens do tipo {doc_type} (padrão: {DEFAULT_FOLDERS[doc_type]})")
+    parser.add_argument("--manifesto-rg", metavar="ARQUIVO",
+                        help="CSV com as colunas frente e verso (nomes dos arquivos) para parear o RG novo; "
+                             "sem ele, os lados são identificados por <documento>_frente e <documento>_verso")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Extração de dados de Cartão SUS, CNH e RG por OCR.")
+    subparsers = parser.add_subparsers(dest="comando", metavar="COMANDO")
+
+    processar = subparsers.add_parser("processar", help="Executa o OCR e extrai os campos das imagens das pastas")
+    add_folder_arguments(processar)
+    processar.add_argument("--workers", type=int, default=1,
+                           help="Número de processos, cada um com o seu modelo (padrão: 1, sem paralelismo)")
+    processar.add_argument("--batch-size", type=int, default=8,
+                           help="Quantidade de imagens enviadas ao modelo em cada chamada")
+    add_model_arguments(processar)
+    add_cascade_arguments(processar)
+    processar.add_argument("--skew-mode", choices=["ocr", "deteccao"], default="ocr",
+                           help='Estimativa da inclinação: "ocr" (OCR completo) ou "deteccao" (apenas detecção)')
+    processar.add_argument("--recortar", action="store_true",
+                           help="Localiza e recorta o documento antes do OCR (fotos em que o documento ocupa só parte da imagem)")
+    processar.add_argument("--templates", metavar="ARQUIVO",
+                           help="Regiões dos campos gravadas com calibrar: CNH e RG são lidos só nessas regiões")
+    processar.add_argument("--cache", metavar="ARQUIVO",
+                           help="Arquivo SQLite do cache de OCR; imagens já processadas não passam pelo modelo")
+    processar.add_argument("--cache-max-mb", type=int, default=2048,
+                           help="Tamanho máximo do cache de OCR em MB")
+    processar.add_argument("--exportar", action="append", metavar="ARQUIVO",
+                           help="Grava os resultados (arquivos, tipo, campos, confiança de cada campo e tempos) à "
+                                "medida que os lotes terminam, em .jsonl, .csv ou .parquet (requer pyarrow); "
+                                "pode ser repetido")
+    processar.add_argument("--parquet-linhas", type=int, default=10000,
+                           help="Linhas por grupo (row group) na saída em Parquet")
+    processar.add_argument("--metricas", metavar="ARQUIVO",
+                           help="Grava em JSON lines a duração de cada estágio por documento")
+    processar.add_argument("--metricas-prometheus", metavar="ARQUIVO",
+                           help="Grava ao final os totais por estágio no formato texto do Prometheus")
+    processar.add_argument("--salvar-linhas", metavar="PASTA",
+                           help="Grava as linhas do OCR de cada imagem (<tipo>/<imagem>.txt) para uso com reextrair")
+    processar.add_argument("--salvar-palavras", metavar="PASTA",
+                           help="Grava as palavras do OCR de cada documento (<tipo>/<imagem>.npz) para uso com replay")
+    processar.add_argument("--nao-exibir", action="store_true",
+                           help="Não exibe o resultado do OCR sobre as imagens")
+    processar.set_defaults(func=command_processar)
+
+    listar = subparsers.add_parser("listar", help="Lista os tipos de documento e os itens de cada pasta")
+    add_folder_arguments(listar)
+    listar.set_defaults(func=command_listar)
+
+    reextrair = subparsers.add_parser("reextrair",
+                                      help="Extrai os campos a partir das linhas de OCR gravadas, sem o modelo")
+    reextrair.add_argument("--tipo", required=True, choices=list(FIELD_EXTRACTORS))
+    reextrair.add_argument("arquivos", nargs="+",
+                           help="Arquivos .txt ou pastas gravados com --salvar-linhas "
+                                "(RG novo: pares por <documento>_frente/_verso ou, fora da convenção, na ordem dada)")
+    reextrair.set_defaults(func=command_reextrair)
+
+    replay_parser = subparsers.add_parser(
+        "replay", help="Reextrai os campos das palavras de OCR gravadas, sem o modelo, e compara com execuções anteriores")
+    replay_parser.add_argument("pasta", help="Pasta gravada com processar --salvar-palavras")
+    replay_parser.add_argument("--tipo", choices=list(FIELD_EXTRACTORS), help="Apenas um tipo de documento")
+    replay_parser.add_argument("--saida", metavar="ARQUIVO", help="Grava os resultados em JSON lines")
+    replay_parser.add_argument("--comparar", metavar="ARQUIVO",
+                               help="Resultados de uma execução anterior (JSON lines gravado com --saida)")
+    replay_parser.set_defaults(func=command_replay)
+
+    classificar = subparsers.add_parser(
+        "classificar", help="Classifica as imagens de uma pasta mista pelo texto do OCR e extrai os campos de cada tipo")
+    classificar.add_argument("pasta", help="Pasta com imagens de qualquer tipo (RG novo: frente e verso vizinhos)")
+    classificar.add_argument("--saida", metavar="ARQUIVO", help="Grava os resultados em JSON lines")
+    classificar.add_argument("--batch-size", type=int, default=8)
+    add_model_arguments(classificar)
+    classificar.add_argument("--skew-mode", choices=["ocr", "deteccao"], default="ocr")
+    classificar.add_argument("--recortar", action="store_true",
+                             help="Localiza e recorta o documento antes do OCR")
+    classificar.add_argument("--cache", metavar="ARQUIVO", help="Arquivo SQLite do cache de OCR")
+    classificar.add_argument("--salvar-palavras", metavar="PASTA",
+                             help="Grava as palavras do OCR de cada documento, no tipo classificado, para uso com replay")
+    classificar.set_defaults(func=command_classificar)
+
+    calibrar = subparsers.add_parser(
+        "calibrar", help="Mede as regiões dos campos de CNH e RG nas palavras de OCR gravadas (modo template)")
+    calibrar.add_argument("pasta", help="Pasta gravada com processar --recortar --salvar-palavras")
+    calibrar.add_argument("--tipo", choices=list(TEMPLATE_TYPES), help="Apenas um tipo de documento")
+    calibrar.add_argument("--saida", default="templates.json", metavar="ARQUIVO")
+    calibrar.add_argument("--min-documentos", type=int, default=5,
+                          help="Mínimo de documentos de um tipo para medir as regiões")
+    calibrar.set_defaults(func=command_calibrar)
+
+    # Listados apenas na ajuda: os argumentos são tratados pelos próprios módulos
+    subparsers.add_parser("servidor", help="Serviço HTTP local de extração (ocr_server.py)")
+    subparsers.add_parser("benchmark", help="Benchmark com documentos sintéticos (benchmark.py)")
+    subparsers.add_parser("monitorar", help="Monitora as pastas e processa os arquivos novos (watch_folders.py)")
+
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+
+    # Sem subcomando, processa as pastas padrão (comportamento anterior de "python main.py [opções]")
+    if not argv or (argv[0].startswith("-") and argv[0] not in ("-h", "--help")):
+        argv = ["processar"] + argv
+
+    if argv[0] in DELEGATED_COMMANDS:
+        DELEGATED_COMMANDS[argv[0]](argv[1:])
+        return
+
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
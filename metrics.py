@@ -0,0 +1,252 @@
+import json
+import os
+import threading
+import time
+
+# Instrumentação opcional dos pipelines. Desativada por padrão: cada ponto de medição custa apenas
+# o teste da flag "enabled" e nenhuma estrutura é criada.
+enabled = False
+
+_lock = threading.Lock()
+_local = threading.local()
+_output = None
+_collect = False
+_collected = []
+
+# Totais acumulados dos documentos finalizados
+_stage_totals = {}  # estágio -> [documentos, segundos]
+_counters = {"documentos": 0, "inclinados": 0, "palavras": 0, "cache": 0}
+
+
+def enable(jsonl_path=None, collect=False):
+    # jsonl_path: grava um registro por documento; collect: guarda os registros para drain()
+    global enabled, _output, _collect
+    with _lock:
+        if jsonl_path is not None:
+            _output = open(jsonl_path, "a", encoding="utf-8")
+        _collect = collect
+        enabled = True
+
+
+def disable():
+    global enabled, _output
+    with _lock:
+        enabled = False
+        if _output is not None:
+            _output.close()
+            _output = None
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class StageTimer:
+    __slots__ = ("records", "stage", "start")
+
+    def __init__(self, records, stage):
+        self.records = records
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        add_stage(self.records, self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def timer(records, stage):
+    # Mede um estágio; a duração é dividida igualmente entre os documentos do lote
+    if not enabled:
+        return NULL_TIMER
+    return StageTimer(records, stage)
+
+
+def add_stage(records, stage, seconds):
+    records = [record for record in records if record is not None]
+    if not records:
+        return
+    share = seconds / len(records)
+    for record in records:
+        record["estagios"][stage] = record["estagios"].get(stage, 0) + share
+
+
+def document_label(source):
+    if isinstance(source, str):
+        return source
+    return f"<{type(source).__name__}>"
+
+
+def new_records(sources):
+    # Um registro por documento, ou None para cada documento quando a instrumentação está desativada
+    if not enabled:
+        return [None] * len(sources)
+    return [{"documento": document_label(source), "estagios": {}} for source in sources]
+
+
+def set_field(record, field, value):
+    if record is not None:
+        record[field] = value
+
+
+# Medição da detecção e do reconhecimento dentro da chamada do modelo
+######################################################################
+
+def instrument_model(model):
+    # Registra uma única vez os hooks nos preditores de detecção e reconhecimento (módulos PyTorch)
+    if getattr(model, "metrics_hooks", False):
+        return
+
+    for attribute, stage in (("det_predictor", "deteccao"), ("reco_predictor", "reconhecimento")):
+        module = getattr(model, attribute, None)
+        if hasattr(module, "register_forward_pre_hook"):
+            module.register_forward_pre_hook(lambda module, inputs, stage=stage: hook_start(stage))
+            module.register_forward_hook(lambda module, inputs, output, stage=stage: hook_end(stage))
+
+    model.metrics_hooks = True
+
+
+def hook_start(stage):
+    if enabled and getattr(_local, "model_records", None) is not None:
+        _local.hook_start = time.perf_counter()
+
+
+def hook_end(stage):
+    if enabled and getattr(_local, "model_records", None) is not None:
+        add_stage(_local.model_records, _local.prefix + stage, time.perf_counter() - _local.hook_start)
+
+
+class ModelCallTimer(StageTimer):
+    __slots__ = ("prefix",)
+
+    def __init__(self, records, prefix):
+        super().__init__(records, prefix + "ocr")
+        self.prefix = prefix
+
+    def __enter__(self):
+        _local.model_records = self.records
+        _local.prefix = self.prefix
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        _local.model_records = None
+        return super().__exit__(*exc)
+
+
+def model_call(model, records, prefix=""):
+    # Mede a chamada completa do modelo e, quando possível, a detecção e o reconhecimento separadamente
+    if not enabled:
+        return NULL_TIMER
+    instrument_model(model)
+    return ModelCallTimer(records, prefix)
+
+
+# Registros do último lote processado na thread, para que o extrator complete e finalize os registros
+#######################################################################################################
+
+def set_batch(records):
+    # Registros ainda pendentes de um lote anterior (por exemplo, pipeline chamado sem extrator) são finalizados
+    pending = getattr(_local, "batch", None)
+    if pending:
+        finish(pending)
+    _local.batch = records if enabled else None
+
+
+def take_batch(count):
+    records = getattr(_local, "batch", None)
+    _local.batch = None
+    if records is None:
+        return [None] * count
+    return records
+
+
+def finish(records):
+    records = [record for record in records if record is not None]
+    if not records:
+        return
+
+    with _lock:
+        for record in records:
+            for stage, seconds in record["estagios"].items():
+                totals = _stage_totals.setdefault(stage, [0, 0.0])
+                totals[0] += 1
+                totals[1] += seconds
+            _counters["documentos"] += 1
+            _counters["inclinados"] += bool(record.get("inclinado"))
+            _counters["palavras"] += record.get("palavras", 0)
+            _counters["cache"] += bool(record.get("cache"))
+
+            if _output is not None:
+                _output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if _collect:
+                _collected.append(record)
+
+        if _output is not None:
+            _output.flush()
+
+
+def drain():
+    # Retorna e descarta os registros guardados (usado pelos processos de trabalho)
+    global _collected
+    with _lock:
+        records, _collected = _collected, []
+    return records
+
+
+def ingest(records):
+    # Incorpora registros vindos de outro processo
+    finish(records)
+
+
+# Exportação
+############
+
+def prometheus_snapshot():
+    lines = [
+        "# HELP ocr_estagio_segundos_total Tempo acumulado por estágio do pipeline.",
+        "# TYPE ocr_estagio_segundos_total counter",
+    ]
+    with _lock:
+        for stage, (count, seconds) in sorted(_stage_totals.items()):
+            lines.append(f'ocr_estagio_segundos_total{{estagio="{stage}"}} {seconds:.6f}')
+        lines += [
+            "# HELP ocr_estagio_documentos_total Documentos que passaram por cada estágio.",
+            "# TYPE ocr_estagio_documentos_total counter",
+        ]
+        for stage, (count, seconds) in sorted(_stage_totals.items()):
+            lines.append(f'ocr_estagio_documentos_total{{estagio="{stage}"}} {count}')
+
+        lines += [
+            "# HELP ocr_documentos_total Documentos processados.",
+            "# TYPE ocr_documentos_total counter",
+            f"ocr_documentos_total {_counters['documentos']}",
+            "# HELP ocr_documentos_inclinados_total Documentos reprocessados após a correção de inclinação.",
+            "# TYPE ocr_documentos_inclinados_total counter",
+            f"ocr_documentos_inclinados_total {_counters['inclinados']}",
+            "# HELP ocr_documentos_cache_total Documentos atendidos pelo cache de OCR.",
+            "# TYPE ocr_documentos_cache_total counter",
+            f"ocr_documentos_cache_total {_counters['cache']}",
+            "# HELP ocr_palavras_total Palavras reconhecidas.",
+            "# TYPE ocr_palavras_total counter",
+            f"ocr_palavras_total {_counters['palavras']}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    # Escrita atômica, para que um coletor nunca leia um arquivo pela metade
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_snapshot())
+    os.replace(tmp_path, path)
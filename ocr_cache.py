@@ -0,0 +1,135 @@
+import hashlib
+import io
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from auxiliary_functions import PageWords
+
+# Versão do formato das entradas; alterar invalida os resultados gravados anteriormente
+CACHE_VERSION = 5
+
+
+def encode_entry(entry):
+    # Entrada (meta_data, palavras, inclinado) em bytes de um .npz sem objetos Python: os arrays de cada PageWords
+    # (textos como str) e um membro JSON com as dimensões e a inclinação, como em ocr_replay; a leitura usa
+    # allow_pickle=False, de modo que um arquivo de cache adulterado não executa código
+    meta_data, words, skewed = entry
+    pages = [meta_data] if meta_data is words else [meta_data, words]
+    arrays = {}
+    for idx, page in enumerate(pages):
+        arrays[f"textos{idx}"] = np.asarray(page.texts, dtype=str)
+        arrays[f"geometria{idx}"] = np.asarray(page.geometries, dtype=np.float32).reshape(-1, 4, 2)
+        arrays[f"confianca{idx}"] = np.asarray(page.confidences, dtype=np.float32)
+    header = {
+        "paginas": [{"dimensoes": [int(size) for size in page.dimensions] if page.dimensions is not None else None,
+                     "inclinado": bool(page.skewed)} for page in pages],
+        "inclinado": bool(skewed),
+    }
+    buffer = io.BytesIO()
+    np.savez(buffer, entrada=np.array(json.dumps(header)), **arrays)
+    return buffer.getvalue()
+
+
+def decode_entry(value):
+    with np.load(io.BytesIO(value), allow_pickle=False) as data:
+        header = json.loads(str(data["entrada"]))
+        pages = []
+        for idx, page in enumerate(header["paginas"]):
+            dimensions = tuple(page["dimensoes"]) if page["dimensoes"] is not None else None
+            pages.append(PageWords(data[f"textos{idx}"].astype(object), data[f"geometria{idx}"],
+                                   data[f"confianca{idx}"], dimensions, page["inclinado"]))
+    return pages[0], pages[-1], header["inclinado"]
+
+
+class OcrCache:
+    # Cache persistente dos resultados de OCR, endereçado pelo conteúdo da imagem.
+    # As entradas guardam o resultado sem filtro de confiança, de modo que uma mesma entrada
+    # atende a qualquer limiar_conf; a remoção segue a ordem do acesso mais antigo (LRU).
+
+    def __init__(self, path="ocr_cache.sqlite", max_bytes=2 * 1024 ** 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        # O modo WAL permite que vários processos usem o mesmo arquivo
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self.connection.commit()
+
+        # Tamanho aproximado do cache; o valor exato só é consultado quando o limite parece excedido
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def config_key(model_config, **pipeline_options):
+        # Identifica a configuração do modelo e do pipeline que produziu o resultado
+        config = dict(model_config, **pipeline_options, versao=CACHE_VERSION)
+        return json.dumps(config, sort_keys=True)
+
+    @staticmethod
+    def key(image, config_key):
+        # Hash do conteúdo da imagem (bytes do arquivo ou imagem decodificada) e da configuração
+        digest = hashlib.sha256(config_key.encode("utf-8"))
+        if isinstance(image, np.ndarray):
+            digest.update(str(image.shape).encode("utf-8"))
+            digest.update(np.ascontiguousarray(image).tobytes())
+        else:
+            digest.update(image)
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+
+        return decode_entry(row[0])
+
+    def put(self, key, entry):
+        value = encode_entry(entry)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()))
+            self.total_bytes += len(value)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        # Remove as entradas acessadas há mais tempo até o cache caber no limite
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+        removed = []
+        for key, size in self.connection.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            removed.append((key,))
+            total -= size
+
+        self.connection.executemany("DELETE FROM entries WHERE key = ?", removed)
+        self.total_bytes = total
+
+    def stats(self):
+        with self.lock:
+            count, size = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"acertos": self.hits, "falhas": self.misses, "entradas": count, "bytes": size}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
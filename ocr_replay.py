@@ -0,0 +1,152 @@
+import json
+import os
+
+import numpy as np
+
+from auxiliary_functions import filter_word_arrays, group_words_by_lines_np
+
+# Armazenamento das palavras do OCR de cada documento (.npz) e reextração dos campos sem o modelo
+# Cada arquivo guarda as palavras de todas as páginas do documento (frente e verso no RG novo):
+# textos, geometria (N, 4, 2), confiança e página de cada palavra; e os metadados do documento: tipo, imagem
+# de origem e correção de inclinação de cada página e o limiar de confiança usado na extração
+
+
+def document_words_path(words_dir, doc_type, sources):
+    # <pasta>/<tipo>/<nome da primeira imagem>.npz; documentos sem caminho de arquivo não são gravados
+    names = [source for source in sources if isinstance(source, str)]
+    if not names:
+        return None
+    name = os.path.splitext(os.path.basename(names[0]))[0]
+    return os.path.join(words_dir, doc_type, name + ".npz")
+
+
+def save_document_words(words_dir, doc_type, sources, outputs, limiar_conf=None):
+    # outputs: saídas do pipeline com return_words=True, uma por página (None para imagens ausentes)
+    path = document_words_path(words_dir, doc_type, sources)
+    if path is None:
+        return None
+
+    texts, geometries, confidences, pages, skewed = [], [], [], [], []
+    for page, output in enumerate(outputs):
+        if output is None:
+            skewed.append(False)
+            continue
+        _, _, (page_texts, page_geometries, page_confidences), page_skewed = output
+        texts.append(np.asarray(page_texts, dtype=str))
+        geometries.append(np.asarray(page_geometries, dtype=np.float32).reshape(-1, 4, 2))
+        confidences.append(np.asarray(page_confidences, dtype=np.float32))
+        pages.append(np.full(len(page_texts), page, dtype=np.int16))
+        skewed.append(bool(page_skewed))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(
+        path,
+        textos=np.concatenate(texts) if texts else np.array([], dtype=str),
+        geometria=np.concatenate(geometries) if geometries else np.zeros((0, 4, 2), dtype=np.float32),
+        confianca=np.concatenate(confidences) if confidences else np.zeros(0, dtype=np.float32),
+        pagina=np.concatenate(pages) if pages else np.zeros(0, dtype=np.int16),
+        # Metadados em um único membro JSON: cada membro do .npz custa uma leitura de cabeçalho no replay
+        documento=np.array(json.dumps({
+            "tipo": doc_type,
+            "fontes": [source if isinstance(source, str) else "" for source in sources],
+            "inclinado": skewed,
+            "limiar": limiar_conf,
+        }, ensure_ascii=False)),
+    )
+    return path
+
+
+def load_document_words(path):
+    with np.load(path, allow_pickle=False) as data:
+        document = json.loads(str(data["documento"]))
+        for key in ("textos", "geometria", "confianca", "pagina"):
+            document[key] = data[key]
+        return document
+
+
+def find_documents(words_dir, doc_type=None):
+    # Arquivos .npz da pasta (recursivamente), em ordem alfabética
+    paths = []
+    for root, _, files in os.walk(words_dir):
+        paths.extend(os.path.join(root, name) for name in files if name.endswith(".npz"))
+    paths.sort()
+    if doc_type is not None:
+        paths = [path for path in paths if os.path.basename(os.path.dirname(path)) == doc_type]
+    return paths
+
+
+def replay(words_dir, extractors, doc_type=None, tolerance=0.01):
+    # Agrupa as linhas de todas as páginas com uma única chamada vetorizada e aplica os extratores de cada tipo
+    # extractors: tipo -> função que recebe as linhas de cada página (document_types.FIELD_EXTRACTORS)
+    documents = []
+    geometries, texts, page_ids = [], [], []
+    num_pages = 0
+    for path in find_documents(words_dir, doc_type):
+        document = load_document_words(path)
+        document["documento"] = os.path.splitext(os.path.relpath(path, words_dir))[0].replace(os.sep, "/")
+        document["primeira_pagina"] = num_pages
+
+        words = (document["textos"], document["geometria"], document["confianca"])
+        for page in range(len(document["fontes"])):
+            keep = document["pagina"] == page
+            page_texts, page_geometries, _ = filter_word_arrays(tuple(array[keep] for array in words),
+                                                                document["limiar"])
+            texts.append(page_texts)
+            geometries.append(page_geometries)
+            page_ids.append(np.full(len(page_texts), num_pages, dtype=np.int64))
+            num_pages += 1
+        documents.append(document)
+
+    page_lines = group_words_by_lines_np(
+        np.concatenate(geometries + [np.zeros((0, 4, 2), dtype=np.float32)]),
+        np.concatenate(texts + [np.array([], dtype=str)]),
+        tolerance,
+        page_ids=np.concatenate(page_ids + [np.zeros(0, dtype=np.int64)]),
+        num_pages=num_pages)
+
+    results = []
+    for document in documents:
+        first = document["primeira_pagina"]
+        lines = page_lines[first:first + len(document["fontes"])]
+        results.append({
+            "documento": document["documento"],
+            "tipo": document["tipo"],
+            "fontes": document["fontes"],
+            "inclinado": document["inclinado"],
+            "dados": extractors[document["tipo"]](*lines),
+        })
+    return results
+
+
+def write_results(path, results, mode="w"):
+    # mode="a" acrescenta os resultados ao arquivo (gravação em partes)
+    with open(path, mode, encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+def read_results(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def diff_results(previous, current):
+    # Diferenças campo a campo entre duas execuções, pelo identificador do documento
+    previous = {result["documento"]: result for result in previous}
+    current = {result["documento"]: result for result in current}
+
+    changes = []
+    for document, result in current.items():
+        before = previous.get(document)
+        if before is None:
+            continue
+        for field in dict.fromkeys(list(before["dados"]) + list(result["dados"])):
+            old, new = before["dados"].get(field), result["dados"].get(field)
+            if old != new:
+                changes.append({"documento": document, "campo": field, "antes": old, "depois": new})
+
+    return {
+        "alteracoes": changes,
+        "novos": [document for document in current if document not in previous],
+        "ausentes": [document for document in previous if document not in current],
+    }
@@ -0,0 +1,178 @@
+import argparse
+import base64
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from auxiliary_functions import field_confidences, read_image
+from config_run_model import add_model_arguments, load_ocr_model, model_options, warmup_ocr_model
+from document_types import DOCUMENT_TYPES, PAGES_PER_ITEM, process_batch
+from template_fields import load_templates
+
+
+class MicroBatcher:
+    # Agrupa as requisições que chegam dentro de uma janela de tempo em uma única chamada do modelo
+
+    def __init__(self, model, doc_type, model_lock, max_batch_size=8, max_wait=0.02, **kwargs):
+        self.model = model
+        self.doc_type = doc_type
+        self.model_lock = model_lock
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.kwargs = kwargs
+        self.queue = queue.Queue()
+
+        thread = threading.Thread(target=self.run, name=f"batcher-{doc_type}", daemon=True)
+        thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self.queue.put((item, future))
+        return future.result()
+
+    def next_batch(self):
+        # Bloqueia até a primeira requisição e espera no máximo max_wait pelas seguintes
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def process(self, items):
+        # Um único modelo é compartilhado entre os tipos de documento; todas as páginas das requisições (frente e
+        # verso no RG novo) em uma única chamada do modelo
+        with self.model_lock:
+            return process_batch(self.model, self.doc_type, items,
+                                 batch_size=len(items) * PAGES_PER_ITEM[self.doc_type], **self.kwargs)
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                results = self.process([item for item, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                # Se o lote falhar (por exemplo, uma imagem inválida), as requisições são processadas uma a uma
+                # para que apenas a requisição com problema receba o erro
+                for item, future in batch:
+                    try:
+                        future.set_result(self.process([item])[0])
+                    except Exception as e:
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+def decode_payload(doc_type, body, content_type):
+    # Imagem enviada diretamente no corpo ou em JSON com base64
+    if not content_type.startswith("application/json"):
+        if doc_type == "rg_novo":
+            raise ValueError("O RG novo exige JSON com os campos 'frente' e 'verso' em base64.")
+        return read_image(body)
+
+    payload = json.loads(body)
+    if doc_type == "rg_novo":
+        frente = read_image(base64.b64decode(payload["frente"])) if payload.get("frente") else None
+        verso = read_image(base64.b64decode(payload["verso"])) if payload.get("verso") else None
+        return frente, verso
+
+    return read_image(base64.b64decode(payload["imagem"]))
+
+
+def make_handler(batchers):
+
+    class OcrRequestHandler(BaseHTTPRequestHandler):
+
+        def send_json(self, status, content):
+            body = json.dumps(content, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/saude":
+                self.send_json(200, {"status": "ok", "tipos": sorted(batchers)})
+            else:
+                self.send_json(404, {"erro": "Rota não encontrada."})
+
+        def do_POST(self):
+            doc_type = self.path.strip("/")
+            if doc_type not in batchers:
+                self.send_json(404, {"erro": f"Tipo de documento desconhecido: {doc_type}"})
+                return
+
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                # A decodificação acontece na thread da requisição, fora do lote
+                item = decode_payload(doc_type, body, self.headers.get("Content-Type", ""))
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_json(400, {"erro": f"Imagem inválida: {e}"})
+                return
+
+            try:
+                dados, *meta_data = batchers[doc_type].submit(item)
+            except Exception as e:
+                self.send_json(500, {"erro": str(e)})
+                return
+
+            self.send_json(200, {"dados": dados, "confiancas": field_confidences(dados, *meta_data)})
+
+    return OcrRequestHandler
+
+
+def serve(host="127.0.0.1", port=8000, max_batch_size=8, max_wait=0.02, skew_mode="ocr", crop=False,
+          templates=None, model_config=None):
+    # model_config: parâmetros de load_ocr_model (arquiteturas, backend e lotes internos)
+    model = warmup_ocr_model(load_ocr_model(**(model_config or {})))
+    model_lock = threading.Lock()
+
+    batchers = {
+        doc_type: MicroBatcher(model, doc_type, model_lock, max_batch_size, max_wait, skew_mode=skew_mode,
+                               crop=crop, templates=templates)
+        for doc_type in DOCUMENT_TYPES
+    }
+
+    server = ThreadingHTTPServer((host, port), make_handler(batchers))
+    print(f"Serviço de OCR em http://{host}:{port} (rotas: {', '.join('/' + t for t in batchers)})")
+    server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serviço HTTP local de extração de documentos.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=8,
+                        help="Máximo de requisições agrupadas em uma chamada do modelo")
+    parser.add_argument("--max-wait-ms", type=float, default=20,
+                        help="Tempo máximo de espera por novas requisições antes de executar o lote")
+    parser.add_argument("--skew-mode", choices=["ocr", "deteccao"], default="ocr")
+    add_model_arguments(parser)
+    parser.add_argument("--recortar", action="store_true",
+                        help="Localiza e recorta o documento antes do OCR (fotos em que o documento ocupa só parte da imagem)")
+    parser.add_argument("--templates", metavar="ARQUIVO",
+                        help="Regiões dos campos gravadas com main.py calibrar (modo template para CNH e RG)")
+    args = parser.parse_args(argv)
+
+    templates = load_templates(args.templates) if args.templates else None
+    serve(args.host, args.port, args.max_batch_size, args.max_wait_ms / 1000, args.skew_mode, args.recortar,
+          templates, model_options(args))
+
+
+if __name__ == "__main__":
+    main()
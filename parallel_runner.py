@@ -0,0 +1,138 @@
+import math
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cascade
+import config_run_model
+import metrics
+import template_fields
+from document_types import process_items
+from ocr_cache import OcrCache
+
+# Modelo, modelo rápido do modo cascata e cache de OCR de cada processo de trabalho
+worker_model = None
+worker_fast_model = None
+worker_cache = None
+
+
+def init_worker(torch_threads, cache_path=None, cache_max_bytes=None, metrics_enabled=False, model_options=None,
+                fast_model_options=None):
+    global worker_model, worker_fast_model, worker_cache
+    model_options = model_options or {}
+
+    # Divide os núcleos entre os processos para evitar disputa de threads
+    if model_options.get("backend", "pytorch").startswith("pytorch"):
+        import torch
+        torch.set_num_threads(torch_threads)
+
+    worker_model = config_run_model.load_ocr_model(**model_options)
+    if fast_model_options is not None:
+        worker_fast_model = config_run_model.load_ocr_model(**fast_model_options)
+
+    # Os registros de métricas são enviados ao processo principal junto com os resultados
+    if metrics_enabled:
+        metrics.enable(collect=True)
+
+    # Cada processo abre a sua conexão com o arquivo do cache
+    if cache_path is not None:
+        worker_cache = OcrCache(cache_path, cache_max_bytes)
+
+
+def process_chunk(task):
+    doc_type, items, batch_size, with_confidences, kwargs = task
+
+    stats_before = dict(config_run_model.deskew_stats)
+    template_before = dict(template_fields.template_stats)
+    cascade_before = dict(cascade.cascade_stats)
+    cache_before = (worker_cache.hits, worker_cache.misses) if worker_cache is not None else (0, 0)
+
+    # Um item com problema recebe o erro sem interromper os demais itens do lote
+    outputs = process_items(worker_model, doc_type, items, batch_size=batch_size, cache=worker_cache,
+                            fast_model=worker_fast_model, **kwargs)
+
+    stats_delta = {key: config_run_model.deskew_stats[key] - stats_before[key] for key in stats_before}
+    for key in template_before:
+        stats_delta["template_" + key] = template_fields.template_stats[key] - template_before[key]
+    for key in cascade_before:
+        stats_delta["cascata_" + key] = cascade.cascade_stats[key] - cascade_before[key]
+    if worker_cache is not None:
+        stats_delta["cache_acertos"] = worker_cache.hits - cache_before[0]
+        stats_delta["cache_falhas"] = worker_cache.misses - cache_before[1]
+
+    # Apenas os dicionários extraídos, os erros (e, se pedido, a confiança de cada campo) voltam ao processo
+    # principal
+    confidences = [output.get("confiancas") for output in outputs] if with_confidences else None
+    return [output["dados"] for output in outputs], confidences, [output.get("erro") for output in outputs], \
+        stats_delta, metrics.drain()
+
+
+def split_chunks(items, workers, batch_size):
+    # Lotes menores quando há poucos itens, para ocupar todos os processos
+    chunk_size = max(1, min(batch_size, math.ceil(len(items) / workers)))
+    return [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+
+
+def iter_parallel(jobs, workers, batch_size=8, cache=None, with_confidences=False, model_options=None,
+                  fast_model_options=None, **kwargs):
+    # jobs: lista de (tipo de documento, itens); gera (índice do job, itens do lote, dicionários, confianças,
+    # erros (None para os itens processados)) na ordem de entrada, à medida que os lotes terminam, sem acumular
+    # os resultados
+    # cache: OcrCache do processo principal; os processos de trabalho abrem o mesmo arquivo
+    # with_confidences: calcula nos processos de trabalho a confiança de cada campo (senão, None)
+    # model_options: parâmetros de config_run_model.load_ocr_model em cada processo
+    # fast_model_options: parâmetros do modelo rápido do modo cascata (cascade), carregado em cada processo
+    tasks = []
+    for job_idx, (doc_type, items) in enumerate(jobs):
+        for chunk in split_chunks(items, workers, batch_size):
+            tasks.append((job_idx, (doc_type, chunk, batch_size, with_confidences, kwargs)))
+
+    if not tasks:
+        return
+
+    workers = min(workers, len(tasks))
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    # "spawn" evita herdar o estado de threads do PyTorch do processo principal
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=init_worker,
+                             initargs=(torch_threads, cache.path if cache else None,
+                                       cache.max_bytes if cache else None, metrics.enabled,
+                                       model_options, fast_model_options)) as executor:
+        # No máximo 2 lotes por processo em andamento: um novo lote só é enviado quando o mais antigo é
+        # consumido, de modo que os resultados não se acumulam quando quem consome (por exemplo, a gravação) é
+        # mais lento que os processos
+        pending = deque(tasks)
+        in_flight = deque()
+        while pending and len(in_flight) < 2 * workers:
+            job_idx, task = pending.popleft()
+            in_flight.append((job_idx, task, executor.submit(process_chunk, task)))
+
+        while in_flight:
+            job_idx, task, future = in_flight.popleft()
+            data, confidences, errors, stats_delta, records = future.result()
+            if pending:
+                next_job_idx, next_task = pending.popleft()
+                in_flight.append((next_job_idx, next_task, executor.submit(process_chunk, next_task)))
+
+            metrics.ingest(records)
+            if cache is not None:
+                cache.hits += stats_delta.pop("cache_acertos")
+                cache.misses += stats_delta.pop("cache_falhas")
+            for key in template_fields.template_stats:
+                template_fields.template_stats[key] += stats_delta.pop("template_" + key)
+            for key in cascade.cascade_stats:
+                cascade.cascade_stats[key] += stats_delta.pop("cascata_" + key)
+            for key, value in stats_delta.items():
+                config_run_model.deskew_stats[key] += value
+            yield job_idx, task[1], data, confidences, errors
+
+
+def run_parallel(jobs, workers, batch_size=8, cache=None, **kwargs):
+    # Retorna os dicionários de cada job na ordem de entrada
+    outputs = [[] for _ in jobs]
+    for job_idx, _, data, _, _ in iter_parallel(jobs, workers, batch_size, cache, **kwargs):
+        outputs[job_idx].extend(data)
+    return outputs
@@ -0,0 +1,245 @@
+import csv
+import json
+import os
+import time
+
+# Gravação contínua dos resultados da extração em JSON lines, CSV ou Parquet (pela extensão do arquivo)
+# Cada lote é gravado assim que termina e nada fica acumulado em memória além do lote atual (no Parquet, do
+# grupo de linhas em formação). No JSON lines e no CSV, flush() grava os buffers e chama os.fsync ao final de
+# cada lote: uma interrupção perde no máximo o lote em andamento. O Parquet é opcional (pyarrow) e tem dois
+# modos: um único arquivo, que só fica legível depois de close() (o rodapé é gravado no fim) e é perdido por
+# inteiro se o processo for interrompido; ou arquivos parciais (parts=True), um arquivo Parquet completo por
+# lote, gravado com fsync e renomeado de forma atômica, para o monitoramento com checkpoint.
+
+# Colunas do CSV e do Parquet: uma linha por campo extraído de cada documento
+# (um documento sem campos, por exemplo com erro, ocupa uma linha com campo vazio)
+TABLE_COLUMNS = ["tipo", "arquivos", "campo", "valor", "confianca", "tempo_total", "tempos", "erro", "processado_em"]
+
+
+def item_paths(item):
+    # Arquivos de um item: um caminho ou o par (frente, verso) do RG novo
+    return [path for path in item if path is not None] if isinstance(item, tuple) else [item]
+
+
+def records_timings(records):
+    # Tempos por estágio de cada arquivo, a partir dos registros de métricas (metrics.drain); um arquivo lido
+    # mais de uma vez (por exemplo, pelos dois modelos do modo cascata) soma os tempos dos seus registros
+    timings = {}
+    for record in records:
+        stages = timings.setdefault(record["documento"], {})
+        for stage, seconds in record["estagios"].items():
+            stages[stage] = stages.get(stage, 0) + seconds
+    return timings
+
+
+def item_timings(item, timings):
+    # Tempos por estágio de um item, somando os arquivos (frente e verso); None sem registros de métricas
+    stages = {}
+    for path in item_paths(item):
+        for stage, seconds in timings.get(path, {}).items():
+            stages[stage] = stages.get(stage, 0) + seconds
+    return {stage: round(seconds, 6) for stage, seconds in stages.items()} or None
+
+
+def result_record(doc_type, item, dados, confiancas=None, tempos=None, erro=None):
+    # Registro de um documento: tipo, arquivos de origem, campos, confiança média de cada campo e tempos por estágio
+    record = {"tipo": doc_type, "arquivos": item_paths(item), "dados": dados, "confiancas": confiancas,
+              "tempos": tempos, "processado_em": time.time()}
+    if erro is not None:
+        record["erro"] = erro
+    return record
+
+
+def table_rows(record):
+    # Linhas do CSV e do Parquet de um registro
+    tempos = record.get("tempos")
+    base = {
+        "tipo": record["tipo"],
+        "arquivos": ";".join(record["arquivos"]),
+        "tempo_total": round(sum(tempos.values()), 6) if tempos else None,
+        "tempos": json.dumps(tempos, ensure_ascii=False) if tempos else None,
+        "erro": record.get("erro"),
+        "processado_em": record["processado_em"],
+    }
+    dados = record.get("dados") or {}
+    confiancas = record.get("confiancas") or {}
+    if not dados:
+        return [dict(base, campo=None, valor=None, confianca=None)]
+    return [dict(base, campo=field, valor=None if value is None else str(value), confianca=confiancas.get(field))
+            for field, value in dados.items()]
+
+
+class JsonlWriter:
+    # Um registro por linha; os registros são acrescentados ao arquivo existente
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class CsvWriter:
+    # Uma linha por campo; o cabeçalho só é gravado em um arquivo novo ou vazio
+    def __init__(self, path):
+        new_file = not os.path.isfile(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=TABLE_COLUMNS)
+        if new_file:
+            self.writer.writeheader()
+
+    def write(self, record):
+        self.writer.writerows(table_rows(record))
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class ParquetWriter:
+    # Uma linha por campo, gravada em grupos de row_group_size linhas; o arquivo é recriado a cada execução
+    # parts: cada flush() grava as linhas pendentes em um novo arquivo <nome>-<instante em ns>.parquet, ao lado de
+    # path, e os arquivos de execuções anteriores são mantidos (a pasta pode ser lida como um conjunto de
+    # dados, por exemplo com pandas.read_parquet em uma lista dos arquivos)
+    def __init__(self, path, row_group_size=10000, parts=False):
+        # O pyarrow só é necessário para a saída em Parquet
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("A saída em Parquet requer o pacote pyarrow (pip install pyarrow).") from None
+
+        self.pa = pyarrow
+        self.schema = pyarrow.schema([
+            ("tipo", pyarrow.string()),
+            ("arquivos", pyarrow.string()),
+            ("campo", pyarrow.string()),
+            ("valor", pyarrow.string()),
+            ("confianca", pyarrow.float64()),
+            ("tempo_total", pyarrow.float64()),
+            ("tempos", pyarrow.string()),
+            ("erro", pyarrow.string()),
+            ("processado_em", pyarrow.float64()),
+        ])
+        self.parquet = pyarrow.parquet
+        self.row_group_size = row_group_size
+        self.path = path
+        self.parts = parts
+        self.rows = []
+        if not parts:
+            self.file = open(path, "wb")
+            self.writer = pyarrow.parquet.ParquetWriter(self.file, self.schema)
+
+    def table(self, rows):
+        columns = {column: [row[column] for row in rows] for column in TABLE_COLUMNS}
+        return self.pa.table(columns, schema=self.schema)
+
+    def write(self, record):
+        self.rows.extend(table_rows(record))
+        if not self.parts and len(self.rows) >= self.row_group_size:
+            self.write_row_group()
+
+    def write_row_group(self):
+        # Grupos de exatamente row_group_size linhas; ao fechar, as linhas restantes formam o último grupo
+        if not self.rows:
+            return
+        rows, self.rows = self.rows[:self.row_group_size], self.rows[self.row_group_size:]
+        self.writer.write_table(self.table(rows), row_group_size=self.row_group_size)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def write_part(self):
+        # Arquivo Parquet completo com as linhas pendentes; gravado em um temporário e renomeado depois do
+        # fsync, para que uma interrupção não deixe um arquivo parcial com a extensão .parquet
+        if not self.rows:
+            return
+        root, extension = os.path.splitext(self.path)
+        part_path = f"{root}-{time.time_ns()}{extension}"
+        temp_path = part_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            self.parquet.write_table(self.table(self.rows), f, row_group_size=self.row_group_size)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, part_path)
+        self.rows = []
+
+    def flush(self):
+        # Arquivo único: os grupos de linhas completos já estão no disco, mas o arquivo só é legível depois de
+        # close(); as linhas restantes aguardam completar um grupo, para não fragmentar o arquivo
+        # Arquivos parciais: as linhas do lote vão para um novo arquivo, legível assim que flush() retorna
+        if self.parts:
+            self.write_part()
+
+    def close(self):
+        if self.parts:
+            self.write_part()
+            return
+        while self.rows:
+            self.write_row_group()
+        self.writer.close()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+WRITERS = {".jsonl": JsonlWriter, ".json": JsonlWriter, ".csv": CsvWriter, ".parquet": ParquetWriter}
+
+
+def open_writer(path, row_group_size=10000, parquet_parts=False):
+    # Escritor pela extensão do arquivo: .jsonl (ou .json), .csv ou .parquet
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in WRITERS:
+        raise ValueError(f"Formato de saída não suportado: {path} (use .jsonl, .csv ou .parquet)")
+    if extension == ".parquet":
+        return ParquetWriter(path, row_group_size, parquet_parts)
+    return WRITERS[extension](path)
+
+
+class ResultWriter:
+    # Grava os mesmos registros em um ou mais arquivos
+    # parquet_parts: saídas em Parquet gravadas em um arquivo por lote (ParquetWriter com parts=True), para que
+    # cada lote esteja legível no disco ao fim de write(), como nos demais formatos
+    def __init__(self, paths, row_group_size=10000, parquet_parts=False):
+        self.writers = []
+        try:
+            for path in paths:
+                self.writers.append(open_writer(path, row_group_size, parquet_parts))
+        except Exception:
+            self.close()
+            raise
+        self.count = 0
+
+    def write(self, records):
+        # Grava os registros de um lote e garante que estejam no disco antes de retornar
+        for record in records:
+            for writer in self.writers:
+                writer.write(record)
+            self.count += 1
+        self.flush()
+
+    def flush(self):
+        for writer in self.writers:
+            writer.flush()
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+        self.writers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,100 @@
+import csv
+import os
+import re
+
+# Pareamento da frente e do verso do RG novo
+# Os lados são reconhecidos pelo nome do arquivo (<documento>_frente.jpg e <documento>_verso.jpg; também
+# "-", "." ou espaço como separador e f/v ou front/back) ou por um manifesto CSV com as colunas frente e verso.
+# Arquivos fora da convenção e do manifesto são pareados de dois em dois na ordem recebida (as pastas são
+# listadas em ordem alfabética).
+
+SIDE_SUFFIX = re.compile(r'^(?P<documento>.+?)[\s._-]+(?P<lado>frente|verso|front|back|f|v)$', re.IGNORECASE)
+FRONT_SIDES = ("frente", "front", "f")
+
+
+def side_key(path):
+    # (documento, 0 para a frente ou 1 para o verso) pelo nome do arquivo; None fora da convenção
+    match = SIDE_SUFFIX.match(os.path.splitext(os.path.basename(path))[0])
+    if match is None:
+        return None
+    return match.group("documento").lower(), 0 if match.group("lado").lower() in FRONT_SIDES else 1
+
+
+def read_manifest(path):
+    # Pares (frente, verso) do manifesto, pelos nomes dos arquivos; o verso pode ficar em branco
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(row["frente"].strip(), (row.get("verso") or "").strip() or None) for row in csv.DictReader(f)]
+
+
+def pair_rg_files(paths, manifest=None):
+    # Retorna os pares (frente, verso), com None no lado ausente, em ordem alfabética, e o relatório:
+    # "sem_verso" e "sem_frente" (lados sem o par correspondente), "ordem" (pares formados pela ordem dos arquivos)
+    # e "manifesto_ausentes" (arquivos do manifesto que não estão na pasta)
+    by_name = {os.path.basename(path): path for path in paths}
+    pairs = []
+    report = {"sem_verso": [], "sem_frente": [], "ordem": [], "manifesto_ausentes": []}
+    used = set()
+
+    for front, back in manifest or []:
+        missing = [name for name in (front, back) if name is not None and name not in by_name]
+        report["manifesto_ausentes"].extend(missing)
+        if front in by_name:
+            pairs.append((by_name[front], by_name.get(back)))
+            used.update(name for name in (front, back) if name in by_name)
+            if by_name.get(back) is None:
+                report["sem_verso"].append(by_name[front])
+        elif back in by_name:
+            pairs.append((None, by_name[back]))
+            used.add(back)
+            report["sem_frente"].append(by_name[back])
+
+    sides = {}
+    others = []
+    for path in paths:
+        if os.path.basename(path) in used:
+            continue
+        key = side_key(path)
+        if key is None:
+            others.append(path)
+            continue
+        document, side = key
+        sides.setdefault(document, [[], []])[side].append(path)
+
+    for document in sorted(sides):
+        fronts, backs = (sorted(files, key=os.path.basename) for files in sides[document])
+        # Mais de um arquivo do mesmo lado: pareados na ordem dos nomes, as sobras seguem sozinhas
+        for i in range(max(len(fronts), len(backs))):
+            front = fronts[i] if i < len(fronts) else None
+            back = backs[i] if i < len(backs) else None
+            pairs.append((front, back))
+            if back is None:
+                report["sem_verso"].append(front)
+            elif front is None:
+                report["sem_frente"].append(back)
+
+    # Fora da convenção: de dois em dois, como antes
+    for i in range(0, len(others), 2):
+        pair = (others[i], others[i + 1] if i + 1 < len(others) else None)
+        pairs.append(pair)
+        report["ordem"].append(pair)
+        if pair[1] is None:
+            report["sem_verso"].append(pair[0])
+
+    pairs.sort(key=lambda pair: os.path.basename(pair[0] or pair[1]))
+    return pairs, report
+
+
+def pairing_messages(report):
+    # Linhas de aviso do relatório de pareamento
+    messages = []
+    for path in report["sem_verso"]:
+        messages.append(f"RG sem verso correspondente: {os.path.basename(path)}")
+    for path in report["sem_frente"]:
+        messages.append(f"RG sem frente correspondente: {os.path.basename(path)}")
+    for front, back in report["ordem"]:
+        if back is not None:
+            messages.append(f"RG pareado pela ordem dos arquivos (fora da convenção _frente/_verso): "
+                            f"{os.path.basename(front)} e {os.path.basename(back)}")
+    for name in report["manifesto_ausentes"]:
+        messages.append(f"Arquivo do manifesto não encontrado: {name}")
+    return messages
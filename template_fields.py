@@ -0,0 +1,397 @@
+import json
+import re
+
+import numpy as np
+
+import metrics
+from auxiliary_functions import PageWords, crop_document, filter_word_arrays, group_words_by_lines_np, page_to_arrays, \
+    read_image
+from config_run_model import run_ocr_batch
+from field_rules import COMPILED, DATE_PATTERNS, FIELD_RULES, PATTERNS, RG_PATTERNS, TRANSFORMS
+from ocr_replay import find_documents, load_document_words
+
+# Reconhecimento por regiões dos campos (modo template)
+# CNH, RG novo e RG antigo têm layout fixo: depois que a página é recortada e alinhada
+# (auxiliary_functions.crop_document), apenas as regiões dos campos passam pelo modelo. Os campos de uma
+# palavra (CPF, números e datas) vão direto para o reconhecimento (model.reco_predictor), sem detecção; os
+# campos de texto (nome e filiação) passam pelo OCR completo em recortes pequenos.
+# Documentos com alinhamento duvidoso (palavras fixas do layout não reconhecidas nas suas posições) ou com
+# algum campo fora do formato esperado seguem o caminho de página inteira.
+# As regiões de cada tipo são medidas nos documentos já processados, a partir das palavras gravadas com
+# "processar --recortar --salvar-palavras" (calibrate_templates).
+
+TEMPLATE_TYPES = ("cnh", "rg_novo", "rg_antigo")
+
+# Formato de cada campo: padrões de field_rules que o texto reconhecido na região deve satisfazer por inteiro
+# (o valor é o grupo 1, ou o texto todo nos padrões sem grupo)
+FIELD_FORMATS = {
+    "RG": RG_PATTERNS[1:],  # sem o padrão com o rótulo "REGISTRO GERAL": a região contém só o número
+    "CPF": ("cpf",),
+    "CNH": ("cnh",),
+    "Data de Nascimento": DATE_PATTERNS,
+    "Data de Expedicao": DATE_PATTERNS,
+    "Validade": ("data_cnh",),
+    "Primeira CNH": ("data_cnh",),
+}
+TYPE_FORMATS = {
+    "cnh": {"RG": ("rg_cnh",), "Data de Nascimento": ("data_cnh",)},
+}
+
+# Nome e filiação: pelo menos duas palavras, sem dígitos
+TEXT_FORMAT = re.compile(r"[^\W\d_]+(?:[\s'.-]+[^\W\d_]+)+")
+
+# Contadores: documentos recebidos no modo template e documentos resolvidos sem o caminho de página inteira
+template_stats = {"documentos": 0, "template": 0}
+
+
+def load_templates(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_templates(path, templates):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(templates, f, ensure_ascii=False, indent=2)
+
+
+def field_formats(doc_type, field):
+    return TYPE_FORMATS.get(doc_type, {}).get(field, FIELD_FORMATS.get(field))
+
+
+def field_sides(doc_type):
+    # Lado do documento (frente 0, verso 1) de onde cada campo é extraído
+    sides = {}
+    for fields, side, _ in FIELD_RULES[doc_type]["regras"]:
+        for field in fields if isinstance(fields, tuple) else (fields,):
+            sides[field] = side
+    return sides
+
+
+def validate_field(doc_type, field, text):
+    # Valor do campo se o texto reconhecido tiver o formato esperado; None caso contrário
+    text = " ".join(text.split())
+    formats = field_formats(doc_type, field)
+    if formats is None:
+        return text if TEXT_FORMAT.fullmatch(text) else None
+
+    for name in formats:
+        match = COMPILED[name].fullmatch(TRANSFORMS[PATTERNS[name][2]](text))
+        if match:
+            return match.group(1) if match.re.groups else match.group(0)
+    return None
+
+
+def region_crop(image, region):
+    # Recorte da região (x0, y0, x1, y1) em coordenadas relativas da página alinhada
+    (h, w) = image.shape[:2]
+    x0, y0, x1, y1 = region
+    left, top = min(int(x0 * w), w - 1), min(int(y0 * h), h - 1)
+    right, bottom = max(int(np.ceil(x1 * w)), left + 1), max(int(np.ceil(y1 * h)), top + 1)
+    return image[top:bottom, left:right]
+
+
+def region_box(region):
+    # Região (x0, y0, x1, y1) como geometria (4, 2) de uma palavra
+    x0, y0, x1, y1 = region
+    return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.float32)
+
+
+def template_batch(model, doc_type, items, template, fallback, batch_size=8, limiar_conf=0, min_alignment=0.6,
+                   min_confidence=0.3):
+    # Resultados no mesmo formato das funções em lote: (dados, meta_data de cada lado); no modo template
+    # meta_data tem as palavras reconhecidas nas regiões, com geometrias relativas à página recortada
+    # fallback: função que recebe a lista de itens recusados e as imagens já recortadas de cada caminho
+    # (caminho -> imagem) e os processa pelo caminho de página inteira, sem decodificar e recortar de novo
+    pages_spec = template["paginas"]
+    fields = FIELD_RULES[doc_type]["campos"]
+    if not all(any(field in spec["campos"] for spec in pages_spec) for field in fields):
+        # Template sem todos os campos do tipo: nada a ganhar com as regiões
+        return fallback(list(items), {})
+
+    documents = [item if isinstance(item, tuple) else (item,) for item in items]
+    records = metrics.new_records([pages[0] for pages in documents])
+    accepted = [len(pages) == len(pages_spec) and all(page is not None for page in pages) for pages in documents]
+    template_stats["documentos"] += sum(accepted)
+
+    # Recortes de todas as páginas: palavras fixas e campos de uma palavra para o reconhecimento direto,
+    # campos de texto para o OCR completo; refs: (documento, página, campo ou None para as palavras fixas,
+    # texto esperado ou região)
+    word_crops, word_refs = [], []
+    text_crops, text_refs = [], []
+    word_fields = [[] for _ in documents]
+    # Páginas recortadas de cada documento, reaproveitadas pelo caminho de página inteira se ele for recusado
+    cropped = [None] * len(documents)
+    for idx, (pages, record) in enumerate(zip(documents, records)):
+        try:
+            with metrics.timer([record], "recorte"):
+                aligned = [crop_document(read_image(page)) if page is not None else (None, False) for page in pages]
+        except (FileNotFoundError, ValueError):
+            # Imagem ausente ou corrompida: o caminho de página inteira trata e informa o erro
+            accepted[idx] = False
+            continue
+        cropped[idx] = [image for image, _ in aligned]
+        if not accepted[idx]:
+            continue
+
+        # Sem palavras fixas para medir o alinhamento, a página só é aceita se o documento foi localizado
+        if any(not found and not spec["ancoras"] for (_, found), spec in zip(aligned, pages_spec)):
+            accepted[idx] = False
+            continue
+
+        for page_idx, ((image, _), spec) in enumerate(zip(aligned, pages_spec)):
+            for anchor in spec["ancoras"]:
+                word_crops.append(region_crop(image, anchor["regiao"]))
+                word_refs.append((idx, page_idx, None, anchor["texto"]))
+            for field, region in spec["campos"].items():
+                if region["tipo"] == "palavra":
+                    word_crops.append(region_crop(image, region["regiao"]))
+                    word_refs.append((idx, page_idx, field, region))
+                    word_fields[idx].append(field)
+                else:
+                    text_crops.append(region_crop(image, region["regiao"]))
+                    text_refs.append((idx, page_idx, field, region))
+
+    # Uma chamada do reconhecimento para todos os recortes de uma palavra
+    with metrics.timer(records, "reconhecimento_regioes"):
+        predictions = model.reco_predictor(word_crops) if word_crops else []
+
+    dados_list = [dict.fromkeys(fields) for _ in documents]
+    anchors = [[0, 0] for _ in documents]
+    # Palavras reconhecidas nas regiões de cada página: (documento, página) -> [(textos, geometrias, confianças)]
+    region_words = {}
+    for (idx, page_idx, field, expected), (text, confidence) in zip(word_refs, predictions):
+        if field is None:
+            anchors[idx][0] += text.strip().upper() == expected
+            anchors[idx][1] += 1
+        elif confidence >= min_confidence:
+            dados_list[idx][field] = validate_field(doc_type, field, text)
+            texts = np.empty(1, dtype=object)
+            texts[0] = text
+            region_words.setdefault((idx, page_idx), []).append(
+                (texts, region_box(expected["regiao"])[None], np.array([confidence], dtype=np.float32)))
+
+    # Alinhamento e campos de uma palavra são conferidos antes do OCR dos campos de texto
+    for idx, (hits, total) in enumerate(anchors):
+        if not accepted[idx]:
+            continue
+        metrics.set_field(records[idx], "alinhamento", hits / total if total else None)
+        if total and hits / total < min_alignment:
+            accepted[idx] = False
+        elif any(dados_list[idx][field] is None for field in word_fields[idx]):
+            accepted[idx] = False
+
+    # Campos de texto: OCR completo nos recortes dos documentos ainda aceitos, em lotes, e as linhas de cada
+    # recorte unidas por espaço
+    pending = [(crop, ref) for crop, ref in zip(text_crops, text_refs) if accepted[ref[0]]]
+    text_results = run_ocr_batch(model, [crop for crop, _ in pending], batch_size,
+                                 records=[records[idx] for _, (idx, _, _, _) in pending],
+                                 prefix="regioes_") if pending else []
+    text_words = []
+    for result, (_, (_, _, _, region)) in zip(text_results, pending):
+        texts, geometries, confidences = filter_word_arrays(page_to_arrays(result.pages[0]), limiar_conf)
+        # Rótulos do layout descartados; geometrias levadas de volta à página para que a tolerância do
+        # agrupamento em linhas seja a mesma do caminho de página inteira
+        keep = ~np.isin(texts.astype(str), region.get("rotulos", []))
+        x0, y0, x1, y1 = region["regiao"]
+        geometries = geometries[keep] * np.array([x1 - x0, y1 - y0], dtype=np.float32) + \
+            np.array([x0, y0], dtype=np.float32)
+        text_words.append((texts[keep], geometries, confidences[keep]))
+    text_lines = group_words_by_lines_np(
+        np.concatenate([geometries for _, geometries, _ in text_words] + [np.zeros((0, 4, 2), dtype=np.float32)]),
+        np.concatenate([texts for texts, _, _ in text_words] + [np.empty(0, dtype=object)]),
+        page_ids=np.repeat(np.arange(len(text_words)), [len(texts) for texts, _, _ in text_words]),
+        num_pages=len(text_words))
+
+    for (_, (idx, page_idx, field, _)), words, lines in zip(pending, text_words, text_lines):
+        if len(words[2]) and words[2].mean() >= min_confidence:
+            dados_list[idx][field] = validate_field(doc_type, field, " ".join(lines))
+            region_words.setdefault((idx, page_idx), []).append(words)
+
+    results = [None] * len(documents)
+    for idx, pages in enumerate(documents):
+        if accepted[idx] and all(value is not None for value in dados_list[idx].values()):
+            meta_data = []
+            for page_idx, image in enumerate(cropped[idx]):
+                words = region_words.get((idx, page_idx), [])
+                meta_data.append(PageWords(
+                    np.concatenate([texts for texts, _, _ in words] + [np.empty(0, dtype=object)]),
+                    np.concatenate([geometries for _, geometries, _ in words] +
+                                   [np.zeros((0, 4, 2), dtype=np.float32)]),
+                    np.concatenate([confidences for _, _, confidences in words] + [np.zeros(0, dtype=np.float32)]),
+                    image.shape[:2]))
+            results[idx] = (dados_list[idx],) + tuple(meta_data)
+
+    done = [idx for idx, result in enumerate(results) if result is not None]
+    for idx in done:
+        metrics.set_field(records[idx], "template", True)
+    metrics.finish([records[idx] for idx in done])
+    template_stats["template"] += len(done)
+
+    # Os documentos recusados seguem juntos para o caminho de página inteira, com as páginas já recortadas: os
+    # caminhos continuam identificando as imagens (métricas e linhas gravadas) e as imagens recebidas em memória
+    # são substituídas pelos recortes
+    rejected = [idx for idx, result in enumerate(results) if result is None]
+    if rejected:
+        rejected_items, decoded = [], {}
+        for idx in rejected:
+            pages = list(documents[idx])
+            for page_idx, image in enumerate(cropped[idx] or []):
+                if image is None:
+                    continue
+                if isinstance(pages[page_idx], str):
+                    decoded[pages[page_idx]] = image
+                else:
+                    pages[page_idx] = image
+            rejected_items.append(tuple(pages) if isinstance(items[idx], tuple) else pages[0])
+        for idx, result in zip(rejected, fallback(rejected_items, decoded)):
+            results[idx] = result
+
+    return results
+
+
+def report_template_stats():
+    total = template_stats["documentos"]
+    template = template_stats["template"]
+    percentual = 100 * template / total if total else 0
+    return f"Documentos resolvidos pelas regiões dos campos: {template} de {total} ({percentual:.1f}%)"
+
+
+# Calibração das regiões a partir das palavras gravadas
+########################################################
+
+def words_box(geometries):
+    # Retângulo (x0, y0, x1, y1) que contém as palavras
+    return np.concatenate([geometries.min(axis=(0, 1)), geometries.max(axis=(0, 1))])
+
+
+def locate_value(texts, geometries, value):
+    # Índices das palavras da página que formam o valor de um campo; None se alguma palavra não for encontrada
+    # Palavras repetidas na página são resolvidas pela proximidade das palavras encontradas uma única vez
+    tokens = str(value).split()
+    candidates = []
+    for token in tokens:
+        found = np.flatnonzero(texts == token)
+        if len(found) == 0 and len(tokens) == 1:
+            found = np.array([i for i, text in enumerate(texts) if token in text], dtype=np.int64)
+        if len(found) == 0:
+            return None
+        candidates.append(found)
+
+    unique = [found[0] for found in candidates if len(found) == 1]
+    if not unique:
+        return None
+    centers = geometries.mean(axis=1)
+    reference = centers[unique].mean(axis=0)
+    return [found[np.argmin(np.abs(centers[found] - reference).sum(axis=1))] for found in candidates]
+
+
+def padded_region(boxes, heights, pad_x=0.15, pad_y=0.3):
+    # Região que contém as ocorrências observadas, com folga proporcional à altura do texto: na horizontal os
+    # percentis 2 e 98 (o comprimento do valor varia), na vertical a mediana (as linhas do layout são fixas)
+    height = float(np.median(heights))
+    x0, y0 = np.percentile(boxes[:, 0], 2), np.median(boxes[:, 1])
+    x1, y1 = np.percentile(boxes[:, 2], 98), np.median(boxes[:, 3])
+    return [round(float(np.clip(value, 0, 1)), 4) for value in
+            (x0 - pad_x * height, y0 - pad_y * height, x1 + pad_x * height, y1 + pad_y * height)]
+
+
+def region_labels(samples, side, field, region, min_share):
+    # Palavras que aparecem dentro da região na maioria dos documentos sem fazer parte do valor do campo
+    counts = {}
+    for dados, pages in samples:
+        texts, geometries = pages[side]
+        centers = geometries.mean(axis=1)
+        inside = (centers[:, 0] > region[0]) & (centers[:, 0] < region[2]) & \
+            (centers[:, 1] > region[1]) & (centers[:, 1] < region[3])
+        tokens = set(str(dados.get(field)).split())
+        for text in set(texts[inside].tolist()) - tokens:
+            counts[text] = counts.get(text, 0) + 1
+    return sorted(text for text, count in counts.items() if count >= min_share * len(samples))
+
+
+def build_template(doc_type, samples, min_share=0.8, max_anchors=3, max_spread=0.02):
+    # samples: (dados, páginas) de cada documento; página: (textos, geometrias) das palavras
+    count = len(samples)
+    num_pages = len(samples[0][1])
+    sides = field_sides(doc_type)
+
+    pages_spec = [{"campos": {}, "ancoras": []} for _ in range(num_pages)]
+    for field in FIELD_RULES[doc_type]["campos"]:
+        side = sides[field]
+        boxes, heights, single = [], [], True
+        for dados, pages in samples:
+            value = dados.get(field)
+            if value is None or side >= len(pages):
+                continue
+            texts, geometries = pages[side]
+            found = locate_value(texts, geometries, value)
+            if found is None:
+                continue
+            boxes.append(words_box(geometries[found]))
+            heights.append(np.median(geometries[found][:, :, 1].max(axis=1) - geometries[found][:, :, 1].min(axis=1)))
+            single = single and len(str(value).split()) == 1
+
+        # Um campo que não é localizado na maioria dos documentos inviabiliza o template do tipo
+        if len(boxes) < min_share * count:
+            return None
+        region = padded_region(np.array(boxes), np.array(heights))
+        pages_spec[side]["campos"][field] = {"regiao": region, "tipo": "palavra" if single else "texto"}
+        if not single:
+            # Rótulos dentro da região (por exemplo, "FILIAÇÃO" na linha do valor) são descartados na leitura
+            pages_spec[side]["campos"][field]["rotulos"] = region_labels(samples, side, field, region, min_share)
+
+    # Palavras fixas do layout (rótulos): únicas na página, presentes na maioria dos documentos
+    # e sempre na mesma posição; servem para medir o alinhamento
+    for side, spec in enumerate(pages_spec):
+        occurrences = {}
+        for dados, pages in samples:
+            values = {token for value in dados.values() if value is not None for token in str(value).split()}
+            texts, geometries = pages[side]
+            names, counts = np.unique(texts, return_counts=True)
+            for text in names[counts == 1]:
+                if len(text) >= 3 and text.isalpha() and text not in values:
+                    i = int(np.flatnonzero(texts == text)[0])
+                    occurrences.setdefault(text, []).append(geometries[i])
+
+        candidates = []
+        for text, geometries in occurrences.items():
+            if len(geometries) < min_share * count:
+                continue
+            geometries = np.array(geometries)
+            spread = float(geometries.mean(axis=1).std(axis=0).max())
+            if spread <= max_spread:
+                candidates.append((spread, text, geometries))
+
+        for _, text, geometries in sorted(candidates, key=lambda candidate: candidate[0])[:max_anchors]:
+            boxes = np.array([words_box(geometry[None]) for geometry in geometries])
+            spec["ancoras"].append({"texto": text.upper(),
+                                    "regiao": padded_region(boxes, boxes[:, 3] - boxes[:, 1])})
+
+    return {"documentos": count, "paginas": pages_spec}
+
+
+def calibrate_templates(words_dir, extractors, doc_type=None, min_documents=5, **kwargs):
+    # Mede as regiões dos campos de cada tipo nas palavras gravadas com "processar --recortar --salvar-palavras"
+    # extractors: tipo -> função que recebe as linhas de cada página (document_types.FIELD_EXTRACTORS)
+    samples = {}
+    for path in find_documents(words_dir, doc_type):
+        document = load_document_words(path)
+        if document["tipo"] not in TEMPLATE_TYPES:
+            continue
+
+        words = (document["textos"], document["geometria"], document["confianca"])
+        pages = []
+        for page in range(len(document["fontes"])):
+            keep = document["pagina"] == page
+            texts, geometries, _ = filter_word_arrays(tuple(array[keep] for array in words), document["limiar"])
+            pages.append((np.asarray(texts, dtype=str), geometries))
+
+        lines = [group_words_by_lines_np(geometries, texts) for texts, geometries in pages]
+        samples.setdefault(document["tipo"], []).append((extractors[document["tipo"]](*lines), pages))
+
+    templates = {}
+    for name, documents in samples.items():
+        template = build_template(name, documents, **kwargs) if len(documents) >= min_documents else None
+        if template is not None:
+            templates[name] = template
+    return templates
@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import time
+
+import metrics
+from auxiliary_functions import is_image_file
+from cascade import report_cascade_stats
+from config_run_model import add_cascade_arguments, add_model_arguments, cascade_model_options, load_ocr_model, \
+    model_options
+from document_types import DEFAULT_FOLDERS, process_items
+from ocr_cache import OcrCache
+from result_writer import ResultWriter, item_paths, item_timings, records_timings, result_record
+from rg_pairing import pair_rg_files, pairing_messages, side_key
+from template_fields import load_templates
+
+# Monitoramento das pastas de documentos: processa apenas os arquivos novos ou alterados
+# As pastas são varridas periodicamente com os.scandir (nome, tamanho e data de modificação, sem abrir os
+# arquivos); um arquivo só é processado depois de aparecer com a mesma assinatura em duas varreduras
+# seguidas, para não ler imagens que ainda estão sendo copiadas. Os arquivos concluídos ficam registrados
+# em um checkpoint, e um reinício continua de onde parou.
+# O checkpoint tem duas partes: o arquivo JSON com todos os arquivos concluídos e um diário (<checkpoint>.diario)
+# ao qual cada lote acrescenta apenas os seus arquivos; o diário é incorporado ao JSON quando fica tão grande
+# quanto ele, de modo que o custo por lote não cresce com o total de arquivos processados.
+
+# Tamanho mínimo do diário (em arquivos) antes da incorporação ao checkpoint
+JOURNAL_MIN_ENTRIES = 1000
+
+
+def scan_folder(folder):
+    # Assinatura (tamanho, data de modificação) de cada arquivo de imagem da pasta
+    files = {}
+    if not os.path.isdir(folder):
+        return files
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or not is_image_file(entry.name) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            files[os.path.abspath(entry.path)] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+
+def load_checkpoint(path):
+    # Arquivos já processados: caminho -> assinatura no momento do processamento (checkpoint e diário)
+    done = {}
+    if path is None:
+        return done
+    if os.path.isfile(path):
+        with open(path, encoding="utf-8") as f:
+            done = json.load(f)
+    for entries in read_journal(path + ".diario"):
+        done.update(entries)
+    return done
+
+
+def read_journal(path):
+    # Lotes registrados no diário, um objeto JSON por linha; uma última linha incompleta (interrupção durante a
+    # gravação) é ignorada, e os arquivos desse lote são processados novamente
+    if not os.path.isfile(path):
+        return []
+    batches = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                batches.append(json.loads(line))
+            except ValueError:
+                break
+    return batches
+
+
+def save_checkpoint(path, done):
+    # Gravação atômica: um arquivo temporário substitui o checkpoint anterior
+    if path is None:
+        return
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(done, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class Checkpoint:
+    # Arquivos concluídos (done) com gravação incremental: cada lote acrescenta uma linha ao diário (com fsync) e o
+    # checkpoint completo só é regravado quando o diário acumula tantos arquivos quanto ele
+    def __init__(self, path):
+        self.path = path
+        self.done = load_checkpoint(path)
+        self.journal_entries = 0
+        if path is not None:
+            # Diário de uma execução anterior incorporado desde o início
+            self.compact()
+
+    def add(self, entries):
+        self.done.update(entries)
+        if self.path is None or not entries:
+            return
+        with open(self.path + ".diario", "a", encoding="utf-8") as f:
+            f.write(json.dumps(entries, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_entries += len(entries)
+        if self.journal_entries >= max(JOURNAL_MIN_ENTRIES, len(self.done)):
+            self.compact()
+
+    def compact(self):
+        # Checkpoint completo gravado de forma atômica antes de esvaziar o diário: uma interrupção entre as duas
+        # etapas só deixa no diário arquivos que já estão no checkpoint
+        save_checkpoint(self.path, self.done)
+        with open(self.path + ".diario", "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_entries = 0
+
+
+def pending_files(current, previous, done):
+    # Arquivos estáveis (mesma assinatura na varredura anterior) ainda não processados nessa versão
+    return sorted(path for path, signature in current.items()
+                  if previous.get(path) == signature and done.get(path) != signature)
+
+
+def make_items(doc_type, files, complete=False, processed=(), expired=()):
+    # RG novo: pares (frente, verso) pelo nome dos arquivos (rg_pairing); um lado sem par aguarda a próxima
+    # varredura, exceto com complete=True ou quando está em expired (esperou demais pelo outro lado), e então é
+    # processado sozinho e informado
+    # processed: arquivos já processados e inalterados, que podem completar o par de um lado novo ou alterado
+    if doc_type == "rg_novo":
+        keys = {side_key(path)[0] for path in files if side_key(path) is not None}
+        partners = [path for path in processed if side_key(path) is not None and side_key(path)[0] in keys]
+        pairs, report = pair_rg_files(list(files) + partners)
+        pending = set(files)
+        pairs = [pair for pair in pairs if pending.intersection(pair)]
+        if not complete:
+            expired = set(expired)
+            pairs = [pair for pair in pairs if None not in pair or expired.intersection(pair)]
+            report = {"sem_verso": [path for path in report["sem_verso"] if path in expired],
+                      "sem_frente": [path for path in report["sem_frente"] if path in expired],
+                      "ordem": [], "manifesto_ausentes": []}
+        for message in pairing_messages(report):
+            print(message)
+        return pairs
+    return list(files)
+
+
+def watch(model, folders, checkpoint_path=None, writer=None, interval=2.0, batch_size=8, once=False,
+          pair_timeout=300, max_attempts=3, **kwargs):
+    # folders: tipo de documento -> pasta; once: processa os arquivos disponíveis e encerra
+    # writer: ResultWriter que recebe os resultados de cada lote (sem ele, os resultados são exibidos); com as
+    # métricas ativas (metrics.enable(collect=True)), os registros de cada lote dão os tempos de cada documento
+    # pair_timeout: segundos que um lado do RG novo aguarda o outro antes de ser processado sozinho
+    # max_attempts: tentativas de um arquivo com erro nesta execução; os arquivos com erro não entram no
+    # checkpoint, de modo que um reinício (ou uma alteração do arquivo) os processa novamente
+    checkpoint = Checkpoint(checkpoint_path)
+    done = checkpoint.done
+    previous = {}
+    # Lados do RG novo aguardando o par: caminho -> instante em que passaram a aguardar
+    waiting = {}
+    # Arquivos com erro: caminho -> [assinatura, tentativas]
+    failures = {}
+
+    while True:
+        current = {doc_type: scan_folder(folder) for doc_type, folder in folders.items()}
+        # Lados removidos da pasta deixam de aguardar o par
+        waiting = {path: since for path, since in waiting.items() if any(path in files for files in current.values())}
+
+        for doc_type in folders:
+            # Em uma execução única não há varredura anterior: os arquivos são tomados como estáveis
+            reference = current[doc_type] if once else previous.get(doc_type, {})
+            processed = sorted(path for path, signature in current[doc_type].items() if done.get(path) == signature)
+            files = [path for path in pending_files(current[doc_type], reference, done)
+                     if failures.get(path, [None, 0])[0] != current[doc_type][path]
+                     or failures[path][1] < max_attempts]
+            now = time.monotonic()
+            expired = [path for path in files if path in waiting and now - waiting[path] >= pair_timeout]
+            items = make_items(doc_type, files, once, processed, expired)
+
+            included = {path for item in items for path in item_paths(item)}
+            for path in files:
+                if path in included:
+                    waiting.pop(path, None)
+                else:
+                    waiting.setdefault(path, now)
+
+            for start in range(0, len(items), batch_size):
+                chunk = items[start:start + batch_size]
+                outputs = process_items(model, doc_type, chunk, batch_size, **kwargs)
+                timings = records_timings(metrics.drain())
+
+                records = []
+                entries = {}
+                for item, output in zip(chunk, outputs):
+                    records.append(result_record(doc_type, item, output["dados"], output.get("confiancas"),
+                                                 item_timings(item, timings), output.get("erro")))
+                    for path in item_paths(item):
+                        signature = current[doc_type][path]
+                        if output.get("erro") is None:
+                            entries[path] = signature
+                            failures.pop(path, None)
+                            continue
+                        # Falha talvez passageira (memória, arquivo em uso ou incompleto): nova tentativa nas
+                        # próximas varreduras, até max_attempts para a mesma assinatura
+                        attempts = failures[path][1] if failures.get(path, [None])[0] == signature else 0
+                        failures[path] = [signature, attempts + 1]
+
+                # Os resultados são gravados (com fsync; no Parquet, em um novo arquivo por lote) antes do
+                # checkpoint: um arquivo concluído no checkpoint sempre tem o seu resultado gravado
+                if writer is not None:
+                    writer.write(records)
+                else:
+                    for record in records:
+                        print(record)
+                checkpoint.add(entries)
+
+        if once:
+            if checkpoint_path is not None:
+                checkpoint.compact()
+            return done
+
+        previous = current
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monitora as pastas de documentos e processa os arquivos novos.")
+    for doc_type in DEFAULT_FOLDERS:
+        parser.add_argument("--" + doc_type.replace("_", "-"), dest=doc_type, metavar="PASTA",
+                            help=f"Pasta com as imagens do tipo {doc_type} (padrão: {DEFAULT_FOLDERS[doc_type]})")
+    parser.add_argument("--checkpoint", default="monitoramento.json", metavar="ARQUIVO",
+                        help="Arquivos já processados; um reinício continua de onde parou")
+    parser.add_argument("--resultados", nargs="+", default=["resultados.jsonl"], metavar="ARQUIVO",
+                        help="Resultados acrescentados à medida que os lotes terminam, em .jsonl, .csv ou .parquet "
+                             "(requer pyarrow; um arquivo <nome>-<instante>.parquet por lote)")
+    parser.add_argument("--parquet-linhas", type=int, default=10000,
+                        help="Linhas por grupo (row group) na saída em Parquet")
+    parser.add_argument("--intervalo", type=float, default=2.0, help="Segundos entre as varreduras das pastas")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--tentativas", type=int, default=3,
+                        help="Tentativas de um arquivo com erro antes de aguardar uma alteração ou um reinício")
+    parser.add_argument("--espera-par", type=float, default=300,
+                        help="Segundos que um lado do RG novo aguarda o outro antes de ser processado sozinho")
+    add_model_arguments(parser)
+    add_cascade_arguments(parser)
+    parser.add_argument("--skew-mode", choices=["ocr", "deteccao"], default="ocr")
+    parser.add_argument("--recortar", action="store_true",
+                        help="Localiza e recorta o documento antes do OCR (fotos em que o documento ocupa só parte da imagem)")
+    parser.add_argument("--templates", metavar="ARQUIVO",
+                        help="Regiões dos campos gravadas com main.py calibrar (modo template para CNH e RG)")
+    parser.add_argument("--cache", metavar="ARQUIVO", help="Arquivo SQLite do cache de OCR")
+    parser.add_argument("--salvar-palavras", metavar="PASTA",
+                        help="Grava as palavras do OCR de cada documento para uso com main.py replay")
+    parser.add_argument("--uma-vez", action="store_true", help="Processa os arquivos disponíveis e encerra")
+    args = parser.parse_args(argv)
+
+    folders = {doc_type: getattr(args, doc_type) for doc_type in DEFAULT_FOLDERS if getattr(args, doc_type)}
+    folders = folders or dict(DEFAULT_FOLDERS)
+
+    options = {"skew_mode": args.skew_mode}
+    if args.recortar:
+        options["crop"] = True
+    if args.templates:
+        options["templates"] = load_templates(args.templates)
+    if args.salvar_palavras:
+        options["words_dir"] = args.salvar_palavras
+    cache = OcrCache(args.cache) if args.cache else None
+    # Parquet em um arquivo por lote: o checkpoint só pode marcar arquivos cujos resultados já estão legíveis
+    writer = ResultWriter(args.resultados, args.parquet_linhas, parquet_parts=True)
+
+    # Os registros de métricas de cada lote dão os tempos por estágio de cada documento nos resultados
+    metrics.enable(collect=True)
+
+    model = load_ocr_model(**model_options(args))
+    fast_options = cascade_model_options(args)
+    if fast_options is not None:
+        options["fast_model"] = load_ocr_model(**fast_options)
+        options["min_confidence"] = args.limiar_cascata
+    print(f"Monitorando: {', '.join(f'{doc_type} ({folder})' for doc_type, folder in folders.items())}")
+    try:
+        watch(model, folders, args.checkpoint, writer, args.intervalo, args.batch_size, args.uma_vez,
+              args.espera_par, args.tentativas, cache=cache, **options)
+    except KeyboardInterrupt:
+        # O checkpoint já foi gravado ao final do último lote concluído
+        print("Monitoramento encerrado.")
+    finally:
+        if fast_options is not None:
+            print(report_cascade_stats())
+        writer.close()
+        metrics.disable()
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == "__main__":
+    main()